@@ -0,0 +1,183 @@
+# Script to benchmark the checker and the scanner against the local synthetic streams
+# Please read the manual (run the script with -h parameter)
+#
+# author: Yuri Ponomarev
+# Github: https://github.com/ponwork/
+
+import argparse
+import time
+import ipaddress
+import os
+import platform
+import re
+import subprocess
+import json
+import tempfile
+import sys
+
+# Setup the command line argument parsing
+parser = argparse.ArgumentParser(description='Script to benchmark the IPTV UDP checker and scanner with the local multicast generator')
+
+parser.add_argument("--channels",       help="Number of the channels to send",                  required=False, default=100)
+parser.add_argument("--group",          help="Multicast group of the first channel",            required=False, default='239.255.0.1')
+parser.add_argument("--port",           help="UDP port of the channels",                        required=False, default=1234)
+parser.add_argument("--nic",            help="network interface IP address with UDP stream",    required=False, default='0.0.0.0')
+parser.add_argument("--bitrate",        help="Bitrate of each channel in kbps",                 required=False, default=500)
+parser.add_argument("--dead",           help="Channels in the playlist that are never sent",    required=False, default=10)
+parser.add_argument("--late",           help="Channels that start to be sent later",            required=False, default=0)
+parser.add_argument("--lossy",          help="Channels that lose the datagrams",                required=False, default=5)
+parser.add_argument("--unnamed",        help="Channels sent without the SDT (no service_name)", required=False, default=0)
+parser.add_argument("--udp_timeout",    help="Time to wait in seconds for the UPD port reply",  required=False, default=2)
+parser.add_argument("--info_timeout",   help="Time to wait in seconds for the stream's info",   required=False, default=5)
+parser.add_argument("--scenarios",      help="Scenarios to run (space separated)",              required=False, nargs='+',
+                    default=['checker-loop', 'checker-threads', 'scanner-multiplex', 'scanner-sequential'],
+                    choices=['checker-loop', 'checker-threads', 'checker-metrics', 'scanner-multiplex', 'scanner-sequential'])
+parser.add_argument("--repeat",         help="Runs of each scenario",                           required=False, default=1)
+parser.add_argument("--results",        help="NDJSON file to append the results to",            required=False)
+
+# The scripts are next to the benchmark
+scripts_path = os.path.dirname(os.path.realpath(__file__))
+
+# ================
+# Define functions
+# ================
+
+def generator_start(playlist):
+    """ Start the multicast generator and wait till it writes the playlist """
+
+    command = [sys.executable, os.path.join(scripts_path, 'multicast-generator.py'), '--channels', str(args.channels),
+               '--group', args.group, '--port', str(args.port), '--nic', args.nic, '--bitrate', str(args.bitrate),
+               '--dead', str(args.dead), '--late', str(args.late), '--lossy', str(args.lossy), '--unnamed', str(args.unnamed),
+               '--playlist', playlist]
+    generator = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 10
+    while not os.path.isfile(playlist) and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    # Let the streams settle
+    time.sleep(1)
+
+    return generator
+
+def scan_range():
+    """ Get the smallest network with all the generated groups """
+
+    first = ipaddress.IPv4Address(args.group)
+    last = first + int(args.channels) - 1
+    prefix = 32
+    while ipaddress.IPv4Network(f'{first}/{prefix}', strict=False).broadcast_address < last:
+        prefix -= 1
+
+    return str(ipaddress.IPv4Network(f'{first}/{prefix}', strict=False))
+
+def scenario_command(scenario, playlist, records):
+    """ Get the command line of the scenario (the checker streams its records to the NDJSON file) """
+
+    timeouts = ['--nic', args.nic, '--udp_timeout', str(args.udp_timeout), '--info_timeout', str(args.info_timeout)]
+    if scenario.startswith('checker'):
+        timeouts += ['--json', records]
+
+    if scenario == 'checker-loop':
+        return [sys.executable, os.path.join(scripts_path, 'multicast-checker.py'), '--playlist', playlist, '--engine', 'loop'] + timeouts
+    if scenario == 'checker-threads':
+        return [sys.executable, os.path.join(scripts_path, 'multicast-checker.py'), '--playlist', playlist, '--engine', 'threads'] + timeouts
+    if scenario == 'checker-metrics':
+        return [sys.executable, os.path.join(scripts_path, 'multicast-checker.py'), '--playlist', playlist, '--metrics', '2', '--pcr'] + timeouts
+
+    mode = scenario.split('-')[1]
+    return [sys.executable, os.path.join(scripts_path, 'multicast-scanner.py'), '--range', scan_range(), '--port', str(args.port),
+            '--mode', mode, '--sample_sec', '1'] + timeouts
+
+def percentile(values, percent):
+    """ Get the nearest-rank percentile of the sorted values """
+
+    return values[max(0, -(-len(values) * percent // 100) - 1)] if values else 0
+
+def scenario_run(scenario, playlist):
+    """ Run the scenario: the wall time, the CPU time and the maximum RSS of the script, the channels' latencies """
+
+    descriptor, records = tempfile.mkstemp(prefix='multicast-benchmark', suffix='.json')
+    os.close(descriptor)
+    command = scenario_command(scenario, playlist, records)
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, cwd=scripts_path)
+    output = process.stdout.read()
+
+    # The resources used by this child only
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+
+    # The maximum RSS is in kilobytes on Linux and in bytes on MacOS
+    rss = usage.ru_maxrss / 1024 if platform.system() != 'Darwin' else usage.ru_maxrss / 1024 / 1024
+
+    result = {'scenario': scenario, 'channels': int(args.channels), 'bitrate': float(args.bitrate), 'wall': round(wall, 3),
+              'cpu': round(usage.ru_utime + usage.ru_stime, 3), 'rss_mb': round(rss, 1), 'exit': process.returncode}
+
+    if scenario.startswith('checker'):
+
+        # The latencies of the working channels from the checker's NDJSON records
+        with open(records) as file:
+            working = [record for record in map(json.loads, filter(str.strip, file)) if record['status'] in ('ok', 'degraded')]
+        latencies = sorted(record['latency_ms'] for record in working)
+        firsts = sorted(record['first_packet_ms'] for record in working if record['first_packet_ms'] is not None)
+        result['found'] = len(latencies)
+        result['latency_p50'] = percentile(latencies, 50)
+        result['latency_p90'] = percentile(latencies, 90)
+        result['latency_max'] = latencies[-1] if latencies else 0
+        result['first_packet_p50'] = percentile(firsts, 50)
+        result['first_packet_p90'] = percentile(firsts, 90)
+
+    else:
+        found = re.search(r'Channels found: (\d+)', output)
+        result['found'] = int(found.group(1)) if found else 0
+
+        # Remove the resulting playlist of the scanner
+        resulting = re.search(r'Resulting file: (.+)', output)
+        if resulting and os.path.isfile(resulting.group(1).strip()):
+            os.remove(resulting.group(1).strip())
+
+    os.remove(records)
+
+    return result
+
+# ================
+# End of functions
+# ================
+
+# Define the script arguments as a <args> variable
+args = parser.parse_args()
+
+playlist = os.path.join(scripts_path, 'benchmark_playlist.m3u')
+if os.path.isfile(playlist):
+    os.remove(playlist)
+
+alive = int(args.channels) - int(args.dead)
+print(f'[*] Channels: {args.channels} ({alive} sent, {args.dead} dead, {args.lossy} lossy) at {args.bitrate} kbps each')
+print(f"[*] Scenarios: {', '.join(args.scenarios)} x {args.repeat}\n")
+
+generator = generator_start(playlist)
+
+try:
+
+    print(f'{"scenario":<20}{"wall, s":>10}{"CPU, s":>10}{"RSS, MB":>10}{"found":>8}{"p50, ms":>10}{"p90, ms":>10}{"max, ms":>10}')
+    for scenario in args.scenarios:
+        for run in range(int(args.repeat)):
+            result = scenario_run(scenario, playlist)
+            print(f'{scenario:<20}{result["wall"]:>10,.2f}{result["cpu"]:>10,.2f}{result["rss_mb"]:>10,.1f}{result["found"]:>8}'
+                  f'{result.get("latency_p50", "-"):>10}{result.get("latency_p90", "-"):>10}{result.get("latency_max", "-"):>10}')
+
+            if args.results:
+                result['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+                with open(args.results, 'a') as file:
+                    file.write(json.dumps(result) + '\n')
+
+except KeyboardInterrupt:
+    print('\n[*] Script has been closed!')
+
+finally:
+    generator.terminate()
+    generator.wait()
+    os.remove(playlist)
@@ -10,26 +10,63 @@ import time
 import socket
 import struct
 import select
+import selectors
+import heapq
+import collections
+import itertools
+import threading
 import json
+import sqlite3
 import re
 import os
 import platform
 import subprocess
 import sys
 import smtplib
+import http.server
+import tempfile
+import errno
 from email.mime.text import MIMEText
 
 # Setup the command line argument parsing
 parser = argparse.ArgumentParser(description='Script to check the IPTV UDP streams from m3u playlist')
 
-parser.add_argument("--playlist",       help="Playlist *.m3u file with UDP streams",            required=True)
-parser.add_argument("--nic",            help="network interface IP address with UDP stream",    required=False, default='0.0.0.0')
+parser.add_argument("--playlist",       help="Playlist *.m3u file(s) with UDP streams (space separated)", required=True, nargs='+')
+parser.add_argument("--nic",            help="network interface IP address(es) with UDP stream (space separated)", required=False, default=['0.0.0.0'], nargs='+')
+parser.add_argument("--processes",      help="Shard processes to check the playlist. Default: one per --nic", required=False, default=0)
+parser.add_argument("--shard",          help=argparse.SUPPRESS,                                 required=False)
 parser.add_argument("--udp_timeout",    help="Time to wait in seconds for the UPD port reply",  required=False, default=5)
 parser.add_argument("--info_timeout",   help="Time to wait in seconds for the stream's info",   required=False, default=10)
 parser.add_argument("--smtp_server",    help="SMTP server to send an email",                    required=False)
 parser.add_argument("--smtp_port",      help="Port for SMTP server",                            required=False, default=25)
 parser.add_argument("--sender",         help="email address for email sender",                  required=False)
 parser.add_argument("--receivers",      help="emails of the receivers (space separated)",       required=False, nargs='+')
+parser.add_argument("--ffprobe",        help="use ffprobe if no stream's info found natively",  required=False, action='store_true')
+parser.add_argument("--cache",          help="SQLite file to cache the channels' states and info", required=False)
+parser.add_argument("--cache_ttl",      help="Seconds to reuse the cached info of alive channels", required=False, default=3600)
+parser.add_argument("--cache_dead_ttl", help="Seconds to trust the cached dead channels",       required=False, default=600)
+parser.add_argument("--cache_max_age",  help="Seconds to keep the cache entries before eviction", required=False, default=604800)
+parser.add_argument("--daemon",         help="monitor the channels continuously, alert on state changes", required=False, action='store_true')
+parser.add_argument("--degraded_after", help="Seconds of silence to mark the channel degraded (daemon)", required=False, default=1)
+parser.add_argument("--down_after",     help="Seconds of silence to mark the channel down (daemon)", required=False, default=5)
+parser.add_argument("--metrics",        help="Seconds to measure the TS health of working channels (daemon: window)", required=False, default=0)
+parser.add_argument("--max_loss",       help="Packet loss %% to mark the channel degraded",    required=False, default=0.1)
+parser.add_argument("--min_bitrate",    help="Bitrate in kbps to mark the channel degraded",   required=False, default=0)
+parser.add_argument("--pcr",            help="check level: analyze the PCR timing of the programs", required=False, action='store_true')
+parser.add_argument("--max_pcr_interval", help="PCR interval in ms to mark the channel degraded", required=False, default=40)
+parser.add_argument("--max_pcr_jitter", help="PCR jitter in ms to mark the channel degraded. Default: no limit", required=False, default=0)
+parser.add_argument("--zap",            help="measure the zap time: join to the first packet, PAT/PMT and keyframe", required=False, action='store_true')
+parser.add_argument("--exporter",       help="port of the Prometheus metrics endpoint (/metrics)", required=False)
+parser.add_argument("--interval",       help="repeat the check every N seconds. Default: once", required=False, default=0)
+parser.add_argument("--profile",        help="print the time spent in each stage of the check", required=False, action='store_true')
+parser.add_argument("--profile_dump",   help="NDJSON file to write the raw stage timings to",  required=False)
+parser.add_argument("--json",           help="NDJSON file to stream the channels' results to", required=False)
+parser.add_argument("--adaptive",       help="learn the channels' timeouts from their history in the --cache", required=False, action='store_true')
+parser.add_argument("--adaptive_margin", help="Margin of the learned timeouts over the p99 latency", required=False, default=3)
+parser.add_argument("--tier",           help="check tier <group-title or playlist>:<interval>[:<timeout>[:<depth>]], repeatable", required=False, action='append')
+parser.add_argument("--concurrency",    help="Channels checked at once by the tiers' scheduler", required=False, default=64)
+parser.add_argument("--joins",          help="Groups joined per second by the tiers' scheduler. Default: no limit", required=False, default=0)
+parser.add_argument("--engine",         help="check engine: one event loop or thread per channel", required=False, default='loop', choices=['loop', 'threads'])
 
 # ================
 # Define functions
@@ -41,10 +78,11 @@ def get_ffprobe(address, port):
     global args
 
     # Run the ffprobe with given IP and PORT with a given timeout to execute
+    started = time.perf_counter()
     try:
         
         # Capture the output from ffprobe
-        result = subprocess.run(['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_programs', f'udp://@{address}:{port}'], capture_output=True, text=True, timeout=args.info_timeout)
+        result = subprocess.run(['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_programs', f'udp://@{address}:{port}'], capture_output=True, text=True, timeout=float(args.info_timeout))
         
         # Convert the STDOUT to JSON
         json_string = json.loads(str(result.stdout))
@@ -52,7 +90,15 @@ def get_ffprobe(address, port):
     except:
         print(f'[*] No data found for {address}:{port}')
         return 0
+
+    finally:
+        profile_add('ffprobe', address, port, time.perf_counter() - started)
     
+    return programs_parser(json_string, address, port)
+
+def programs_parser(json_string, address, port):
+    """ To get the channel name from the ffprobe-like json data """
+
     # Parse the JSON "PROGRAMS" section
     for program in json_string['programs']:
         
@@ -80,44 +126,1063 @@ def get_ffprobe(address, port):
                 print(f'[*] No stream found for {address}:{port}')
                 return 0
 
-def playlist_parser(playlist):
-    """ Function that returns a dictionary of UDP streams """
-    
-    # Defining the variables
-    channel_name = ''
-    channel_address = ''
+    print(f'[*] No data found for {address}:{port}')
+    return 0
+
+# MPEG-TS stream types (ISO/IEC 13818-1 and ATSC A/52) in the ffprobe's naming
+ts_stream_types = {
+    0x01: ('video', 'mpeg1video'),
+    0x02: ('video', 'mpeg2video'),
+    0x03: ('audio', 'mp2'),
+    0x04: ('audio', 'mp2'),
+    0x06: ('data', 'private'),
+    0x0F: ('audio', 'aac'),
+    0x10: ('video', 'mpeg4'),
+    0x11: ('audio', 'aac_latm'),
+    0x1B: ('video', 'h264'),
+    0x24: ('video', 'hevc'),
+    0x81: ('audio', 'ac3'),
+    0x87: ('audio', 'eac3'),
+}
+
+# The PCR base is a 33 bits counter of the 90 kHz clock
+ts_pcr_modulus = (1 << 33) * 300
+
+def ts_crc_table_creator():
+    """ Create the CRC32/MPEG-2 lookup table for the PSI/SI sections """
+
+    table = []
+    for index in range(256):
+        crc = index << 24
+        for bit in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+
+    return table
+
+ts_crc_table = ts_crc_table_creator()
+
+def ts_crc32(data):
+    """ Calculate the CRC32/MPEG-2 of the given section """
+
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ ts_crc_table[(crc >> 24) ^ byte]
+
+    return crc
+
+# The character tables of the DVB SI text strings by their first byte (ETSI EN 300 468 Annex A):
+# 0x01-0x0B are ISO/IEC 8859-5 to 8859-15 (no 8859-12), 0x10 0x00 NN is ISO/IEC 8859-NN
+ts_text_tables = {index: f'iso8859-{index + 4}' for index in range(0x01, 0x0C) if index != 0x08}
+ts_text_tables.update({0x11: 'utf-16-be', 0x12: 'euc-kr', 0x13: 'gb2312', 0x14: 'big5', 0x15: 'utf-8'})
+
+def ts_text(data):
+    """ Decode the DVB SI text string (ETSI EN 300 468 Annex A) """
+
+    if not data:
+        return ''
+
+    # The character table selection bytes
+    codec = None
+    if data[0] == 0x10 and len(data) >= 3:
+        codec, data = f'iso8859-{data[2]}', data[3:]
+    elif data[0] == 0x1F:
+        data = data[2:]
+    elif data[0] < 0x20:
+        codec, data = ts_text_tables.get(data[0]), data[1:]
+
+    if codec is not None:
+        try:
+            return data.decode(codec)
+        except (LookupError, UnicodeDecodeError):
+            pass
+
+    # The default table (ISO/IEC 6937) is decoded as UTF-8 or Latin-1
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+def ts_demuxer():
+    """ Create a state of the MPEG-TS demuxer """
+
+    return {
+        'pat': None,            # program_number -> PMT PID
+        'pmt': {},              # program_number -> PMT data
+        'sdt': None,            # service_id -> (provider, service name)
+        'sections': {},         # PID -> buffer of the incomplete section
+        'packets': 0,           # number of TS packets demuxed
+        'psi_time': None,       # time when the PAT and all the PMTs were received
+    }
+
+def ts_section_parser(demuxer, section):
+    """ Parse the complete PAT, PMT or SDT section """
+
+    # Drop the broken sections
+    if ts_crc32(section) != 0:
+        return
+
+    table_id = section[0]
+    section_end = len(section) - 4
+
+    # Program Association Table
+    if table_id == 0x00:
+        pat = demuxer['pat'] or {}
+        for offset in range(8, section_end, 4):
+            program_number = (section[offset] << 8) | section[offset + 1]
+            pid = ((section[offset + 2] & 0x1F) << 8) | section[offset + 3]
+            if program_number != 0:
+                pat[program_number] = pid
+        demuxer['pat'] = pat
+
+    # Program Map Table
+    elif table_id == 0x02:
+        program_number = (section[3] << 8) | section[4]
+        pcr_pid = ((section[8] & 0x1F) << 8) | section[9]
+        offset = 12 + (((section[10] & 0x0F) << 8) | section[11])
+        streams = []
+        while offset + 5 <= section_end:
+            stream_type = section[offset]
+            pid = ((section[offset + 1] & 0x1F) << 8) | section[offset + 2]
+            streams.append((pid, stream_type))
+            offset += 5 + (((section[offset + 3] & 0x0F) << 8) | section[offset + 4])
+        demuxer['pmt'][program_number] = {'pcr_pid': pcr_pid, 'streams': streams}
+
+    # Service Description Table (actual transport stream)
+    elif table_id == 0x42:
+        sdt = demuxer['sdt'] or {}
+        offset = 11
+        while offset + 5 <= section_end:
+            service_id = (section[offset] << 8) | section[offset + 1]
+            descriptors_end = min(section_end, offset + 5 + (((section[offset + 3] & 0x0F) << 8) | section[offset + 4]))
+            offset += 5
+            while offset + 2 <= descriptors_end:
+                tag, length = section[offset], section[offset + 1]
+                descriptor_end = offset + 2 + length
+                if descriptor_end > descriptors_end:
+                    break
+
+                # Service descriptor: the type, the provider and the name (skipped if their lengths overrun it)
+                if tag == 0x48 and length >= 3:
+                    provider_end = offset + 4 + section[offset + 3]
+                    name_end = provider_end + 1 + section[provider_end] if provider_end < descriptor_end else descriptor_end + 1
+                    if name_end <= descriptor_end:
+                        provider = section[offset + 4:provider_end]
+                        name = section[provider_end + 1:name_end]
+                        sdt[service_id] = (ts_text(bytes(provider)), ts_text(bytes(name)))
+                offset = descriptor_end
+            offset = descriptors_end
+        demuxer['sdt'] = sdt
+
+def ts_demux(demuxer, data):
+    """ Feed the datagram of 188-bytes TS packets to the demuxer """
+
+    pat = demuxer['pat'] or {}
+    psi_pids = {0x0000, 0x0011} | set(pat.values())
+    sections = demuxer['sections']
+
+    for offset in range(0, len(data) - 187, 188):
+
+        # Check the sync byte
+        if data[offset] != 0x47:
+            continue
+
+        demuxer['packets'] += 1
+        pid = ((data[offset + 1] & 0x1F) << 8) | data[offset + 2]
+        if pid not in psi_pids:
+            continue
+
+        # Skip the adaptation field and the packets without payload
+        adaptation = (data[offset + 3] >> 4) & 0x03
+        if adaptation == 0x02 or adaptation == 0x00:
+            continue
+        start = offset + 4
+        if adaptation == 0x03:
+            start += 1 + data[start]
+        payload = data[start:offset + 188]
+        if not payload:
+            continue
+
+        # Payload unit start: finish the previous section and start the new one
+        if data[offset + 1] & 0x40:
+            pointer = payload[0]
+            if pid in sections:
+                sections[pid] += payload[1:1 + pointer]
+                ts_sections_flush(demuxer, pid)
+            sections[pid] = bytearray(payload[1 + pointer:])
+        elif pid in sections:
+            sections[pid] += payload
+        else:
+            continue
+
+        ts_sections_flush(demuxer, pid)
+
+        # The PAT could bring the new PMT PIDs
+        if pid == 0x0000 and demuxer['pat']:
+            psi_pids |= set(demuxer['pat'].values())
+
+def ts_sections_flush(demuxer, pid):
+    """ Parse all the complete sections buffered for the given PID """
+
+    buffer = demuxer['sections'][pid]
+    while len(buffer) >= 3 and buffer[0] != 0xFF:
+        section_length = 3 + (((buffer[1] & 0x0F) << 8) | buffer[2])
+        if len(buffer) < section_length:
+            break
+        ts_section_parser(demuxer, buffer[:section_length])
+        del buffer[:section_length]
+
+    # Stuffing bytes till the end of the packet
+    if buffer[:1] == b'\xff':
+        buffer.clear()
+
+def ts_demuxer_ready(demuxer, with_sdt=True):
+    """ Check that the PAT, all the PMTs and the SDT were received """
+
+    if not demuxer['pat']:
+        return False
+    if not all(program in demuxer['pmt'] for program in demuxer['pat']):
+        return False
+    if with_sdt and demuxer['sdt'] is None:
+        return False
+
+    return True
+
+def ts_demuxer_deadline(demuxer, deadline):
+    """ Get the time till the demuxer needs the data, not later than the given deadline """
+
+    # The SDT is repeated at least every 2 seconds (ETSI TR 101 290), so don't wait longer for it
+    if demuxer['psi_time'] is None and ts_demuxer_ready(demuxer, with_sdt=False):
+        demuxer['psi_time'] = time.monotonic()
+    if demuxer['psi_time'] is not None:
+        deadline = min(deadline, demuxer['psi_time'] + 2)
+
+    return deadline
+
+def ts_info_deadline(demuxer, zap, now, deadline):
+    """ Get the time to stop reading the stream's info (and the zap time), not later than the given deadline """
+
+    # The keyframe is waited for till the timeout
+    if zap is not None and zap['keyframe'] is None:
+        return deadline
+    if ts_demuxer_ready(demuxer):
+        return now
+
+    return ts_demuxer_deadline(demuxer, deadline)
+
+def ts_zap(join):
+    """ Create a state of the zap time measurement from the time of the join """
+
+    return {
+        'join': join,           # time of the IP_ADD_MEMBERSHIP
+        'packet': None,         # time of the first datagram
+        'pat': None,            # time of the first PAT
+        'pmt': None,            # time when all the PMTs were received
+        'keyframe': None,       # time of the first random access point after the PMTs
+    }
+
+def ts_zap_update(zap, demuxer, data, now):
+    """ Record the times of the zap stages reached with the demuxed datagram """
+
+    if zap['packet'] is None:
+        zap['packet'] = now
+    if zap['pat'] is None and demuxer['pat']:
+        zap['pat'] = now
+    if zap['pmt'] is None and ts_demuxer_ready(demuxer, with_sdt=False):
+        zap['pmt'] = now
+
+    # The picture is decodable only when the PMT is known
+    if zap['keyframe'] is None and zap['pmt'] is not None and ts_keyframe(demuxer, data):
+        zap['keyframe'] = now
+
+def ts_keyframe(demuxer, data):
+    """ Check if the datagram has a random access point of the video streams """
+
+    video = {}
+    for pmt in demuxer['pmt'].values():
+        for pid, stream_type in pmt['streams']:
+            if ts_stream_types.get(stream_type, ('unknown',))[0] == 'video':
+                video[pid] = stream_type
+
+    for offset in range(0, len(data) - 187, 188):
+        pid = ((data[offset + 1] & 0x1F) << 8) | data[offset + 2]
+        if data[offset] != 0x47 or pid not in video:
+            continue
+
+        # The random_access_indicator of the adaptation field
+        adaptation = (data[offset + 3] >> 4) & 0x03
+        start = offset + 4
+        if adaptation & 0x02:
+            if data[start] and data[start + 1] & 0x40:
+                return True
+            start += 1 + data[start]
+
+        # The start of the PES: look for the IDR picture (H.264/HEVC) or the sequence header (MPEG-2)
+        if not data[offset + 1] & 0x40 or not adaptation & 0x01:
+            continue
+        payload = bytes(data[start:offset + 188])
+        stream_type = video[pid]
+        index = payload.find(b'\x00\x00\x01', 9)
+        while 0 <= index < len(payload) - 3:
+            code = payload[index + 3]
+            if stream_type == 0x1b and code & 0x1F == 5:
+                return True
+            if stream_type == 0x24 and 16 <= (code >> 1) & 0x3F <= 21:
+                return True
+            if stream_type in (0x01, 0x02) and code == 0xB3:
+                return True
+            index = payload.find(b'\x00\x00\x01', index + 3)
+
+    return False
+
+def profile_add(stage, address, port, seconds):
+    """ Record the time of the stage for the channel (no lock: the list append is atomic) """
+
+    if profile is not None:
+        profile.append((stage, f'{address}:{port}', seconds))
+
+def profile_report(names):
+    """ Print the time spent in each stage: totals, percentiles and the slowest channels (--profile), dump the raw timings """
+
+    # The report of the --profile (the --profile_dump alone writes the raw timings only)
+    if args.profile:
+        stages = {}
+        for stage, channel, seconds in profile:
+            stages.setdefault(stage, []).append(seconds)
+
+        print(f'\n[*] Profile of {len(profile):,} timing(s):')
+        print(f'[*] {"stage":<14}{"count":>8}{"total, s":>12}{"p50, ms":>10}{"p90, ms":>10}{"p99, ms":>10}{"max, ms":>10}')
+        for stage, values in stages.items():
+            values.sort()
+            print(f'[*] {stage:<14}{len(values):>8,}{sum(values):>12,.3f}' + ''.join(f'{percentile(values, percent) * 1000:>10,.1f}' for percent in (50, 90, 99)) + f'{values[-1] * 1000:>10,.1f}')
+
+        slowest = sorted((item for item in profile if item[0] == 'check'), key=lambda item: item[2], reverse=True)[:10]
+        if slowest:
+            print(f'[*] Slowest channels:')
+            for stage, channel, seconds in slowest:
+                print(f'[*] {seconds * 1000:>10,.1f} ms >>> {channel} - {names.get(channel, "")}')
+
+    # The raw timings for the offline analysis
+    if args.profile_dump:
+        with open(args.profile_dump, 'a') as file:
+            for stage, channel, seconds in profile:
+                file.write(json.dumps({'stage': stage, 'channel': channel, 'name': names.get(channel, ''), 'seconds': round(seconds, 6)}) + '\n')
+        print(f'[*] Raw timings: {args.profile_dump}')
+
+def percentile(values, percent):
+    """ Get the nearest-rank percentile of the sorted values """
+
+    return values[max(0, -(-len(values) * percent // 100) - 1)]
+
+def zap_summary():
+    """ Print the percentiles of the zap time stages across the playlist """
+
+    print(f'\n[*] Zap time of {len(zap_times)} working channel(s) since the join:')
+    for stage, name in (('packet', 'First packet'), ('pat', 'First PAT'), ('pmt', 'First PMT'), ('keyframe', 'Keyframe')):
+        values = sorted(round((zap[stage] - zap['join']) * 1000) for zap in zap_times if zap[stage] is not None)
+        if not values:
+            print(f'[*] {name:<13}>>> not found')
+            continue
+        percentiles = ', '.join(f'p{percent} {percentile(values, percent):,} ms' for percent in (50, 90, 99))
+        missing = f' >>> not found for {len(zap_times) - len(values)} channel(s)' if len(values) < len(zap_times) else ''
+        print(f'[*] {name:<13}>>> {percentiles}, max {values[-1]:,} ms{missing}')
+
+def ts_demuxer_programs(demuxer):
+    """ Convert the demuxer state to the ffprobe's '-show_programs' json format """
+
+    programs = []
+    index = 0
+    sdt = demuxer['sdt'] or {}
+
+    for program_number, pmt_pid in sorted((demuxer['pat'] or {}).items()):
+        pmt = demuxer['pmt'].get(program_number)
+        if pmt is None:
+            continue
+
+        streams = []
+        for pid, stream_type in pmt['streams']:
+            codec_type, codec_name = ts_stream_types.get(stream_type, ('unknown', 'unknown'))
+            streams.append({'index': index, 'codec_name': codec_name, 'codec_type': codec_type, 'id': f'0x{pid:x}', 'stream_type': f'0x{stream_type:02x}'})
+            index += 1
+
+        program = {'program_id': program_number, 'program_num': program_number, 'nb_streams': len(streams), 'pmt_pid': pmt_pid, 'pcr_pid': pmt['pcr_pid'], 'tags': {}, 'streams': streams}
+        if program_number in sdt:
+            program['tags'] = {'service_name': sdt[program_number][1], 'service_provider': sdt[program_number][0]}
+        programs.append(program)
+
+    return {'programs': programs}
+
+def get_ts_info(sock, analyzer=None, zap=None, timeout=None, timing=None, rtp=None):
+    """ To get the json data from the joined socket using the built-in MPEG-TS demuxer (the RTP header is removed) """
+
+    global args
+
+    demuxer = ts_demuxer()
+    rtp = rtp if rtp is not None else rtp_receiver()
+    started = time.monotonic()
+
+    # The datagrams are received into one reusable buffer, nothing is accumulated
+    buffer = bytearray(65536)
+    view = memoryview(buffer)
+
+    # Read the datagrams till the PSI/SI tables are complete or the timeout is reached
+    # and till the end of the health measurement if the analyzer is given
+    deadline = time.monotonic() + (timeout if timeout is not None else float(args.info_timeout))
+    metrics_end = time.monotonic() + float(args.metrics) if analyzer is not None else 0
+    try:
+        while True:
+            now = time.monotonic()
+            info_deadline = ts_info_deadline(demuxer, zap, now, deadline)
+            remaining = max(info_deadline, metrics_end) - now
+            if remaining <= 0:
+                break
+            ready = select.select([sock], [], [], remaining)
+            if not ready[0]:
+                break
+            size = sock.recv_into(buffer)
+            data = rtp_strip(rtp, view[:size], time.monotonic())
+            ts_demux(demuxer, data)
+            if analyzer is not None:
+                ts_analyze(analyzer, data, time.monotonic())
+            if zap is not None:
+                ts_zap_update(zap, demuxer, data, time.monotonic())
+
+            # The time till the tables are complete (the history of the adaptive timeouts)
+            if timing is not None and 'ready' not in timing and ts_demuxer_ready(demuxer):
+                timing['ready'] = time.monotonic() - started
+    finally:
+        sock.close()
+
+    return ts_demuxer_programs(demuxer)
+
+def ts_analyzer():
+    """ Create a state of the MPEG-TS health analyzer """
+
+    return {
+        'continuity': {},       # PID -> last continuity counter (| 0x10 once repeated)
+        'cc_errors': {},        # PID -> number of continuity errors
+        'buckets': collections.deque(),  # [second, bytes, packets, lost packets, CC errors, max gap] per second
+        'start': None,          # time of the first datagram
+        'last': None,           # time of the last datagram
+        'position': 0,          # bytes of the TS packets received and lost (the CC gaps)
+        'pcr': {} if args.pcr else None,  # PCR PID -> PCR timing state (the PCR check level only)
+        'rtp': rtp_receiver(),  # RTP sequence and jitter per SSRC (the RTP streams only)
+    }
+
+# The sequence number jumps (RFC 3550 A.1): up to 3000 ahead are the lost datagrams, up to 100 behind
+# are the reordered ones, the others are the stray datagrams or the restart of the sender (resynced)
+rtp_max_dropout = 3000
+rtp_max_misorder = 100
+
+# The senders (SSRCs) tracked per group: the one silent for the longest time is evicted over the limit
+rtp_max_ssrc = 8
+
+def rtp_receiver():
+    """ Create a state of the RTP receiver statistics """
+
+    return {
+        'ssrc': {},             # SSRC -> highest sequence number, transit time, jitter, last datagram time
+        'buckets': collections.deque(),  # [second, received, expected, reordered, duplicates] per second
+        'missing': 0,           # datagrams missing since the start (the late ones fill the gaps)
+        'lost': 0,              # the most datagrams missing since the start (never decreases: the counter)
+    }
+
+def rtp_strip(rtp, data, now):
+    """ Get the payload of the RTP datagram (the TS datagram as is), count its sequence and jitter per SSRC """
+
+    # The TS datagram starts with the sync byte, the RTP header with the version 2
+    if len(data) < 12 or data[0] >> 6 != 2:
+        return data
+
+    # The fixed header, the CSRCs, the extension and the padding
+    header = 12 + (data[0] & 0x0F) * 4
+    if data[0] & 0x10:
+        if len(data) < header + 4:
+            return data[:0]
+        header += 4 + int.from_bytes(data[header + 2:header + 4], 'big') * 4
+    end = len(data) - (data[-1] if data[0] & 0x20 else 0)
+    if header > end:
+        return data[:0]
+
+    sequence = int.from_bytes(data[2:4], 'big')
+    timestamp = int.from_bytes(data[4:8], 'big')
+    ssrc = int.from_bytes(data[8:12], 'big')
+
+    # The datagrams expected by the highest sequence number, the late and the repeated ones (per SSRC)
+    expected = 1
+    reordered = duplicates = 0
+    state = rtp['ssrc'].get(ssrc)
+    if state is None:
+        if len(rtp['ssrc']) >= rtp_max_ssrc:
+            del rtp['ssrc'][min(rtp['ssrc'], key=lambda key: rtp['ssrc'][key]['seen'])]
+        state = rtp['ssrc'][ssrc] = {'sequence': sequence, 'transit': None, 'jitter': 0.0, 'bad': None, 'seen': now}
+    else:
+        delta = (sequence - state['sequence']) & 0xFFFF
+        if delta == 0:
+            expected = 0
+            duplicates = 1
+        elif delta < rtp_max_dropout:
+            expected = delta
+            state['sequence'] = sequence
+        elif delta <= 0x10000 - rtp_max_misorder:
+
+            # The large jump: the sender restarted if the next datagram follows it, no loss is counted
+            if sequence == state['bad']:
+                state['sequence'] = sequence
+                state['transit'] = None
+                state['bad'] = None
+            else:
+                state['bad'] = (sequence + 1) & 0xFFFF
+        else:
+            expected = 0
+            reordered = 1
+
+    # The interarrival jitter (RFC 3550): the difference of the transit times in the 90 kHz units smoothed by 1/16
+    transit = (int(now * 90000) - timestamp) & 0xFFFFFFFF
+    if state['transit'] is not None:
+        difference = (transit - state['transit']) & 0xFFFFFFFF
+        difference = min(difference, 0x100000000 - difference)
+        state['jitter'] += (difference - state['jitter']) / 16
+    state['transit'] = transit
+    state['seen'] = now
+
+    buckets = rtp['buckets']
+    second = int(now)
+    if not buckets or buckets[-1][0] != second:
+        buckets.append([second, 0, 0, 0, 0])
+    bucket = buckets[-1]
+    bucket[1] += 1
+    bucket[2] += expected
+    bucket[3] += reordered
+    bucket[4] += duplicates
+    rtp['missing'] += expected - 1 + duplicates
+    rtp['lost'] = max(rtp['lost'], rtp['missing'])
+
+    return data[header:end]
+
+def rtp_metrics(rtp, now, window):
+    """ Get the RTP loss, the reordered and the repeated datagrams over the sliding window and the worst jitter """
+
+    buckets = rtp['buckets']
+    while buckets and buckets[0][0] < int(now - window):
+        buckets.popleft()
+
+    received = sum(bucket[1] for bucket in buckets)
+    expected = sum(bucket[2] for bucket in buckets)
+    reordered = sum(bucket[3] for bucket in buckets)
+    duplicates = sum(bucket[4] for bucket in buckets)
+    lost = max(0, expected - (received - duplicates))
+    # The senders heard in the window, the worst jitter of them
+    senders = [state for state in rtp['ssrc'].values() if state['seen'] >= now - window] or list(rtp['ssrc'].values())
+    jitter = max((state['jitter'] for state in senders), default=0)
+
+    return {'rtp_ssrc': len(senders), 'rtp_lost': lost, 'rtp_loss': round(lost * 100 / expected, 3) if expected else 0,
+            'rtp_reordered': reordered, 'rtp_duplicates': duplicates, 'rtp_jitter': round(jitter / 90, 2)}
 
-    # Defininfg regular expression for strings
-    channel_name_re = re.compile(r'(?<=#EXTINF:2,)(.*)(?=$)')
-    channel_address_re = re.compile(r'(?<=@)(.*)(?=$)')
+def ts_analyze(analyzer, data, now):
+    """ Count the continuity errors, the lost packets and the bytes of the datagram """
+
+    count = len(data) // 188
+    data = data[:count * 188]
+    continuity = analyzer['continuity']
+    cc_errors = analyzer['cc_errors']
+    lost = 0
+    errors = 0
+
+    # The strided views of the TS headers and the adaptation field flags: no copies and no per-packet objects
+    for sync, pid_high, pid_low, flags, length, af_flags in zip(data[0::188], data[1::188], data[2::188],
+                                                                data[3::188], data[4::188], data[5::188]):
+
+        # Skip the lost sync and the null packets
+        if sync != 0x47:
+            continue
+        pid = ((pid_high & 0x1F) << 8) | pid_low
+        if pid == 0x1FFF:
+            continue
+
+        # The discontinuity indicator of the adaptation field: the counter may start anew
+        if flags & 0x20 and length and af_flags & 0x80:
+            continuity.pop(pid, None)
+
+        # The packets without payload do not increment the counter
+        if not flags & 0x10:
+            continue
+        counter = flags & 0x0F
+        last = continuity.get(pid)
+        continuity[pid] = counter
+        if last is None or counter == ((last & 0x0F) + 1) & 0x0F:
+            continue
+
+        # The duplicate packet (the same counter) is allowed once: the repeat is marked by the bit over the counter
+        if counter == last:
+            continuity[pid] = counter | 0x10
+            continue
+        cc_errors[pid] = cc_errors.get(pid, 0) + 1
+        errors += 1
+        if counter != last & 0x0F:
+            lost += (counter - last - 1) & 0x0F
+
+    # The lost packets are in the stream before the datagram: the PCR positions count their bytes too
+    analyzer['position'] += lost * 188
+    if analyzer['pcr'] is not None:
+        ts_pcr_analyze(analyzer, data, now)
+    analyzer['position'] += len(data)
+
+    # The gap since the previous datagram shows the bursty delivery
+    gap = now - analyzer['last'] if analyzer['last'] is not None else 0
+    if analyzer['start'] is None:
+        analyzer['start'] = now
+    analyzer['last'] = now
+
+    buckets = analyzer['buckets']
+    second = int(now)
+    if not buckets or buckets[-1][0] != second:
+        buckets.append([second, 0, 0, 0, 0, 0])
+    bucket = buckets[-1]
+    bucket[1] += len(data)
+    bucket[2] += count
+    bucket[3] += lost
+    bucket[4] += errors
+    bucket[5] = max(bucket[5], gap)
+
+def ts_pcr_analyze(analyzer, data, now):
+    """ Collect the PCR values of the datagram with their arrival time and byte position """
+
+    # Only the packets with the adaptation field and the PCR flag are looked at
+    for index, (flags, length, af_flags) in enumerate(zip(data[3::188], data[4::188], data[5::188])):
+        if not flags & 0x20 or length < 7 or not af_flags & 0x10:
+            continue
+        offset = index * 188
+        if data[offset] != 0x47:
+            continue
+        pid = ((data[offset + 1] & 0x1F) << 8) | data[offset + 2]
+
+        # 33 bits of the base (90 kHz), 6 reserved bits and 9 bits of the extension (27 MHz)
+        value = int.from_bytes(data[offset + 6:offset + 12], 'big')
+        pcr = (value >> 15) * 300 + (value & 0x1FF)
+
+        state = analyzer['pcr'].setdefault(pid, {'last': None, 'wraps': 0, 'samples': collections.deque()})
+        if state['last'] is not None and pcr < state['last']:
+
+            # The wrap of the 33 bits counter (~26.5 hours) or the discontinuity: start again
+            if state['last'] - pcr > ts_pcr_modulus // 2:
+                state['wraps'] += 1
+            else:
+                state['samples'].clear()
+        state['last'] = pcr
+
+        seconds = (state['wraps'] * ts_pcr_modulus + pcr) / 27000000
+        if state['samples'] and seconds - state['samples'][-1][1] > 1:
+            state['samples'].clear()
+        state['samples'].append((now, seconds, analyzer['position'] + offset))
+
+def ts_residuals(xs, ys):
+    """ Get the residuals of the least squares line fitted to the points """
+
+    count = len(xs)
+    mean_x = sum(xs) / count
+    mean_y = sum(ys) / count
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance if variance else 0
+
+    return [y - mean_y - slope * (x - mean_x) for x, y in zip(xs, ys)]
+
+def ts_pcr_metrics(analyzer, now, window):
+    """ Get the worst PCR interval, jitter and accuracy of the PCR PIDs over the sliding window """
+
+    interval = jitter = accuracy = 0
+    for state in analyzer['pcr'].values():
+        samples = state['samples']
+        while samples and samples[0][0] < now - window:
+            samples.popleft()
+        if len(samples) < 3:
+            continue
+        arrivals, values, positions = zip(*samples)
+
+        # The repetition of the PCR values
+        interval = max(interval, max(b - a for a, b in zip(values, values[1:])))
+
+        # The arrival time against the PCR clock with the clocks' drift removed (overall jitter, peak to peak)
+        offsets = ts_residuals(arrivals, [arrival - value for arrival, value in zip(arrivals, values)])
+        jitter = max(jitter, max(offsets) - min(offsets))
+
+        # The PCR value against the one expected by its byte position at the constant transport rate
+        errors = ts_residuals(positions, values)
+        accuracy = max(accuracy, max(abs(error) for error in errors))
+
+    return {'pcr_pids': len([state for state in analyzer['pcr'].values() if len(state['samples']) >= 3]),
+            'pcr_interval': round(interval * 1000, 1), 'pcr_jitter': round(jitter * 1000, 1),
+            'pcr_accuracy': round(accuracy * 1000000000)}
+
+def ts_metrics(analyzer, now, window):
+    """ Get the bitrate, the loss rate and the CC errors over the sliding window """
+
+    # Drop the buckets older than the window
+    buckets = analyzer['buckets']
+    while buckets and buckets[0][0] < int(now - window):
+        buckets.popleft()
+
+    size = sum(bucket[1] for bucket in buckets)
+    packets = sum(bucket[2] for bucket in buckets)
+    lost = sum(bucket[3] for bucket in buckets)
+    errors = sum(bucket[4] for bucket in buckets)
+    burst = max((bucket[5] for bucket in buckets), default=0)
+
+    # The oldest bucket counts from the start of its second
+    span = now - max(buckets[0][0], analyzer['start']) if buckets else 0
+    bitrate = round(size * 8 / span / 1000) if span > 0 else 0
+    loss = lost * 100 / (packets + lost) if packets + lost else 0
+
+    metrics = {'bitrate': bitrate, 'loss': loss, 'cc_errors': errors, 'packets': packets, 'burst': round(burst * 1000)}
+    if analyzer['pcr'] is not None:
+        metrics.update(ts_pcr_metrics(analyzer, now, window))
+    if analyzer['rtp']['ssrc']:
+        metrics.update(rtp_metrics(analyzer['rtp'], now, window))
+
+    return metrics
+
+def ts_degraded(metrics):
+    """ Get the reason to mark the channel degraded by the metrics thresholds or '' """
+
+    if metrics['loss'] > float(args.max_loss):
+        return f'loss {metrics["loss"]:.2f}%'
+    if metrics.get('rtp_loss', 0) > float(args.max_loss):
+        return f'RTP loss {metrics["rtp_loss"]:.2f}%'
+    if float(args.min_bitrate) and metrics['bitrate'] < float(args.min_bitrate):
+        return f'bitrate {metrics["bitrate"]:,} kbps'
+    if 'pcr_pids' in metrics:
+        if not metrics['pcr_pids']:
+            return 'no PCR'
+        if metrics['pcr_interval'] > float(args.max_pcr_interval):
+            return f'PCR interval {metrics["pcr_interval"]} ms'
+        if float(args.max_pcr_jitter) and metrics['pcr_jitter'] > float(args.max_pcr_jitter):
+            return f'PCR jitter {metrics["pcr_jitter"]} ms'
+
+    return ''
+
+def get_stream_info(sock, address, port, analyzer=None, zap=None, timeout=None, timing=None):
+    """ To get the channel name from the socket already joined to ip:port """
+
+    global args
+
+    # Use the built-in demuxer first and ffprobe as a fallback
+    # The socket is closed by the demuxer, so ffprobe joins the group again only in this case
+    # ffprobe is not used for the RTP streams: it would be given the udp:// URL
+    started = time.perf_counter()
+    rtp = analyzer['rtp'] if analyzer is not None else rtp_receiver()
+    programs = get_ts_info(sock, analyzer, zap, timeout, timing, rtp)
+    profile_add('info', address, port, time.perf_counter() - started)
+    info = programs_parser(programs, address, port)
+    if info == 0 and args.ffprobe and not rtp['ssrc']:
+        info = get_ffprobe(address, port)
+
+    cache_put(address, port, 'alive', info, programs_pids(programs))
+
+    return info
+
+def programs_pids(json_string):
+    """ Get the list of the streams' PIDs from the ffprobe-like json data """
+
+    pids = []
+    for program in json_string.get('programs', []):
+        for stream in program.get('streams', []):
+            try:
+                pids.append(int(str(stream['id']), 16))
+            except (KeyError, ValueError):
+                pass
+
+    return pids
+
+# The cache updates are written in one transaction every second or every 500 updates:
+# the processes sharing the file hold its write lock only for the flush
+cache_interval = 1
+cache_batch = 500
+
+def cache_open(path):
+    """ Open the channels cache (SQLite file) and evict the outdated entries """
+
+    global args
+
+    # The readers of the shard processes sharing the file do not wait for the writer (WAL)
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('CREATE TABLE IF NOT EXISTS channels (channel TEXT PRIMARY KEY, state TEXT, info TEXT, pids TEXT, last_seen REAL, checked REAL)')
+    connection.execute('CREATE TABLE IF NOT EXISTS latencies (channel TEXT PRIMARY KEY, first TEXT, info TEXT, misses INTEGER)')
+    try:
+        with connection:
+            evicted = connection.execute('DELETE FROM channels WHERE checked < ?', (time.time() - float(args.cache_max_age),)).rowcount
+    except sqlite3.OperationalError as error:
+        print(f'[*] Unable to evict the outdated cache entries: {error}')
+        evicted = 0
+
+    return {'connection': connection, 'lock': threading.Lock(), 'hits': 0, 'misses': 0, 'writes': 0, 'evicted': evicted,
+            'pending': [], 'flushed': time.monotonic()}
+
+def cache_lookup(address, port, count=True):
+    """ Get the fresh cached state of ip:port: ('alive', info), ('dead', 0) or None """
+
+    global cache
+
+    if cache is None:
+        return None
+
+    with cache['lock']:
+        row = cache['connection'].execute('SELECT state, info, checked FROM channels WHERE channel = ?', (f'{address}:{port}',)).fetchone()
+
+        # Only the channels with the stream's info are reused, the dead ones are skipped for a shorter time
+        result = None
+        if row is not None:
+            state, info, checked = row
+            age = time.time() - checked
+            if state == 'alive' and age < float(args.cache_ttl) and json.loads(info) != 0:
+                result = ('alive', json.loads(info))
+            elif state == 'dead' and age < float(args.cache_dead_ttl):
+                result = ('dead', 0)
+
+        if not count:
+            pass
+        elif result is None:
+            cache['misses'] += 1
+        else:
+            cache['hits'] += 1
+
+    return result
+
+def cache_put(address, port, state, info=0, pids=None):
+    """ Record the checked state of ip:port to the cache """
+
+    global cache
+
+    if cache is None:
+        return
+
+    now = time.time()
+    with cache['lock']:
+        if state == 'alive':
+            cache['pending'].append((f'{address}:{port}', state, json.dumps(info), json.dumps(pids or []), now, now))
+        else:
+            cache['pending'].append((f'{address}:{port}', state, json.dumps(info), json.dumps(pids or []), now))
+        cache['writes'] += 1
+        flush = len(cache['pending']) >= cache_batch or time.monotonic() - cache['flushed'] >= cache_interval
+
+    if flush:
+        cache_flush()
+
+def cache_flush():
+    """ Write the pending updates to the cache in one short transaction (kept for the next flush if the file is locked) """
+
+    global cache
+
+    if cache is None:
+        return
+
+    with cache['lock']:
+        rows, cache['pending'] = cache['pending'], []
+        cache['flushed'] = time.monotonic()
+        if not rows:
+            return
+
+        try:
+            with cache['connection']:
+                for row in rows:
+                    if len(row) == 6:
+                        cache['connection'].execute('INSERT OR REPLACE INTO channels VALUES (?, ?, ?, ?, ?, ?)', row)
+                    else:
+                        cache['connection'].execute('INSERT INTO channels VALUES (?, ?, ?, ?, NULL, ?) ON CONFLICT(channel) DO UPDATE SET state = excluded.state, checked = excluded.checked', row)
+        except sqlite3.OperationalError as error:
+            print(f'[*] Unable to write the cache: {error}')
+            cache['pending'] = rows + cache['pending']
+
+def history_load():
+    """ Load the channels' latencies history (seconds) from the cache """
+
+    history = {}
+    with cache['lock']:
+        for channel, first, info, misses in cache['connection'].execute('SELECT channel, first, info, misses FROM latencies'):
+            history[channel] = {'first': json.loads(first), 'info': json.loads(info), 'misses': misses, 'changed': False}
+
+    return history
+
+def history_add(address, port, first=None, info=None):
+    """ Add the first packet and the stream's info latencies of the check (None: the channel is silent) """
+
+    if history is None:
+        return
+
+    with cache['lock']:
+        entry = history.setdefault(f'{address}:{port}', {'first': [], 'info': [], 'misses': 0, 'changed': False})
+        entry['changed'] = True
+        if first is None:
+            entry['misses'] += 1
+        else:
+            entry['misses'] = 0
+            entry['first'] = entry['first'][-(history_size - 1):] + [round(first, 4)]
+        if info is not None:
+            entry['info'] = entry['info'][-(history_size - 1):] + [round(info, 4)]
+
+def history_save():
+    """ Write the changed channels' latencies history to the cache (the shard processes share it) """
+
+    if history is None:
+        return
+
+    with cache['lock']:
+        rows = [(channel, json.dumps(entry['first']), json.dumps(entry['info']), entry['misses']) for channel, entry in history.items() if entry['changed']]
+        try:
+            with cache['connection']:
+                cache['connection'].executemany('INSERT OR REPLACE INTO latencies VALUES (?, ?, ?, ?)', rows)
+        except sqlite3.OperationalError as error:
+            print(f'[*] Unable to write the latencies history: {error}')
+            return
+        for entry in history.values():
+            entry['changed'] = False
+
+def history_timeouts(address, port, udp_timeout=None):
+    """ Get the first packet and the stream's info timeouts of the channel learned from its history """
+
+    udp_timeout, info_timeout = float(args.udp_timeout) if udp_timeout is None else udp_timeout, float(args.info_timeout)
+    if history is None or f'{address}:{port}' not in history:
+        return udp_timeout, info_timeout
+
+    # The p99 latency with the margin, not shorter than the floor and not longer than the given timeouts
+    entry = history[f'{address}:{port}']
+    if len(entry['first']) >= history_samples:
+        udp_timeout = min(udp_timeout, max(history_floor, percentile(sorted(entry['first']), 99) * float(args.adaptive_margin)))
+
+    # The group never answered in the last checks
+    elif entry['misses'] >= history_samples:
+        udp_timeout = min(udp_timeout, history_quiet)
+
+    # With --zap the stream's info timeout is the keyframe wait too: the learned PSI/SI time would cut the GOP short
+    if len(entry['info']) >= history_samples and not args.zap:
+        info_timeout = min(info_timeout, max(history_floor, percentile(sorted(entry['info']), 99) * float(args.adaptive_margin)))
+
+    return udp_timeout, info_timeout
+
+def history_summary(channels):
+    """ Print the number of the channels with the learned timeouts and the longest waits """
+
+    timeouts = [history_timeouts(record['address'], record['port']) for record in channels.values()]
+    learned = sum(1 for timeout in timeouts if timeout != (float(args.udp_timeout), float(args.info_timeout)))
+    print(f'[*] Adaptive timeouts: {learned} of {len(timeouts)} channel(s) learned from the history', end='')
+    if timeouts:
+        print(f', the longest waits: {max(timeout[0] for timeout in timeouts) * 1000:,.0f} ms for the first packet, {max(timeout[1] for timeout in timeouts) * 1000:,.0f} ms for the info')
+    else:
+        print()
+
+def cache_close():
+    """ Commit and close the cache, print the statistics """
+
+    global cache
+
+    if cache is None:
+        return
+
+    cache_flush()
+    with cache['lock']:
+        cache['connection'].close()
+
+    print(f'[*] Cache: {cache["hits"]:,} hit(s), {cache["misses"]:,} miss(es), {cache["writes"]:,} update(s), {cache["evicted"]:,} evicted')
+
+# The stream's URL of the playlist: udp:// or rtp://, the optional source (SSM) before '@' and the port
+playlist_url_re = re.compile(r'^(udp|rtp)://(?:[^@/]*@)?([0-9.]+)(?::([0-9]+))?', re.IGNORECASE)
+
+# The attributes of the #EXTINF line: tvg-id="...", group-title="..."
+playlist_attribute_re = re.compile(r'([A-Za-z0-9_-]+)="([^"]*)"')
+
+def playlist_reader(playlist):
+    """ Lazily yield the UDP/RTP channels' records of the M3U playlist """
+
+    extinf = None
+    group = None
+    name = os.path.basename(playlist)
+
+    with open(playlist, errors='replace') as playlist:
+        for line in playlist:
+            line = line.strip()
+
+            # Empty lines and the header
+            if not line or line.startswith('#EXTM3U'):
+                continue
+
+            # #EXTINF:<duration> <attributes>,<name> (the commas inside the quotes are not the separator)
+            if line.startswith('#EXTINF:'):
+                info = line[8:]
+                quoted = False
+                separator = len(info)
+                for index, char in enumerate(info):
+                    if char == '"':
+                        quoted = not quoted
+                    elif char == ',' and not quoted:
+                        separator = index
+                        break
+                head = info[:separator].strip()
+                duration = head.split(' ', 1)[0] if head else '-1'
+                extinf = {'duration': duration, 'attributes': dict(playlist_attribute_re.findall(head)), 'name': info[separator + 1:].strip()}
+                continue
+
+            # The group of the next channel
+            if line.startswith('#EXTGRP:'):
+                group = line[8:].strip()
+                continue
+
+            # The other directives and the comments
+            if line.startswith('#'):
+                continue
+
+            # The stream's URL: the other schemes (http://, files) are skipped
+            url = playlist_url_re.match(line)
+            if url:
+                scheme, address, port = url.group(1).lower(), url.group(2), url.group(3) or '1234'
+                record = {'name': f'{address}:{port}', 'address': address, 'port': port, 'scheme': scheme, 'duration': '-1', 'attributes': {}, 'playlist': name}
+                if extinf is not None:
+                    record.update(extinf)
+                    record['name'] = extinf['name'] or record['name']
+                if group is not None and 'group-title' not in record['attributes']:
+                    record['attributes'] = dict(record['attributes'], **{'group-title': group})
+                yield record
+
+            extinf = None
+            group = None
+
+def playlist_parser(playlists):
+    """ Function that returns the index of the playlists' channels by group:port """
 
-    # Create a dictionary
     dictionary = {}
+    duplicates = 0
+
+    # The first channel of the same group:port is kept (of the first playlist), the names could repeat
+    for playlist in playlists:
+        for record in playlist_reader(playlist):
+            key = f'{record["address"]}:{record["port"]}'
+            if key in dictionary:
+                duplicates += 1
+                continue
+            dictionary[key] = record
+
+    if duplicates:
+        print(f'[*] Duplicate channels skipped in the playlist: {duplicates}')
 
-    with open(playlist) as playlist:
-        for counter, line in enumerate(playlist):
-            if re.findall(channel_name_re ,line):
-                channel_name = re.search(channel_name_re,line).group()
-                channel_address = re.search(channel_address_re, playlist.readline()).group()
-                dictionary[channel_name] = channel_address
-    
     return dictionary
 
-def channel_checker(sock):
+def channel_checker(sock, timeout=None):
     """ Function to check the given UDP socket """
 
     global args
 
-    ready = select.select([sock], [], [], args.udp_timeout)
+    # The socket is left opened on success: the queued datagrams are used for the stream's info
+    ready = select.select([sock], [], [], timeout if timeout is not None else float(args.udp_timeout))
     if ready[0]:
-        sock.close()
         return 0
     else:
+        sock.close()
         return 1
 
 def socket_creator(nic, address, port, os_name):
     """ Creates a sockets for a given ports """
 
+    started = time.perf_counter()
+
     # Create a UDP socket
     # AF_INET address family represented by a pair (host, port)
     # SOCK_DGRAM is a UDP socket type for datagram-based protocol
@@ -138,57 +1203,900 @@ def socket_creator(nic, address, port, os_name):
     else:
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     
+    # On Linux a socket receives the datagrams of all the groups joined on the host for the same port
+    # IP_MULTICAST_ALL = 0 (49) limits it to the groups joined by this socket only (set before the bind)
+    if os_name == 'Linux':
+        sock.setsockopt(socket.IPPROTO_IP, getattr(socket, 'IP_MULTICAST_ALL', 49), 0)
+    
     # Bind to the port that we know will receive multicast data
-    sock.bind((nic, int(port)))
+    # Linux delivers the multicast datagrams to the sockets bound to the group or any address only:
+    # the interface is chosen by the join
+    sock.bind(('0.0.0.0' if os_name == 'Linux' else nic, int(port)))
     
     # Tell the kernel that we are a multicast socket
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
     
     # Tell the kernel that we want to add ourselves to a multicast group
     # The address for the multicast group is the third param
+    joined = time.perf_counter()
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(address) + socket.inet_aton(nic))
+    join_times[sock.fileno()] = time.monotonic()
+    profile_add('socket', address, port, joined - started)
+    profile_add('join', address, port, time.perf_counter() - joined)
 
     return sock
 
-def mass_checker(channel):
-    """ Function to mass check the channels in the dictionary """
+def channel_result(channel, address, port, info, latency, metrics=None, zap=None, first=None, error=None):
+    """ Function to get the result line of the checked channel, its record is emitted to the results """
+
+    # The local error (the group is not joined) says nothing about the stream
+    if exporter is not None and error is None:
+        exporter_check(channel, address, port, info != 0, first, latency / 1000, metrics)
+
+    record = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'channel': channel,
+        'address': address,
+        'port': int(port),
+        'status': 'ok' if info != 0 else 'down',
+        'service_name': info if info not in (0, 1) else None,
+        'latency_ms': latency,
+        'first_packet_ms': round(first * 1000) if first is not None else None,
+        'reason': None,
+    }
+    if error is not None:
+        record['status'] = 'error'
+        record['reason'] = error
+    elif info == 0:
+        record['reason'] = 'no packets' if first is None else 'no stream info'
+
+    # Add the zap time stages of the working channel
+    if zap is not None and info != 0 and zap['packet'] is not None:
+        zap_times.append(zap)
+        record['zap'] = {stage: round((zap[stage] - zap['join']) * 1000) if zap[stage] is not None else None for stage in ('packet', 'pat', 'pmt', 'keyframe')}
+
+    # Check the health of the working channel
+    if metrics is not None and info != 0:
+        record['metrics'] = dict(metrics, loss=round(metrics['loss'], 3))
+        reason = ts_degraded(metrics)
+        if reason:
+            record['status'] = 'degraded'
+            record['reason'] = reason
+
+    result_emit(record)
+
+    return result_line(record)
+
+def result_line(record):
+    """ Get the text line of the channel's result record """
+
+    channel = record['channel']
+    latency = f'{record["latency_ms"]:,} ms'
+
+    if 'zap' in record:
+        stages = ', '.join(f'{name} {record["zap"][stage]:,} ms' if record['zap'][stage] is not None else f'no {name}'
+                           for stage, name in (('packet', 'packet'), ('pat', 'PAT'), ('pmt', 'PMT'), ('keyframe', 'keyframe')))
+        latency += f' >>> zap: {stages}'
+
+    if 'metrics' in record:
+        metrics = record['metrics']
+        health = f'{metrics["bitrate"]:,} kbps, loss {metrics["loss"]:.2f}%, CC errors {metrics["cc_errors"]}'
+        if 'pcr_pids' in metrics:
+            health += f', PCR interval {metrics["pcr_interval"]} ms, jitter {metrics["pcr_jitter"]} ms, accuracy {metrics["pcr_accuracy"]:,} ns, gap {metrics["burst"]} ms'
+        if 'rtp_ssrc' in metrics:
+            health += f', RTP loss {metrics["rtp_loss"]:.2f}% ({metrics["rtp_lost"]:,} lost, {metrics["rtp_reordered"]:,} reordered), jitter {metrics["rtp_jitter"]} ms'
+        if record['status'] == 'degraded':
+            return f'[*] DEGRADED >>> Channel is degraded! >>> "{channel}" >>> {health} >>> {latency}'
+        latency = f'{latency} >>> {health}'
+
+    if record['status'] == 'error':
+        return f'[*] Channel {channel} is not checked >>> {record["reason"]}'
+
+    if record['status'] == 'down':
+        return f'[*] Channel {channel} is not working >>> {latency}'
+
+    elif record['service_name'] is None: # Stream captured but without channel name
+
+        return f'[*] OK >>> Channel is working! >>> "{channel}" >>> No stream name found >>> {latency}'
+
+    else: # Stream captured with channel name
+
+        return f'[*] OK >>> Channel is working! >>> "{channel}" >>> Stream name: "{record["service_name"]}" >>> {latency}'
+
+def result_emit(record):
+    """ Add the record to the results of the run and stream it to the NDJSON file at once """
+
+    # The list append is atomic, the file lines are written under the lock
+    if results is not None:
+        results.append(record)
+    if results_file is not None:
+        line = json.dumps(record) + '\n'
+        with results_lock:
+            results_file.write(line)
+            results_file.flush()
+
+def results_summary():
+    """ Get the list of the broken channels from the results of the run """
+
+    lines = []
+    for record in results:
+        if record['status'] == 'down':
+            lines.append(f'{record["address"]}:{record["port"]} - {record["channel"]}\n')
+        elif record['status'] == 'degraded':
+            lines.append(f'{record["address"]}:{record["port"]} - {record["channel"]} (degraded: {record["reason"]})\n')
+
+    return ''.join(lines)
+
+def mass_checker(key, tier=None):
+    """ Function to mass check the channels in the dictionary (with the timeout and the depth of the tier) """
 
     # Define global variables
     global os_name
-    global channels_not_working
 
-    # Check channel
-    channel_address, channel_port = channels_dictionary[channel].split(':')
-    sock = socket_creator(args.nic, channel_address, channel_port, os_name)
-    result = channel_checker(sock)
-    if result == 0:
-        
-        # Get the data of the possible stream
-        info = get_ffprobe(channel_address, channel_port)
-        
-        if info == 1: # Stream captured but without channel name
-                
-            return f'[*] OK >>> Channel is working! >>> "{channel}" >>> No stream name found'
+    # Check channel: one join and one wait for both the check and the stream's info
+    record = channels_dictionary[key]
+    channel_address, channel_port = record['address'], record['port']
+    channel = record['name']
+    depth = tier['depth'] if tier is not None else ('metrics' if float(args.metrics) else 'info')
+    udp_timeout, info_timeout = history_timeouts(channel_address, channel_port, tier['timeout'] if tier is not None else None)
+    start = time.perf_counter()
+    try:
+        sock = socket_creator(args.nic, channel_address, channel_port, os_name)
+    except OSError as error:
+        print(f'[*] Unable to join {channel_address}:{channel_port}: {error}')
+        return channel_result(channel, channel_address, channel_port, 0, 0, error=str(error))
+    zap = ts_zap(join_times.pop(sock.fileno())) if args.zap else None
+    waited = time.perf_counter()
+    result = channel_checker(sock, udp_timeout)
+    packet = time.perf_counter() - waited if result == 0 else None
+    profile_add('first packet' if result == 0 else 'timeout', channel_address, channel_port, time.perf_counter() - waited)
+    first = time.perf_counter() - start if result == 0 else None
+    timing = {}
+    cached = cache_lookup(channel_address, channel_port)
+    analyzer = ts_analyzer() if depth == 'metrics' else None
+    if result == 0 and depth == 'join':
 
-        elif info == 0:
+        # The first packet is enough: the cached stream's name if it is known
+        sock.close()
+        info = cached[1] if cached is not None and cached[0] == 'alive' else 1
 
-            # Add the broken channel to the list
-            channels_not_working += f'{channel_address}:{channel_port} - {channel}\n'
-            return f'[*] Channel {channel} is not working'
+    elif result == 0 and cached is not None and cached[0] == 'alive' and analyzer is None and zap is None:
 
-        else: # Stream captured with channel name
-            
-            return f'[*] OK >>> Channel is working! >>> "{channel}" >>> Stream name: "{info}"'
+        # Reuse the cached stream's info
+        sock.close()
+        info = cached[1]
+
+    elif result == 0:
+        
+        # Get the data of the possible stream (and measure its health and the zap time)
+        info = get_stream_info(sock, channel_address, channel_port, analyzer, zap, info_timeout, timing)
     
     else:
-        # Add the broken channel to the list
-        channels_not_working += f'{channel_address}:{channel_port} - {channel}\n'
-        return f'[*] Channel {channel} is not working'
+        info = 0
+        cache_put(channel_address, channel_port, 'dead')
+
+    history_add(channel_address, channel_port, packet, timing.get('ready'))
+
+    latency = round((time.perf_counter() - start) * 1000)
+    profile_add('check', channel_address, channel_port, time.perf_counter() - start)
+    metrics = ts_metrics(analyzer, time.monotonic(), float(args.metrics)) if analyzer is not None else None
+
+    return channel_result(channel, channel_address, channel_port, info, latency, metrics, zap, first)
+
+def files_limit(wanted):
+    """ Raise the limit of the opened files (sockets) up to the wanted number, get the limit reached """
+
+    try:
+        import resource
+    except ImportError:
+        return wanted
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= wanted:
+        return wanted
+    if hard != resource.RLIM_INFINITY:
+        wanted = min(hard, wanted)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+    except (ValueError, OSError):
+        return soft
+
+    return wanted
+
+def files_sockets(limit):
+    """ Get the number of the sockets to keep opened under the limit of the opened files """
+
+    # The rest is left for the standard streams, the cache, the results and ffprobe
+    return max(1, limit - min(64, limit // 2))
+
+def loop_checker(channels):
+    """ Function to check all the channels in one event loop (epoll/kqueue) """
+
+    global args
+    global os_name
+
+    # Allow one socket per channel: the channels over the limit of the opened files
+    # are joined as the earlier ones are resolved
+    sockets = files_sockets(files_limit(len(channels) + 64))
+    pending = collections.deque(channels.values())
+
+    selector = selectors.DefaultSelector()
+    deadlines = []
+    counter = itertools.count()
+    fallback = []
+
+    # The datagrams of all the channels are received into one reusable buffer
+    buffer = bytearray(65536)
+    view = memoryview(buffer)
+
+    while pending or selector.get_map():
+
+        # Join the groups at once while the sockets are under the limit
+        while pending and len(selector.get_map()) < sockets:
+            record = pending.popleft()
+            channel, address, port = record['name'], record['address'], record['port']
+            udp_timeout, info_timeout = history_timeouts(address, port)
+            start = time.perf_counter()
+            try:
+                sock = socket_creator(args.nic, address, port, os_name)
+            except OSError as error:
+
+                # Out of the opened files: wait for the joined channels to be resolved
+                if error.errno in (errno.EMFILE, errno.ENFILE) and selector.get_map():
+                    pending.appendleft(record)
+                    sockets = len(selector.get_map())
+                    break
+                print(f'[*] Unable to join {address}:{port}: {error}')
+                yield channel_result(channel, address, port, 0, 0, error=str(error))
+                continue
+            state = {'channel': channel, 'address': address, 'port': port, 'start': start, 'joined': time.perf_counter(), 'alive': False, 'demuxer': None,
+                     'cached': cache_lookup(address, port), 'deadline': time.monotonic() + udp_timeout, 'info_timeout': info_timeout, 'ready': None,
+                     'zap': ts_zap(join_times.pop(sock.fileno())) if args.zap else None}
+            selector.register(sock, selectors.EVENT_READ, state)
+            heapq.heappush(deadlines, (state['deadline'], next(counter), sock))
+
+        if not selector.get_map():
+            continue
+
+        # Wait for the datagrams till the nearest deadline
+        timeout = max(0, deadlines[0][0] - time.monotonic()) if deadlines else None
+        for key, event in selector.select(timeout):
+            state = key.data
+
+            if not state['alive']:
+                state['first'] = time.perf_counter() - state['start']
+                state['packet'] = time.perf_counter() - state['joined']
+                profile_add('first packet', state['address'], state['port'], state['packet'])
+
+            # The first packet of the channel with the cached stream's info: resolve it now
+            if not state['alive'] and state['cached'] is not None and state['cached'][0] == 'alive' and not float(args.metrics) and not args.zap:
+                state['alive'] = True
+                state['deadline'] = 0
+                heapq.heappush(deadlines, (0, next(counter), key.fileobj))
+                continue
+
+            # The first packet: the channel is alive, start collecting the stream's info and its health
+            if not state['alive']:
+                now = time.monotonic()
+                state['alive'] = True
+                state['demuxer'] = ts_demuxer()
+                state['analyzer'] = ts_analyzer() if float(args.metrics) else None
+                state['rtp'] = state['analyzer']['rtp'] if state['analyzer'] is not None else rtp_receiver()
+                state['info_deadline'] = now + state['info_timeout']
+                state['metrics_end'] = now + float(args.metrics)
+                state['deadline'] = max(state['info_deadline'], state['metrics_end'])
+                heapq.heappush(deadlines, (state['deadline'], next(counter), key.fileobj))
+
+            try:
+                size = key.fileobj.recv_into(buffer)
+            except OSError:
+                continue
+            data = rtp_strip(state['rtp'], view[:size], time.monotonic())
+            ts_demux(state['demuxer'], data)
+            if state['analyzer'] is not None:
+                ts_analyze(state['analyzer'], data, time.monotonic())
+            if state['zap'] is not None:
+                ts_zap_update(state['zap'], state['demuxer'], data, time.monotonic())
+
+            # The time till the tables are complete (the history of the adaptive timeouts)
+            if state['ready'] is None and ts_demuxer_ready(state['demuxer']):
+                state['ready'] = time.perf_counter() - state['start'] - state['first']
+
+            # Reschedule the channel if the tables are complete or the SDT waiting time is shorter
+            deadline = max(ts_info_deadline(state['demuxer'], state['zap'], time.monotonic(), state['info_deadline']), state['metrics_end'])
+            if deadline < state['deadline']:
+                state['deadline'] = deadline
+                heapq.heappush(deadlines, (deadline, next(counter), key.fileobj))
+
+        # Resolve the channels with the expired deadlines
+        now = time.monotonic()
+        while deadlines and deadlines[0][0] <= now:
+            deadline, order, sock = heapq.heappop(deadlines)
+            try:
+                state = selector.get_key(sock).data
+            except (KeyError, ValueError):
+                continue
+
+            # Outdated deadline of the rescheduled channel
+            if deadline != state['deadline']:
+                continue
+
+            selector.unregister(sock)
+            sock.close()
+            history_add(state['address'], state['port'], state.get('packet'), state['ready'])
+
+            metrics = None
+            if state.get('analyzer') is not None:
+                metrics = ts_metrics(state['analyzer'], time.monotonic(), float(args.metrics))
+
+            if not state['alive']:
+                info = 0
+                cache_put(state['address'], state['port'], 'dead')
+                profile_add('timeout', state['address'], state['port'], time.perf_counter() - state['joined'])
+            elif state['demuxer'] is None:
+                info = state['cached'][1]
+            else:
+                profile_add('info', state['address'], state['port'], time.perf_counter() - state['start'] - state['first'])
+                programs = ts_demuxer_programs(state['demuxer'])
+                info = programs_parser(programs, state['address'], state['port'])
+                if info == 0 and args.ffprobe and not state['rtp']['ssrc']:
+                    fallback.append(state)
+                    continue
+                cache_put(state['address'], state['port'], 'alive', info, programs_pids(programs))
+
+            latency = round((time.perf_counter() - state['start']) * 1000)
+            profile_add('check', state['address'], state['port'], time.perf_counter() - state['start'])
+            yield channel_result(state['channel'], state['address'], state['port'], info, latency, metrics, state['zap'], state.get('first'))
+
+    selector.close()
+
+    # Probe the channels without the stream's info with ffprobe
+    if fallback:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            probes = {executor.submit(get_ffprobe, state['address'], state['port']): state for state in fallback}
+            for item in concurrent.futures.as_completed(probes):
+                state = probes[item]
+                cache_put(state['address'], state['port'], 'alive', item.result())
+                latency = round((time.perf_counter() - state['start']) * 1000)
+                profile_add('check', state['address'], state['port'], time.perf_counter() - state['start'])
+                yield channel_result(state['channel'], state['address'], state['port'], item.result(), latency, None, state['zap'], state['first'])
+
+def daemon_state(silence):
+    """ Get the channel's health state for the given seconds of silence """
+
+    if silence < float(args.degraded_after):
+        return 'up'
+    elif silence < float(args.down_after):
+        return 'degraded'
+    else:
+        return 'down'
+
+# The shortest period of the daemon's state evaluation in seconds
+daemon_tick = 0.1
+
+def daemon_join(selector, state):
+    """ Join the group of the monitored channel, the failed join is retried after --down_after seconds """
+
+    try:
+        sock = socket_creator(args.nic, state['address'], state['port'], os_name)
+    except OSError as error:
+        if state['error'] != str(error):
+            print(f'[*] Unable to join {state["address"]}:{state["port"]}: {error}')
+        state['error'] = str(error)
+        state['retry'] = time.monotonic() + float(args.down_after)
+        return
+
+    # The silence is counted from the first join: the channel is up again with its packets
+    sock.setblocking(False)
+    selector.register(sock, selectors.EVENT_READ, state)
+    state['error'] = None
+
+def daemon_checker(channels):
+    """ Function to monitor the channels continuously keeping their memberships """
+
+    global args
+    global os_name
+
+    files_limit(len(channels) + 64)
+    selector = selectors.DefaultSelector()
+    states = []
+
+    # The datagrams of all the channels are received into one reusable buffer
+    buffer = bytearray(65536)
+    view = memoryview(buffer)
+
+    # Join all the groups once: the groups not joined are down and joined again later
+    for record in channels.values():
+        state = {'channel': record['name'], 'address': record['address'], 'port': record['port'], 'state': 'unknown',
+                 'last': time.monotonic(), 'since': time.time(), 'packets': 0, 'error': None, 'retry': 0,
+                 'analyzer': ts_analyzer() if float(args.metrics) else None}
+        daemon_join(selector, state)
+        states.append(state)
+
+    failed = sum(1 for state in states if state['error'] is not None)
+    print(f'[*] Monitoring {len(states)} channel(s): degraded after {args.degraded_after} sec(s), down after {args.down_after} sec(s) of silence'
+          + (f', {failed} not joined yet' if failed else '') + '\n')
+
+    # Evaluate the states several times per the shortest threshold (not more often than every 100 ms)
+    tick = max(daemon_tick, min(float(args.degraded_after), float(args.down_after)) / 4)
+    next_tick = time.monotonic() + tick
+
+    while True:
+        for key, event in selector.select(max(0, next_tick - time.monotonic())):
+            state = key.data
+
+            # Drain the socket: the arrival time and the TS health (if measured)
+            try:
+                while True:
+                    size = key.fileobj.recv_into(buffer)
+                    state['packets'] += 1
+                    if state['analyzer'] is not None:
+                        now = time.monotonic()
+                        ts_analyze(state['analyzer'], rtp_strip(state['analyzer']['rtp'], view[:size], now), now)
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as error:
+                print(f'[*] Error on {state["address"]}:{state["port"]}: {error}')
+            state['last'] = time.monotonic()
 
-def send_email(smtp_server, smtp_port, sender, receivers, channels_not_working):
+        now = time.monotonic()
+        if now < next_tick:
+            continue
+        next_tick = now + tick
+
+        # Alert only on the state transitions
+        transitions = ''
+        for state in states:
+            # Join the group again after the failed join
+            if state['error'] is not None and now >= state['retry']:
+                daemon_join(selector, state)
+
+            new_state = daemon_state(now - state['last'])
+
+            # No packet since the join: wait for the first one till the channel is down
+            if state['packets'] == 0 and new_state != 'down':
+                new_state = 'unknown'
+
+            # The packets arrive, but the stream is broken (the window has to be filled first)
+            reason = ''
+            metrics = None
+            if new_state == 'up' and state['analyzer'] is not None and state['analyzer']['start'] is not None \
+                    and now - state['analyzer']['start'] >= float(args.metrics):
+                metrics = ts_metrics(state['analyzer'], now, float(args.metrics))
+                reason = ts_degraded(metrics)
+                if reason:
+                    new_state = 'degraded'
+            if state['error'] is not None:
+                reason = f'not joined: {state["error"]}'
+
+            if exporter is not None:
+                with exporter['lock']:
+                    values = exporter_channel(state['channel'], state['address'], state['port'])
+                    values['up'] = 1 if new_state in ('up', 'degraded') else 0
+                    if metrics is not None:
+                        values['cc_errors'] = sum(state['analyzer']['cc_errors'].values())
+                        values['bitrate'] = metrics['bitrate']
+                        values['loss'] = metrics['loss']
+                        values['rtp_lost'] = state['analyzer']['rtp']['lost']
+                        values['rtp_jitter'] = metrics.get('rtp_jitter', 0)
+
+            if new_state == state['state']:
+                continue
+
+            result_emit({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'channel': state['channel'], 'address': state['address'],
+                         'port': int(state['port']), 'status': new_state, 'previous': state['state'], 'reason': reason or None})
+            message = f'{state["address"]}:{state["port"]} - {state["channel"]}: {state["state"]} -> {new_state}'
+            if reason:
+                message += f' ({reason})'
+            print(f'[*] {time.strftime("%Y-%m-%d %H:%M:%S")} {message}')
+            if not (state['state'] == 'unknown' and new_state == 'up'):
+                transitions += message + '\n'
+            state['state'] = new_state
+            state['since'] = time.time()
+
+        if transitions and email_set == 1:
+            send_email(args.smtp_server, args.smtp_port, args.sender, args.receivers, transitions, 'The following channel(s) changed the state')
+
+# The check depths of the tiers: the first packet only, the stream's info, the info and the TS health over --metrics seconds
+tier_depths = ('join', 'info', 'metrics')
+
+def tiers_parser(values, depth):
+    """ Get the tiers of the --tier options in their priority order, the channels of no tier are the last one """
+
+    tiers = []
+    for value in values:
+
+        # The group-title could contain ':' too: the most of the valid fields are taken from the end
+        parts = value.split(':')
+        for count in (3, 2, 1):
+            match, fields = ':'.join(parts[:-count]), parts[-count:]
+            try:
+                interval = float(fields[0])
+                timeout = float(fields[1]) if len(fields) > 1 and fields[1] else float(args.udp_timeout)
+            except ValueError:
+                continue
+            tier_depth = fields[2] if len(fields) > 2 else depth
+            if match and interval > 0 and tier_depth in tier_depths:
+                break
+        else:
+            print(f'[*] Wrong tier "{value}": it should be <group-title or playlist>:<interval>[:<timeout>[:<depth>]], the depth is {", ".join(tier_depths)}')
+            sys.exit()
+        tiers.append({'match': match, 'interval': interval, 'timeout': timeout, 'depth': tier_depth, 'priority': len(tiers),
+                      'channels': [], 'checks': 0, 'broken': 0, 'lag': 0})
+
+    # The rest of the channels are checked every --interval seconds (5 minutes by default)
+    if not any(tier['match'] == '*' for tier in tiers):
+        tiers.append({'match': '*', 'interval': float(args.interval) or 300, 'timeout': float(args.udp_timeout), 'depth': depth,
+                      'priority': len(tiers), 'channels': [], 'checks': 0, 'broken': 0, 'lag': 0})
+
+    return tiers
+
+def tiers_assign(channels, tiers):
+    """ Put each channel to the first tier matching its group-title or its playlist's file name """
+
+    for key, record in channels.items():
+        names = (record['attributes'].get('group-title'), record['playlist'], '*')
+        for tier in tiers:
+            if tier['match'] in names:
+                tier['channels'].append(key)
+                break
+
+    for tier in tiers:
+        print(f'[*] Tier {tier["priority"] + 1} "{tier["match"]}": {len(tier["channels"]):,} channel(s) every {tier["interval"]:g} sec(s), '
+              f'timeout {tier["timeout"]:g} sec(s), depth {tier["depth"]}')
+
+def tier_scheduler(channels, tiers):
+    """ Function to check the channels of the tiers on their intervals within the concurrency and the joins budgets """
+
+    global results
+
+    # Each check keeps one socket opened: not more checks at once than the limit of the opened files allows
+    joins = float(args.joins)
+    concurrency = min(int(args.concurrency), files_sockets(files_limit(int(args.concurrency) + 64)))
+
+    # The records of the checks are taken from the results as they come
+    results = collections.deque()
+    states = {}
+
+    # The timers of the channels by their due time (the first checks are spread over the tier's interval)
+    # and the due channels by the priority of their tier
+    timers = []
+    due = []
+    counter = itertools.count()
+    tier_of = {}
+    now = time.monotonic()
+    for tier in tiers:
+        for index, key in enumerate(tier['channels']):
+            tier_of[key] = tier
+            heapq.heappush(timers, (now + tier['interval'] * index / len(tier['channels']), next(counter), key))
+
+    print(f'[*] Scheduler: {concurrency:,} check(s) at once' + (f', {joins:g} join(s) per second' if joins else '') + '\n')
+
+    # The joins budget is a bucket of one second of the joins
+    tokens = max(1, joins)
+    refilled = now
+    running = {}
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        while True:
+            now = time.monotonic()
+            while timers and timers[0][0] <= now:
+                when, order, key = heapq.heappop(timers)
+                heapq.heappush(due, (tier_of[key]['priority'], when, order, key))
+
+            if joins:
+                tokens = min(max(1, joins), tokens + (now - refilled) * joins)
+                refilled = now
+
+            # Start the due checks of the highest tiers first
+            while due and len(running) < concurrency and (not joins or tokens >= 1):
+                priority, when, order, key = heapq.heappop(due)
+                tier = tier_of[key]
+                tier['lag'] = max(tier['lag'], now - when)
+                running[executor.submit(mass_checker, key, tier)] = (key, when)
+                tokens -= 1
+
+            # Wait for the checks till the next timer or the next join
+            wake = [timers[0][0]] if timers else []
+            if due and len(running) < concurrency:
+                wake.append(now + (1 - tokens) / joins)
+            timeout = max(0, min(wake) - time.monotonic()) if wake else None
+            if not running:
+                time.sleep(timeout)
+                continue
+            done, pending = concurrent.futures.wait(running, timeout, concurrent.futures.FIRST_COMPLETED)
+
+            # Print the results and schedule the next checks of the channels
+            for future in done:
+                key, when = running.pop(future)
+                tier = tier_of[key]
+                print(future.result())
+                tier['checks'] += 1
+                heapq.heappush(timers, (max(when + tier['interval'], time.monotonic()), next(counter), key))
+
+            # Alert only on the state changes between the checks
+            transitions = ''
+            while results:
+                record = results.popleft()
+                key = f'{record["address"]}:{record["port"]}'
+                previous = states.get(key)
+                states[key] = record['status']
+                # The local errors (the group is not joined) say nothing about the channel's state
+                if record['status'] == 'error':
+                    states[key] = previous
+                    continue
+                if record['status'] != 'ok':
+                    tier_of[key]['broken'] += 1
+                if previous is None or previous == record['status']:
+                    continue
+                message = f'{key} - {record["channel"]}: {previous} -> {record["status"]}'
+                if record['reason']:
+                    message += f' ({record["reason"]})'
+                print(f'[*] {time.strftime("%Y-%m-%d %H:%M:%S")} {message}')
+                transitions += message + '\n'
+
+            if transitions and email_set == 1:
+                send_email(args.smtp_server, args.smtp_port, args.sender, args.receivers, transitions, 'The following channel(s) changed the state')
+
+            cache_flush()
+            history_save()
+
+    finally:
+        print()
+        for tier in tiers:
+            print(f'[*] Tier {tier["priority"] + 1} "{tier["match"]}": {tier["checks"]:,} check(s), {tier["broken"]:,} down or degraded, '
+                  f'maximum lag {round(tier["lag"] * 1000):,} ms')
+
+        # The running checks are finished within their timeouts
+        executor.shutdown(wait=True, cancel_futures=True)
+
+# The buckets of the latency histograms in seconds
+exporter_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def exporter_start(port):
+    """ Start the Prometheus metrics endpoint in the background thread """
+
+    global exporter
+
+    exporter = {
+        'lock': threading.Lock(),
+        'channels': {},         # group:port -> labels and the values of the channel
+        'histograms': {name: {'buckets': [0] * len(exporter_buckets), 'sum': 0, 'count': 0} for name in ('first_packet', 'check')},
+        'runs': 0,              # completed runs
+        'run_duration': 0,      # seconds of the last run
+    }
+
+    server = http.server.ThreadingHTTPServer(('', int(port)), ExporterHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'[*] Prometheus metrics: http://{args.nic}:{port}/metrics\n')
+
+def exporter_channel(channel, address, port):
+    """ Get the metrics of the channel, create them on the first use (under the lock) """
+
+    key = f'{address}:{port}'
+    if key not in exporter['channels']:
+        labels = f'channel="{exporter_escape(channel)}",group="{key}"'
+        exporter['channels'][key] = {'labels': labels, 'up': 0, 'check': 0, 'cc_errors': 0, 'bitrate': 0, 'loss': 0, 'rtp_lost': 0, 'rtp_jitter': 0}
+
+    return exporter['channels'][key]
+
+def exporter_escape(value):
+    """ Escape the label value of the exposition format """
+
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def exporter_observe(name, value):
+    """ Add the value to the histogram (under the lock) """
+
+    histogram = exporter['histograms'][name]
+    for index, bucket in enumerate(exporter_buckets):
+        if value <= bucket:
+            histogram['buckets'][index] += 1
+    histogram['sum'] += value
+    histogram['count'] += 1
+
+def exporter_check(channel, address, port, up, first, duration, metrics):
+    """ Record the result of the channel's check """
+
+    with exporter['lock']:
+        values = exporter_channel(channel, address, port)
+        values['up'] = 1 if up else 0
+        values['check'] = duration
+        exporter_observe('check', duration)
+        if first is not None:
+            exporter_observe('first_packet', first)
+        if metrics is not None:
+            values['cc_errors'] += metrics['cc_errors']
+            values['bitrate'] = metrics['bitrate']
+            values['loss'] = metrics['loss']
+            values['rtp_lost'] += metrics.get('rtp_lost', 0)
+            values['rtp_jitter'] = metrics.get('rtp_jitter', 0)
+
+def exporter_render():
+    """ Render the metrics in the Prometheus text exposition format """
+
+    # Copy the values under the lock, format them outside of it
+    with exporter['lock']:
+        channels = [dict(values) for values in exporter['channels'].values()]
+        histograms = {name: {'buckets': list(histogram['buckets']), 'sum': histogram['sum'], 'count': histogram['count']}
+                      for name, histogram in exporter['histograms'].items()}
+        runs, run_duration = exporter['runs'], exporter['run_duration']
+
+    lines = []
+    for name, kind, help_text, field in (
+            ('multicast_channel_up', 'gauge', 'Channel is receiving the stream', 'up'),
+            ('multicast_channel_check_seconds', 'gauge', 'Duration of the last check of the channel', 'check'),
+            ('multicast_channel_continuity_errors_total', 'counter', 'Continuity counter errors of the channel', 'cc_errors'),
+            ('multicast_channel_bitrate_kbps', 'gauge', 'Bitrate of the channel', 'bitrate'),
+            ('multicast_channel_loss_percent', 'gauge', 'Packet loss of the channel', 'loss'),
+            ('multicast_channel_rtp_lost_total', 'counter', 'RTP datagrams lost by the sequence numbers', 'rtp_lost'),
+            ('multicast_channel_rtp_jitter_ms', 'gauge', 'RTP interarrival jitter of the channel', 'rtp_jitter')):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{name}{{{values["labels"]}}} {values[field]}' for values in channels)
+
+    for name, help_text in (('first_packet', 'Time from the join to the first packet'), ('check', 'Duration of the channel check')):
+        histogram = histograms[name]
+        lines.append(f'# HELP multicast_{name}_seconds {help_text}')
+        lines.append(f'# TYPE multicast_{name}_seconds histogram')
+        for bucket, count in zip(exporter_buckets, histogram['buckets']):
+            lines.append(f'multicast_{name}_seconds_bucket{{le="{bucket}"}} {count}')
+        lines.append(f'multicast_{name}_seconds_bucket{{le="+Inf"}} {histogram["count"]}')
+        lines.append(f'multicast_{name}_seconds_sum {histogram["sum"]}')
+        lines.append(f'multicast_{name}_seconds_count {histogram["count"]}')
+
+    lines.append('# HELP multicast_channels Channels checked')
+    lines.append('# TYPE multicast_channels gauge')
+    lines.append(f'multicast_channels {len(channels)}')
+    lines.append('# HELP multicast_runs_total Completed runs of the playlist check')
+    lines.append('# TYPE multicast_runs_total counter')
+    lines.append(f'multicast_runs_total {runs}')
+    lines.append('# HELP multicast_run_duration_seconds Duration of the last run of the playlist check')
+    lines.append('# TYPE multicast_run_duration_seconds gauge')
+    lines.append(f'multicast_run_duration_seconds {run_duration}')
+
+    return '\n'.join(lines) + '\n'
+
+class ExporterHandler(http.server.BaseHTTPRequestHandler):
+    """ HTTP handler of the Prometheus metrics endpoint """
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = exporter_render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # No access log on the console
+    def log_message(self, format, *args):
+        pass
+
+def shard_argv(removed):
+    """ Get the command line of the script without the given options and their values """
+
+    argv = []
+    skip = False
+    for token in sys.argv[1:]:
+        if token.startswith('--'):
+            skip = token.split('=')[0] in removed
+        if not skip:
+            argv.append(token)
+
+    return argv
+
+def shard_pin(index):
+    """ Pin the shard process to one of the available CPUs (Linux only) """
+
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+
+    cpus = sorted(os.sched_getaffinity(0))
+    cpu = cpus[index % len(cpus)]
+    os.sched_setaffinity(0, {cpu})
+
+    return cpu
+
+def shard_channels(channels, index, count):
+    """ Get every count-th channel of the playlist starting from the index """
+
+    return {key: record for position, (key, record) in enumerate(channels.items()) if position % count == index}
+
+def shard_run(nics, count):
+    """ Check the playlist with the shard processes (one interface and CPU each) and merge their results """
+
+    global results
+
+    # The single check is reported once by this process, the repeated ones by the shards
+    once = not args.daemon and not float(args.interval) and not args.tier
+    removed = {'--nic', '--processes', '--json', '--exporter'}
+    if once:
+        removed |= {'--smtp_server', '--smtp_port', '--sender', '--receivers'}
+    argv = shard_argv(removed)
+
+    shards = []
+    for index in range(count):
+        nic = nics[index % len(nics)]
+        command = [sys.executable, os.path.realpath(__file__)] + argv + ['--nic', nic, '--shard', f'{index}/{count}']
+
+        # The shard streams its records to the temporary file to be merged
+        shard_file = None
+        if once:
+            descriptor, shard_file = tempfile.mkstemp(prefix='multicast-checker-shard', suffix='.json')
+            os.close(descriptor)
+            command += ['--json', shard_file]
+        elif args.json:
+            command += ['--json', args.json]
+        if args.exporter:
+            command += ['--exporter', str(int(args.exporter) + index)]
+
+        print(f'[*] Shard {index + 1}/{count}: interface {nic}' + (f', metrics port {int(args.exporter) + index}' if args.exporter else ''))
+        sys.stdout.flush()
+        shards.append((subprocess.Popen(command), shard_file))
+
+    # Ctrl-C reaches the shards too: wait for them to close
+    # The shard exited with an error is reported at once: its channels are not checked anymore
+    running = set(range(count))
+    while running:
+        try:
+            for index in sorted(running):
+                process = shards[index][0]
+                if process.poll() is None:
+                    continue
+                running.discard(index)
+                if process.returncode:
+                    shard_failed(index, count, nics[index % len(nics)], process.returncode, once)
+            time.sleep(0.5)
+        except KeyboardInterrupt:
+            continue
+
+    if not once:
+        return
+
+    # Merge the records of the shards
+    results = []
+    for process, shard_file in shards:
+        with open(shard_file) as file:
+            results.extend(json.loads(line) for line in file if line.strip())
+        os.remove(shard_file)
+
+    if args.json:
+        with open(args.json, 'a') as file:
+            file.write(''.join(json.dumps(record) + '\n' for record in results))
+
+    states = collections.Counter(record['status'] for record in results)
+    print(f'\n[*] Shards: {count}, channels: {len(results)}, ok: {states["ok"]}, degraded: {states["degraded"]}, down: {states["down"]}')
+    failed = [index + 1 for index, (process, shard_file) in enumerate(shards) if process.returncode]
+    if failed:
+        print(f"[*] Shard(s) exited with an error: {', '.join(map(str, failed))}")
+
+    channels_not_working = results_summary()
+    if channels_not_working != '':
+        print(f'\n[*] The following channel(s) are not working:\n\n{channels_not_working}')
+        if email_set == 1:
+            send_email(args.smtp_server, args.smtp_port, args.sender, args.receivers, channels_not_working)
+
+def shard_failed(index, count, nic, code, once):
+    """ Report the shard process exited with an error and its channels left unchecked """
+
+    channels = shard_channels(channels_dictionary, index, count)
+    print(f'[*] Shard {index + 1}/{count} on {nic} exited with the code {code}: {len(channels):,} channel(s) are not checked')
+
+    # The repeated checks alert by email: the channels of the shard would not be alerted anymore
+    if not once and email_set == 1:
+        lines = ''.join(f'{key} - {record["name"]}\n' for key, record in channels.items())
+        send_email(args.smtp_server, args.smtp_port, args.sender, args.receivers, lines,
+                   f'The shard {index + 1}/{count} on {nic} exited with the code {code}, the following channel(s) are not checked')
+
+def send_email(smtp_server, smtp_port, sender, receivers, channels_not_working, message='The following channel(s) are not working'):
     """ Function to send an email when IPTV channel failed to play """
 
-    msg = MIMEText(f'The following channel(s) are not working:\n\n{channels_not_working}\n')
+    msg = MIMEText(f'{message}:\n\n{channels_not_working}\n')
     msg['Subject'] = f'!!! IPTV issue !!!'
     msg['From'] = f'{sender}'
     msg['To'] = f'{receivers}'
@@ -197,7 +2105,7 @@ def send_email(smtp_server, smtp_port, sender, receivers, channels_not_working):
         smtpObj = smtplib.SMTP(smtp_server, smtp_port)
         smtpObj.sendmail(sender, receivers, msg.as_string())
         print(f'[*] An email has been sent')
-    except SMTPException:
+    except (smtplib.SMTPException, OSError):
         print(f'[*] Error: unable to send an email')
 
 # ================
@@ -210,8 +2118,13 @@ args = parser.parse_args()
 # Check the OS name
 os_name = platform.system()
 
-# Check the user's input (playlist file)
-if not os.path.isfile(args.playlist):
+# One shard process for each interface or the given number of processes
+nics = args.nic
+args.nic = nics[0]
+shards = max(len(nics), int(args.processes))
+
+# Check the user's input (playlist files)
+if not all(os.path.isfile(playlist) for playlist in args.playlist):
     print("[*] Please specify the correct playlist file's name!")
     sys.exit()
 
@@ -222,42 +2135,160 @@ channels_dictionary = playlist_parser(args.playlist)
 email_set = 0
 if args.smtp_server and args.smtp_port and args.sender and args.receivers:
     email_set = 1
-else:
+elif not args.shard:
     print(f'[*] Email parameters are not defined.\n[*] Run the script with -h parameter for the details.\n')
 
+# Run the shard processes and merge their results
+if shards > 1 and not args.shard:
+    start = time.perf_counter()
+    shard_run(nics, shards)
+    print(f'\n[*] Finished in {round(time.perf_counter() - start, 0):,} second(s)')
+    sys.exit()
+
+# Check the part of the playlist of this shard process
+if args.shard:
+    shard_index, shard_count = map(int, args.shard.split('/'))
+    cpu = shard_pin(shard_index)
+    channels_dictionary = shard_channels(channels_dictionary, shard_index, shard_count)
+    print(f'[*] Shard {shard_index + 1}/{shard_count}: {len(channels_dictionary)} channel(s) on {args.nic}' + (f', CPU {cpu}' if cpu is not None else ''))
+
+# The PCR timing is analyzed over the measurement time
+if args.pcr and not float(args.metrics):
+    args.metrics = 5
+
+# The tiers of the channels checked on their own intervals, timeouts and depths
+# (the TS health of the metrics tiers is measured for 5 seconds by default)
+tiers = None
+if args.tier and args.daemon:
+    print(f'[*] The tiers are not used in the daemon mode')
+elif args.tier:
+    tiers = tiers_parser(args.tier, 'metrics' if float(args.metrics) else 'info')
+    tiers_assign(channels_dictionary, tiers)
+    if not channels_dictionary:
+        print(f'[*] No UDP/RTP channels found in the playlist(s) to check in the tiers')
+        sys.exit()
+    if not float(args.metrics) and any(tier['depth'] == 'metrics' for tier in tiers):
+        args.metrics = 5
+
+# The join times of the sockets and the zap times of the working channels
+join_times = {}
+zap_times = []
+profile = None
+
+# Open the channels cache
+cache = cache_open(args.cache) if args.cache else None
+
+# The channels' latencies history of the adaptive timeouts: the last 50 checks,
+# learned after 5 ones, not shorter than 250 ms, the groups silent for 5 checks are waited for 1 second
+history = None
+history_size = 50
+history_samples = 5
+history_floor = 0.25
+history_quiet = 1
+if args.adaptive and cache is None:
+    print(f'[*] The adaptive timeouts need the --cache file for the channels\' history')
+elif args.adaptive and args.daemon:
+    print(f'[*] The adaptive timeouts are not used in the daemon mode')
+elif args.adaptive:
+    history = history_load()
+
+# Open the NDJSON stream of the results
+results = None
+results_file = open(args.json, 'a') if args.json else None
+results_lock = threading.Lock()
+
+# Start the Prometheus metrics endpoint
+exporter = None
+if args.exporter:
+    exporter_start(args.exporter)
+
 # Main program
 try:
 
-    # Start timer:
-    start = time.perf_counter()
+    # Monitor the channels till the script is closed
+    if args.daemon:
+        daemon_checker(channels_dictionary)
 
-    # Define a string for the non-working channels
-    channels_not_working = ''
+    # Check the tiers of the channels till the script is closed
+    if tiers is not None:
+        tier_scheduler(channels_dictionary, tiers)
 
-    # Run the checker as a multi-thread executor
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        results = [executor.submit(mass_checker, channel) for channel in channels_dictionary]
+    # Check the playlist once or every --interval seconds
+    while True:
 
-        # Print the result:
-        for item in concurrent.futures.as_completed(results):
-            print(item.result())
+        # Start timer:
+        start = time.perf_counter()
 
-    # Check the results and print/send the results
-    if channels_not_working != '':
+        # Define the list of the channels' results
+        results = []
+        zap_times = []
+        profile = [] if args.profile or args.profile_dump else None
 
-        # Print the list of broken channels
-        print(f'\n[*] The following channel(s) are not working:\n\n{channels_not_working}')
-        
-        if email_set == 1:
-            send_email(args.smtp_server, args.smtp_port, args.sender, args.receivers, channels_not_working)
+        if history is not None:
+            history_summary(channels_dictionary)
+
+        # Run the checker as a multi-thread executor
+        # The channels recently confirmed dead are checked last
+        if args.engine == 'threads':
+            channels = sorted(channels_dictionary, key=lambda key: cache_lookup(*key.split(':'), count=False) == ('dead', 0))
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                futures = [executor.submit(mass_checker, key) for key in channels]
 
-    # Stop timer
-    finish = time.perf_counter()
+                # Print the result:
+                for item in concurrent.futures.as_completed(futures):
+                    print(item.result())
 
-    # Print the execution time:
-    total_time = round(finish - start, 0)
-    print(f'\n[*] Finished in {total_time:,} second(s)')
+        # Run the checker as a single event loop
+        else:
+            for result in loop_checker(channels_dictionary):
+                print(result)
+
+        # Keep the states and the latencies of the run for the next ones
+        cache_flush()
+        history_save()
+
+        # Print the zap time percentiles across the playlist
+        if args.zap:
+            zap_summary()
+
+        # Print the time spent in each stage
+        if profile is not None:
+            profile_report({key: record['name'] for key, record in channels_dictionary.items()})
+
+        # The channels not checked because of the local errors (not joined) are not alerted
+        not_checked = sum(1 for record in results if record['status'] == 'error')
+        if not_checked:
+            print(f'\n[*] Channel(s) not checked because of the local errors: {not_checked:,}')
+
+        # Check the results and print/send the results
+        channels_not_working = results_summary()
+        if channels_not_working != '' and not (args.shard and not float(args.interval)):
+
+            # Print the list of broken channels
+            print(f'\n[*] The following channel(s) are not working:\n\n{channels_not_working}')
+            
+            if email_set == 1:
+                send_email(args.smtp_server, args.smtp_port, args.sender, args.receivers, channels_not_working)
+
+        # Stop timer
+        finish = time.perf_counter()
+
+        # Print the execution time:
+        total_time = round(finish - start, 0)
+        print(f'\n[*] Finished in {total_time:,} second(s)')
+
+        if exporter is not None:
+            with exporter['lock']:
+                exporter['runs'] += 1
+                exporter['run_duration'] = round(finish - start, 3)
+
+        if not float(args.interval):
+            break
+        time.sleep(max(0, float(args.interval) - (finish - start)))
+        print()
+
+    cache_close()
 
 except KeyboardInterrupt:
     print('\n[*] Script has been closed!')
-    sys.exit()
\ No newline at end of file
+    sys.exit()
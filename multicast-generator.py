@@ -0,0 +1,307 @@
+# Script to send the synthetic MPEG-TS channels to the multicast groups (a local test bed)
+# Please read the manual (run the script with -h parameter)
+#
+# author: Yuri Ponomarev
+# Github: https://github.com/ponwork/
+
+import argparse
+import time
+import socket
+import struct
+import heapq
+import ipaddress
+import random
+import sys
+
+# Setup the command line argument parsing
+parser = argparse.ArgumentParser(description='Script to send the synthetic IPTV UDP streams to test the checker and the scanner')
+
+parser.add_argument("--channels",       help="Number of the channels to send",                  required=False, default=10)
+parser.add_argument("--group",          help="Multicast group of the first channel",            required=False, default='239.255.0.1')
+parser.add_argument("--port",           help="UDP port of the channels",                        required=False, default=1234)
+parser.add_argument("--nic",            help="network interface IP address to send the streams", required=False, default='0.0.0.0')
+parser.add_argument("--ttl",            help="Multicast TTL of the streams",                    required=False, default=1)
+parser.add_argument("--bitrate",        help="Bitrate of each channel in kbps",                 required=False, default=2000)
+parser.add_argument("--gop",            help="Seconds between the keyframes",                   required=False, default=1)
+parser.add_argument("--dead",           help="Channels in the playlist that are never sent",    required=False, default=0)
+parser.add_argument("--late",           help="Channels that start to be sent later",            required=False, default=0)
+parser.add_argument("--late_sec",       help="Seconds to delay the late channels",              required=False, default=5)
+parser.add_argument("--lossy",          help="Channels that lose the datagrams",                required=False, default=0)
+parser.add_argument("--loss",           help="Datagrams lost by the lossy channels in %%",      required=False, default=1)
+parser.add_argument("--unnamed",        help="Channels sent without the SDT (no service_name)", required=False, default=0)
+parser.add_argument("--duration",       help="Seconds to send the streams. Default: till closed", required=False, default=0)
+parser.add_argument("--playlist",       help="Playlist *.m3u file to write with all the channels", required=False)
+parser.add_argument("--rtp",            help="send the TS datagrams in the RTP packets (payload type 33)", required=False, action='store_true')
+
+# The PIDs of the synthetic program
+pmt_pid = 0x1000
+video_pid = 0x0100
+
+# TS packets in one datagram (1316 bytes)
+packets_per_datagram = 7
+
+# ================
+# Define functions
+# ================
+
+def ts_crc_table_creator():
+    """ Create the CRC32/MPEG-2 lookup table for the PSI/SI sections """
+
+    table = []
+    for index in range(256):
+        crc = index << 24
+        for bit in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+
+    return table
+
+ts_crc_table = ts_crc_table_creator()
+
+def ts_crc32(data):
+    """ Calculate the CRC32/MPEG-2 of the given section """
+
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ ts_crc_table[(crc >> 24) ^ byte]
+
+    return crc
+
+def ts_section(table_id, table_id_extension, body):
+    """ Build the PSI/SI section with the CRC32 """
+
+    section_length = 5 + len(body) + 4
+    section = bytes([table_id, 0xB0 | (section_length >> 8), section_length & 0xFF])
+    section += struct.pack('>HBBB', table_id_extension, 0xC1, 0, 0) + body
+
+    return section + struct.pack('>I', ts_crc32(section))
+
+def ts_pat(program_number):
+    """ Build the PAT of the single program """
+
+    return ts_section(0x00, 1, struct.pack('>HH', program_number, 0xE000 | pmt_pid))
+
+def ts_pmt(program_number):
+    """ Build the PMT of the single H.264 program (the video PID carries the PCR) """
+
+    body = struct.pack('>HH', 0xE000 | video_pid, 0xF000)
+    body += bytes([0x1B]) + struct.pack('>HH', 0xE000 | video_pid, 0xF000)
+
+    return ts_section(0x02, program_number, body)
+
+def ts_sdt(program_number, name):
+    """ Build the SDT with the service descriptor of the program """
+
+    provider = b'multicast-generator'
+    name = name.encode()
+    descriptor = bytes([0x48, 3 + len(provider) + len(name), 0x01, len(provider)]) + provider + bytes([len(name)]) + name
+    body = struct.pack('>HB', 1, 0xFF)
+    body += struct.pack('>HBH', program_number, 0xFC, 0x8000 | len(descriptor)) + descriptor
+
+    return ts_section(0x42, 1, body)
+
+def ts_packet(channel, pid, payload, unit_start=False, adaptation=None):
+    """ Build the TS packet with the next continuity counter of the PID """
+
+    counter = channel['continuity'].get(pid, 0)
+    channel['continuity'][pid] = (counter + 1) & 0x0F
+    channel['position'] += 188
+
+    # The adaptation field (the flags and the fields) is stuffed to fill the packet
+    if adaptation is None and len(payload) == 184:
+        control = 0x10
+    else:
+        adaptation = adaptation or b'\x00'
+        stuffing = 183 - len(adaptation) - len(payload)
+        payload = bytes([len(adaptation) + stuffing]) + adaptation + b'\xff' * stuffing + payload
+        control = 0x30
+
+    return bytes([0x47, (0x40 if unit_start else 0) | (pid >> 8), pid & 0xFF, control | counter]) + payload
+
+def psi_packets(channel):
+    """ Build the PAT, PMT and SDT packets of the channel """
+
+    tables = [(0x0000, channel['pat']), (pmt_pid, channel['pmt'])]
+    if channel['sdt'] is not None:
+        tables.append((0x0011, channel['sdt']))
+
+    return [ts_packet(channel, pid, b'\x00' + section + b'\xff' * (183 - len(section)), unit_start=True) for pid, section in tables]
+
+def video_packet(channel, now):
+    """ Build the next video packet: the PCR every 20 ms and the IDR picture every GOP """
+
+    # The PCR of the packet by its byte position at the constant bitrate
+    if now - channel['pcr_time'] < 0.02:
+        return ts_packet(channel, video_pid, b'\x00' * 184)
+    channel['pcr_time'] = now
+    pcr = int(channel['position'] * 8 / channel['bitrate'] * 27000000)
+    base, extension = divmod(pcr, 300)
+    pcr_field = ((base & 0x1FFFFFFFF) << 15) | (0x3F << 9) | extension
+    flags = 0x10
+    payload = b''
+    unit_start = False
+
+    # The keyframe: the random access indicator and the PES with the IDR NAL unit
+    if now >= channel['keyframe_time']:
+        channel['keyframe_time'] = now + float(args.gop)
+        flags |= 0x40
+        unit_start = True
+        payload = b'\x00\x00\x01\xe0\x00\x00\x80\x00\x00' + b'\x00\x00\x00\x01\x65'
+
+    adaptation = bytes([flags]) + pcr_field.to_bytes(6, 'big')
+    payload += b'\x00' * (183 - len(adaptation) - len(payload))
+
+    return ts_packet(channel, video_pid, payload, unit_start, adaptation)
+
+def datagram(channel, now):
+    """ Build the next datagram of the channel: the PSI/SI tables every 100 ms and the video """
+
+    packets = []
+    if now - channel['psi_time'] >= 0.1:
+        channel['psi_time'] = now
+        packets = psi_packets(channel)
+    while len(packets) < packets_per_datagram:
+        packets.append(video_packet(channel, now))
+
+    return b''.join(packets)
+
+def channels_creator():
+    """ Create the channels' states: the roles are given from the end of the list """
+
+    first = ipaddress.IPv4Address(args.group)
+    count = int(args.channels)
+    roles = ['dead'] * int(args.dead) + ['late'] * int(args.late) + ['lossy'] * int(args.lossy) + ['unnamed'] * int(args.unnamed)
+    roles = ['normal'] * max(0, count - len(roles)) + roles[::-1][:count][::-1]
+
+    channels = []
+    for index in range(count):
+        name = f'Channel {index + 1}'
+        channel = {
+            'name': name,
+            'address': str(first + index),
+            'role': roles[index],
+            'bitrate': float(args.bitrate) * 1000,
+            'pat': ts_pat(index + 1),
+            'pmt': ts_pmt(index + 1),
+            'sdt': None if roles[index] == 'unnamed' else ts_sdt(index + 1, name),
+            'continuity': {},
+            'position': 0,
+            'psi_time': 0,
+            'pcr_time': 0,
+            'keyframe_time': 0,
+            'sent': 0,
+            'sequence': random.randrange(65536),
+            'ssrc': random.getrandbits(32),
+        }
+        channels.append(channel)
+
+    return channels
+
+def rtp_packet(channel, data, now):
+    """ Wrap the datagram to the RTP packet: the sequence number goes on for the lost datagrams too """
+
+    header = struct.pack('>BBHII', 0x80, 33, channel['sequence'], int(now * 90000) & 0xFFFFFFFF, channel['ssrc'])
+    channel['sequence'] = (channel['sequence'] + 1) & 0xFFFF
+
+    return header + data
+
+def playlist_writer(playlist, channels):
+    """ Write the playlist of all the channels (the dead ones included) """
+
+    scheme = 'rtp' if args.rtp else 'udp'
+    with open(playlist, 'w') as file:
+        file.write(f'#EXTM3U\n')
+        for channel in channels:
+            file.write(f'#EXTINF:2,{channel["name"]}\n')
+            file.write(f'{scheme}://@{channel["address"]}:{args.port}\n')
+
+def sender(channels):
+    """ Send the datagrams of all the channels paced by their bitrate in one loop """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, int(args.ttl))
+    if args.nic != '0.0.0.0':
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(args.nic))
+
+    start = time.monotonic()
+    end = start + float(args.duration) if float(args.duration) else None
+    interval = packets_per_datagram * 188 * 8 / (float(args.bitrate) * 1000)
+    loss = float(args.loss) / 100
+
+    # The queue of the channels by the time of their next datagram
+    schedule = []
+    for index, channel in enumerate(channels):
+        if channel['role'] == 'dead':
+            continue
+        delay = float(args.late_sec) if channel['role'] == 'late' else 0
+
+        # The tables and the keyframes of the channels are not sent at the same time
+        channel['psi_time'] = start + delay - random.uniform(0, 0.1)
+        channel['keyframe_time'] = start + delay + random.uniform(0, float(args.gop))
+        heapq.heappush(schedule, (start + delay + interval * index / len(channels), index))
+
+    lag = 0
+    while schedule:
+        due, index = heapq.heappop(schedule)
+        now = time.monotonic()
+        if end is not None and now >= end:
+            break
+        if due > now:
+            time.sleep(due - now)
+        else:
+            lag = max(lag, now - due)
+
+        channel = channels[index]
+        data = datagram(channel, due)
+        if args.rtp:
+            data = rtp_packet(channel, data, due)
+
+        # The lossy channel skips the datagram, the continuity counters go on
+        if channel['role'] != 'lossy' or random.random() >= loss:
+            try:
+                sock.sendto(data, (channel['address'], int(args.port)))
+                channel['sent'] += 1
+            except OSError as error:
+                print(f'[*] Unable to send to {channel["address"]}:{args.port}: {error}')
+
+        heapq.heappush(schedule, (due + interval, index))
+
+    sock.close()
+
+    return lag
+
+# ================
+# End of functions
+# ================
+
+# Define the script arguments as a <args> variable
+args = parser.parse_args()
+
+channels = channels_creator()
+
+if args.playlist:
+    playlist_writer(args.playlist, channels)
+
+# Print the totals
+roles = {}
+for channel in channels:
+    roles[channel['role']] = roles.get(channel['role'], 0) + 1
+print(f'[*] Channels: {len(channels)} from {args.group}:{args.port} at {args.bitrate} kbps each')
+print(f"[*] Roles: {', '.join(f'{role} {count}' for role, count in roles.items())}")
+if args.playlist:
+    print(f'[*] Playlist: {args.playlist}')
+sys.stdout.flush()
+
+try:
+
+    # Start timer:
+    start = time.perf_counter()
+
+    lag = sender(channels)
+
+    # Stop timer
+    finish = time.perf_counter()
+    print(f'\n[*] Sent {sum(channel["sent"] for channel in channels):,} datagram(s) in {round(finish - start, 1):,} second(s), maximum lag: {round(lag * 1000):,} ms')
+
+except KeyboardInterrupt:
+    print('\n[*] Script has been closed!')
@@ -14,9 +14,12 @@ import os
 import platform
 import subprocess
 import json
+import sqlite3
 import re
 import sys
 import ipaddress
+import queue
+import threading
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -25,17 +28,36 @@ from email.mime.multipart import MIMEMultipart
 parser = argparse.ArgumentParser(description='Script to check the IPTV UDP streams from m3u playlist')
 
 parser.add_argument("--range",          help="Range of IPs to scan.",                           required=True)
-parser.add_argument("--size",           help="Size of the subnets to divide.",                  required=False, default='32')
+parser.add_argument("--size",           help="Not used: the work is spread between --workers",  required=False, default='32')
+parser.add_argument("--workers",        help="Items scanned at once in the sequential mode",    required=False, default=64)
+parser.add_argument("--probe_workers",  help="Found streams probed at once for the stream's info", required=False, default=8)
 parser.add_argument("--playlist",       help="Playlist *.m3u file with UDP streams",            required=False)
-parser.add_argument("--nic",            help="network interface IP address with UDP stream",    required=False, default='0.0.0.0')
+parser.add_argument("--nic",            help="network interface IP address(es) with UDP stream (space separated)", required=False, default=['0.0.0.0'], nargs='+')
+parser.add_argument("--processes",      help="Shard processes to scan the range. Default: one per --nic", required=False, default=0)
+parser.add_argument("--shard",          help=argparse.SUPPRESS,                                 required=False)
 parser.add_argument("--udp_timeout",    help="Time to wait in seconds for the UPD port reply",  required=False, default=5)
 parser.add_argument("--port",           help="addtional UDP port to scan. Default: 1234",       required=False, default=['1234'], nargs='+')
 parser.add_argument("--sample_sec",     help="Sample lenght in seconds",                        required=False, default=60)
+parser.add_argument("--sample_size",    help="Maximum sample size in MB",                       required=False, default=100)
+parser.add_argument("--sample_workers", help="Unnamed channels recorded at once",               required=False, default=4)
 parser.add_argument("--info_timeout",   help="Time to wait in seconds for the stream's info",   required=False, default=10)
 parser.add_argument("--smtp_server",    help="SMTP server to send an email",                    required=False)
 parser.add_argument("--smtp_port",      help="Port for SMTP server",                            required=False, default=25)
 parser.add_argument("--sender",         help="email address for email sender",                  required=False)
 parser.add_argument("--receivers",      help="emails of the receivers (space separated)",       required=False, nargs='+')
+parser.add_argument("--resume",         help="continue the scan from the checkpoint journal",   required=False, action='store_true')
+parser.add_argument("--ffprobe",        help="use ffprobe if no stream's info found natively",  required=False, action='store_true')
+parser.add_argument("--cache",          help="SQLite file to cache the channels' states and info", required=False)
+parser.add_argument("--cache_ttl",      help="Seconds to reuse the cached info of alive channels", required=False, default=3600)
+parser.add_argument("--cache_dead_ttl", help="Seconds to trust the cached dead channels",       required=False, default=600)
+parser.add_argument("--cache_max_age",  help="Seconds to keep the cache entries before eviction", required=False, default=604800)
+parser.add_argument("--profile",        help="print the time spent in each stage of the scan",  required=False, action='store_true')
+parser.add_argument("--profile_dump",   help="NDJSON file to write the raw stage timings to",  required=False)
+parser.add_argument("--mode",           help="scan mode: groups batch per port socket, one by one or any port capture", required=False, default='multiplex', choices=['multiplex', 'sequential', 'discover'])
+parser.add_argument("--batch",          help="groups joined at once per port (discover: 256). Default: kernel limit", required=False)
+parser.add_argument("--join_rate",      help="IGMP joins per second per port. Default: no limit",  required=False, default=0)
+parser.add_argument("--progress",       help="Seconds between the progress lines. 0: no progress", required=False, default=10)
+parser.add_argument("--heartbeat",      help="NDJSON file to append the progress records to",   required=False)
 
 # Define the variable for the channels dictionary
 channels_dictionary = []
@@ -43,6 +65,12 @@ channels_dictionary = []
 # Define the variable for the list of the channels without names 
 unnamed_channels_dictionary = []
 
+# Define the set of the (IP, port) streams sent in the RTP packets
+rtp_streams = set()
+
+# Define the event to stop the scanning threads
+stop_event = threading.Event()
+
 # ================
 # Define functions
 # ================
@@ -60,17 +88,63 @@ def seconds_humanize(input_seconds):
 
     return days, hours, minutes, seconds
 
-def get_ffmpeg_sample(address, port):
-    """ To get the stream sample """
+def get_sample(address, port):
+    """ To record the raw TS sample of the stream straight from the socket (sample stage) """
 
     global args
 
+    sampleFile = f'sample_{address}-{port}.ts'
+    duration = float(args.sample_sec)
+    size_max = int(float(args.sample_size) * 1024 * 1024) // 188 * 188
+
+    # The datagrams are received one after another into the 1 MB buffer
+    # and the filled buffer is written to the file with one unbuffered write
+    buffer = bytearray(1024 * 1024)
+    view = memoryview(buffer)
+    filled = 0
+    written = 0
+
+    started = time.perf_counter()
+    sock = socket_creator(args.nic, address, port, os_name)
     try:
-        subprocess.run([f'ffmpeg -v quiet -y -i udp://@{address}:{port} -t {args.sample_sec} sample_{address}-{port}.mp4'], \
-                        shell=True, stdin=None, stdout=None, stderr=None)
-    except:
-        print(f'[*] !!! Error with saving the file: sample_{address}-{port}.mp4 !!!')
-        sys.exit()   
+        with open(sampleFile, 'wb', buffering=0) as file:
+            deadline = time.monotonic() + duration
+            while written + filled < size_max and not stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                ready = select.select([sock], [], [], min(remaining, float(args.udp_timeout)))
+                if not ready[0]:
+                    break
+                size = sock.recv_into(view[filled:])
+
+                # The RTP header is removed: the sample is the plain TS
+                payload = rtp_payload(view[filled:filled + size])
+                if len(payload) != size:
+                    view[filled:filled + len(payload)] = payload
+                filled += len(payload)
+
+                # Keep the room for the largest datagram
+                if len(buffer) - filled < 65536:
+                    written += file.write(view[:min(filled, size_max - written)])
+                    filled = 0
+
+            written += file.write(view[:min(filled, size_max - written)])
+
+    except OSError as error:
+        print(f'[*] !!! Error with saving the file: {sampleFile}: {error} !!!')
+        return None
+    finally:
+        sock.close()
+        profile_add('sample', address, port, time.perf_counter() - started)
+
+    # The stream has gone since the scan
+    if written == 0:
+        os.remove(sampleFile)
+        print(f'[*] !!! No data for the sample of {address}:{port} !!!')
+        return None
+
+    print(f'[*] !!! Sample for {address}:{port} captured: {sampleFile} ({written / 1024 / 1024:,.1f} MB) !!!')
 
 def get_ffprobe(address, port):
     """ To get the json data from ip:port """
@@ -78,10 +152,11 @@ def get_ffprobe(address, port):
     global args
 
     # Run the ffprobe with given IP and PORT with a given timeout to execute
+    started = time.perf_counter()
     try:
         
         # Capture the output from ffprobe
-        result = subprocess.run(['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_programs', f'udp://@{address}:{port}'], capture_output=True, text=True, timeout=args.info_timeout)
+        result = subprocess.run(['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_programs', f'udp://@{address}:{port}'], capture_output=True, text=True, timeout=float(args.info_timeout))
         
         # Convert the STDOUT to JSON
         json_string = json.loads(str(result.stdout))
@@ -89,7 +164,15 @@ def get_ffprobe(address, port):
     except:
         print(f'[*] No data found for {address}:{port}')
         return 0
+
+    finally:
+        profile_add('ffprobe', address, port, time.perf_counter() - started)
     
+    return programs_parser(json_string, address, port)
+
+def programs_parser(json_string, address, port):
+    """ To get the channel name from the ffprobe-like json data """
+
     # Parse the JSON "PROGRAMS" section
     for program in json_string['programs']:
         
@@ -120,113 +203,1196 @@ def get_ffprobe(address, port):
                 print(f'[*] No stream found for {address}:{port}')
                 return 0
 
-def create_file(range):
-    """ Prepare the resulting playlist file """
+    print(f'[*] No data found for {address}:{port}')
+    return 0
+
+# MPEG-TS stream types (ISO/IEC 13818-1 and ATSC A/52) in the ffprobe's naming
+ts_stream_types = {
+    0x01: ('video', 'mpeg1video'),
+    0x02: ('video', 'mpeg2video'),
+    0x03: ('audio', 'mp2'),
+    0x04: ('audio', 'mp2'),
+    0x06: ('data', 'private'),
+    0x0F: ('audio', 'aac'),
+    0x10: ('video', 'mpeg4'),
+    0x11: ('audio', 'aac_latm'),
+    0x1B: ('video', 'h264'),
+    0x24: ('video', 'hevc'),
+    0x81: ('audio', 'ac3'),
+    0x87: ('audio', 'eac3'),
+}
+
+def ts_crc_table_creator():
+    """ Create the CRC32/MPEG-2 lookup table for the PSI/SI sections """
+
+    table = []
+    for index in range(256):
+        crc = index << 24
+        for bit in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+
+    return table
+
+ts_crc_table = ts_crc_table_creator()
+
+def ts_crc32(data):
+    """ Calculate the CRC32/MPEG-2 of the given section """
+
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ ts_crc_table[(crc >> 24) ^ byte]
+
+    return crc
+
+# The character tables of the DVB SI text strings by their first byte (ETSI EN 300 468 Annex A):
+# 0x01-0x0B are ISO/IEC 8859-5 to 8859-15 (no 8859-12), 0x10 0x00 NN is ISO/IEC 8859-NN
+ts_text_tables = {index: f'iso8859-{index + 4}' for index in range(0x01, 0x0C) if index != 0x08}
+ts_text_tables.update({0x11: 'utf-16-be', 0x12: 'euc-kr', 0x13: 'gb2312', 0x14: 'big5', 0x15: 'utf-8'})
+
+def ts_text(data):
+    """ Decode the DVB SI text string (ETSI EN 300 468 Annex A) """
+
+    if not data:
+        return ''
+
+    # The character table selection bytes
+    codec = None
+    if data[0] == 0x10 and len(data) >= 3:
+        codec, data = f'iso8859-{data[2]}', data[3:]
+    elif data[0] == 0x1F:
+        data = data[2:]
+    elif data[0] < 0x20:
+        codec, data = ts_text_tables.get(data[0]), data[1:]
+
+    if codec is not None:
+        try:
+            return data.decode(codec)
+        except (LookupError, UnicodeDecodeError):
+            pass
+
+    # The default table (ISO/IEC 6937) is decoded as UTF-8 or Latin-1
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+def ts_demuxer():
+    """ Create a state of the MPEG-TS demuxer """
+
+    return {
+        'pat': None,            # program_number -> PMT PID
+        'pmt': {},              # program_number -> PMT data
+        'sdt': None,            # service_id -> (provider, service name)
+        'sections': {},         # PID -> buffer of the incomplete section
+        'packets': 0,           # number of TS packets demuxed
+        'psi_time': None,       # time when the PAT and all the PMTs were received
+    }
+
+def ts_section_parser(demuxer, section):
+    """ Parse the complete PAT, PMT or SDT section """
+
+    # Drop the broken sections
+    if ts_crc32(section) != 0:
+        return
+
+    table_id = section[0]
+    section_end = len(section) - 4
+
+    # Program Association Table
+    if table_id == 0x00:
+        pat = demuxer['pat'] or {}
+        for offset in range(8, section_end, 4):
+            program_number = (section[offset] << 8) | section[offset + 1]
+            pid = ((section[offset + 2] & 0x1F) << 8) | section[offset + 3]
+            if program_number != 0:
+                pat[program_number] = pid
+        demuxer['pat'] = pat
+
+    # Program Map Table
+    elif table_id == 0x02:
+        program_number = (section[3] << 8) | section[4]
+        pcr_pid = ((section[8] & 0x1F) << 8) | section[9]
+        offset = 12 + (((section[10] & 0x0F) << 8) | section[11])
+        streams = []
+        while offset + 5 <= section_end:
+            stream_type = section[offset]
+            pid = ((section[offset + 1] & 0x1F) << 8) | section[offset + 2]
+            streams.append((pid, stream_type))
+            offset += 5 + (((section[offset + 3] & 0x0F) << 8) | section[offset + 4])
+        demuxer['pmt'][program_number] = {'pcr_pid': pcr_pid, 'streams': streams}
+
+    # Service Description Table (actual transport stream)
+    elif table_id == 0x42:
+        sdt = demuxer['sdt'] or {}
+        offset = 11
+        while offset + 5 <= section_end:
+            service_id = (section[offset] << 8) | section[offset + 1]
+            descriptors_end = min(section_end, offset + 5 + (((section[offset + 3] & 0x0F) << 8) | section[offset + 4]))
+            offset += 5
+            while offset + 2 <= descriptors_end:
+                tag, length = section[offset], section[offset + 1]
+                descriptor_end = offset + 2 + length
+                if descriptor_end > descriptors_end:
+                    break
+
+                # Service descriptor: the type, the provider and the name (skipped if their lengths overrun it)
+                if tag == 0x48 and length >= 3:
+                    provider_end = offset + 4 + section[offset + 3]
+                    name_end = provider_end + 1 + section[provider_end] if provider_end < descriptor_end else descriptor_end + 1
+                    if name_end <= descriptor_end:
+                        provider = section[offset + 4:provider_end]
+                        name = section[provider_end + 1:name_end]
+                        sdt[service_id] = (ts_text(bytes(provider)), ts_text(bytes(name)))
+                offset = descriptor_end
+            offset = descriptors_end
+        demuxer['sdt'] = sdt
+
+def ts_demux(demuxer, data):
+    """ Feed the datagram of 188-bytes TS packets to the demuxer """
+
+    pat = demuxer['pat'] or {}
+    psi_pids = {0x0000, 0x0011} | set(pat.values())
+    sections = demuxer['sections']
+
+    for offset in range(0, len(data) - 187, 188):
+
+        # Check the sync byte
+        if data[offset] != 0x47:
+            continue
+
+        demuxer['packets'] += 1
+        pid = ((data[offset + 1] & 0x1F) << 8) | data[offset + 2]
+        if pid not in psi_pids:
+            continue
+
+        # Skip the adaptation field and the packets without payload
+        adaptation = (data[offset + 3] >> 4) & 0x03
+        if adaptation == 0x02 or adaptation == 0x00:
+            continue
+        start = offset + 4
+        if adaptation == 0x03:
+            start += 1 + data[start]
+        payload = data[start:offset + 188]
+        if not payload:
+            continue
+
+        # Payload unit start: finish the previous section and start the new one
+        if data[offset + 1] & 0x40:
+            pointer = payload[0]
+            if pid in sections:
+                sections[pid] += payload[1:1 + pointer]
+                ts_sections_flush(demuxer, pid)
+            sections[pid] = bytearray(payload[1 + pointer:])
+        elif pid in sections:
+            sections[pid] += payload
+        else:
+            continue
+
+        ts_sections_flush(demuxer, pid)
+
+        # The PAT could bring the new PMT PIDs
+        if pid == 0x0000 and demuxer['pat']:
+            psi_pids |= set(demuxer['pat'].values())
+
+def ts_sections_flush(demuxer, pid):
+    """ Parse all the complete sections buffered for the given PID """
+
+    buffer = demuxer['sections'][pid]
+    while len(buffer) >= 3 and buffer[0] != 0xFF:
+        section_length = 3 + (((buffer[1] & 0x0F) << 8) | buffer[2])
+        if len(buffer) < section_length:
+            break
+        ts_section_parser(demuxer, buffer[:section_length])
+        del buffer[:section_length]
+
+    # Stuffing bytes till the end of the packet
+    if buffer[:1] == b'\xff':
+        buffer.clear()
+
+def ts_demuxer_ready(demuxer, with_sdt=True):
+    """ Check that the PAT, all the PMTs and the SDT were received """
+
+    if not demuxer['pat']:
+        return False
+    if not all(program in demuxer['pmt'] for program in demuxer['pat']):
+        return False
+    if with_sdt and demuxer['sdt'] is None:
+        return False
+
+    return True
+
+def ts_demuxer_deadline(demuxer, deadline):
+    """ Get the time till the demuxer needs the data, not later than the given deadline """
+
+    # The SDT is repeated at least every 2 seconds (ETSI TR 101 290), so don't wait longer for it
+    if demuxer['psi_time'] is None and ts_demuxer_ready(demuxer, with_sdt=False):
+        demuxer['psi_time'] = time.monotonic()
+    if demuxer['psi_time'] is not None:
+        deadline = min(deadline, demuxer['psi_time'] + 2)
+
+    return deadline
+
+def ts_demuxer_programs(demuxer):
+    """ Convert the demuxer state to the ffprobe's '-show_programs' json format """
+
+    programs = []
+    index = 0
+    sdt = demuxer['sdt'] or {}
+
+    for program_number, pmt_pid in sorted((demuxer['pat'] or {}).items()):
+        pmt = demuxer['pmt'].get(program_number)
+        if pmt is None:
+            continue
+
+        streams = []
+        for pid, stream_type in pmt['streams']:
+            codec_type, codec_name = ts_stream_types.get(stream_type, ('unknown', 'unknown'))
+            streams.append({'index': index, 'codec_name': codec_name, 'codec_type': codec_type, 'id': f'0x{pid:x}', 'stream_type': f'0x{stream_type:02x}'})
+            index += 1
+
+        program = {'program_id': program_number, 'program_num': program_number, 'nb_streams': len(streams), 'pmt_pid': pmt_pid, 'pcr_pid': pmt['pcr_pid'], 'tags': {}, 'streams': streams}
+        if program_number in sdt:
+            program['tags'] = {'service_name': sdt[program_number][1], 'service_provider': sdt[program_number][0]}
+        programs.append(program)
+
+    return {'programs': programs}
+
+def rtp_payload(data):
+    """ Get the payload of the RTP datagram (the TS datagram as is) """
+
+    # The TS datagram starts with the sync byte, the RTP header with the version 2
+    if len(data) < 12 or data[0] >> 6 != 2:
+        return data
+
+    # The fixed header, the CSRCs, the extension and the padding
+    header = 12 + (data[0] & 0x0F) * 4
+    if data[0] & 0x10:
+        if len(data) < header + 4:
+            return data[:0]
+        header += 4 + int.from_bytes(data[header + 2:header + 4], 'big') * 4
+    end = len(data) - (data[-1] if data[0] & 0x20 else 0)
+    if header > end:
+        return data[:0]
+
+    return data[header:end]
+
+def rtp_detect(sock):
+    """ Check that the queued datagram of the socket is the RTP packet (without reading it) """
+
+    try:
+        first = sock.recv(1, socket.MSG_PEEK | getattr(socket, 'MSG_DONTWAIT', 0))
+    except OSError:
+        return False
+
+    return len(first) == 1 and first[0] >> 6 == 2
+
+def get_ts_info(sock):
+    """ To get the json data from the joined socket using the built-in MPEG-TS demuxer """
+
+    global args
+
+    demuxer = ts_demuxer()
+
+    # The datagrams are received into one reusable buffer, nothing is accumulated
+    buffer = bytearray(65536)
+    view = memoryview(buffer)
+
+    # Read the datagrams till the PSI/SI tables are complete or the timeout is reached
+    deadline = time.monotonic() + float(args.info_timeout)
+    try:
+        while not ts_demuxer_ready(demuxer):
+            remaining = ts_demuxer_deadline(demuxer, deadline) - time.monotonic()
+            if remaining <= 0:
+                break
+            ready = select.select([sock], [], [], remaining)
+            if not ready[0]:
+                break
+            size = sock.recv_into(buffer)
+            ts_demux(demuxer, rtp_payload(view[:size]))
+    finally:
+        sock.close()
+
+    return ts_demuxer_programs(demuxer)
+
+def get_stream_info(sock, address, port):
+    """ To get the channel name from the socket already joined to ip:port """
+
+    global args
+
+    # Use the built-in demuxer first and ffprobe as a fallback (not for the RTP streams)
+    # The socket is closed by the demuxer, so ffprobe joins the group again only in this case
+    if rtp_detect(sock):
+        rtp_streams.add((str(address), str(port)))
+    started = time.perf_counter()
+    programs = get_ts_info(sock)
+    profile_add('info', address, port, time.perf_counter() - started)
+    info = programs_parser(programs, address, port)
+    if info == 0 and args.ffprobe and (str(address), str(port)) not in rtp_streams:
+        info = get_ffprobe(address, port)
+
+    cache_put(address, port, 'alive', info, programs_pids(programs))
+
+    return info
+
+def programs_pids(json_string):
+    """ Get the list of the streams' PIDs from the ffprobe-like json data """
+
+    pids = []
+    for program in json_string.get('programs', []):
+        for stream in program.get('streams', []):
+            try:
+                pids.append(int(str(stream['id']), 16))
+            except (KeyError, ValueError):
+                pass
+
+    return pids
+
+# The cache updates are written in one transaction every second or every 500 updates:
+# the processes sharing the file hold its write lock only for the flush
+cache_interval = 1
+cache_batch = 500
+
+def cache_open(path):
+    """ Open the channels cache (SQLite file) and evict the outdated entries """
+
+    global args
+
+    # The readers of the shard processes sharing the file do not wait for the writer (WAL)
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('CREATE TABLE IF NOT EXISTS channels (channel TEXT PRIMARY KEY, state TEXT, info TEXT, pids TEXT, last_seen REAL, checked REAL)')
+    try:
+        with connection:
+            evicted = connection.execute('DELETE FROM channels WHERE checked < ?', (time.time() - float(args.cache_max_age),)).rowcount
+    except sqlite3.OperationalError as error:
+        print(f'[*] Unable to evict the outdated cache entries: {error}')
+        evicted = 0
+
+    return {'connection': connection, 'lock': threading.Lock(), 'hits': 0, 'misses': 0, 'writes': 0, 'evicted': evicted,
+            'pending': [], 'flushed': time.monotonic()}
+
+def cache_lookup(address, port, count=True):
+    """ Get the fresh cached state of ip:port: ('alive', info), ('dead', 0) or None """
+
+    global cache
+
+    if cache is None:
+        return None
+
+    with cache['lock']:
+        row = cache['connection'].execute('SELECT state, info, checked FROM channels WHERE channel = ?', (f'{address}:{port}',)).fetchone()
+
+        # Only the channels with the stream's info are reused, the dead ones are skipped for a shorter time
+        result = None
+        if row is not None:
+            state, info, checked = row
+            age = time.time() - checked
+            if state == 'alive' and age < float(args.cache_ttl) and json.loads(info) != 0:
+                result = ('alive', json.loads(info))
+            elif state == 'dead' and age < float(args.cache_dead_ttl):
+                result = ('dead', 0)
+
+        if not count:
+            pass
+        elif result is None:
+            cache['misses'] += 1
+        else:
+            cache['hits'] += 1
+
+    return result
+
+def cache_put(address, port, state, info=0, pids=None):
+    """ Record the checked state of ip:port to the cache """
+
+    global cache
+
+    if cache is None:
+        return
+
+    now = time.time()
+    with cache['lock']:
+        if state == 'alive':
+            cache['pending'].append((f'{address}:{port}', state, json.dumps(info), json.dumps(pids or []), now, now))
+        else:
+            cache['pending'].append((f'{address}:{port}', state, json.dumps(info), json.dumps(pids or []), now))
+        cache['writes'] += 1
+        flush = len(cache['pending']) >= cache_batch or time.monotonic() - cache['flushed'] >= cache_interval
+
+    if flush:
+        cache_flush()
+
+def cache_flush():
+    """ Write the pending updates to the cache in one short transaction (kept for the next flush if the file is locked) """
+
+    global cache
+
+    if cache is None:
+        return
+
+    with cache['lock']:
+        rows, cache['pending'] = cache['pending'], []
+        cache['flushed'] = time.monotonic()
+        if not rows:
+            return
+
+        try:
+            with cache['connection']:
+                for row in rows:
+                    if len(row) == 6:
+                        cache['connection'].execute('INSERT OR REPLACE INTO channels VALUES (?, ?, ?, ?, ?, ?)', row)
+                    else:
+                        cache['connection'].execute('INSERT INTO channels VALUES (?, ?, ?, ?, NULL, ?) ON CONFLICT(channel) DO UPDATE SET state = excluded.state, checked = excluded.checked', row)
+        except sqlite3.OperationalError as error:
+            print(f'[*] Unable to write the cache: {error}')
+            cache['pending'] = rows + cache['pending']
+
+def cache_close():
+    """ Commit and close the cache, print the statistics """
+
+    global cache
+
+    if cache is None:
+        return
+
+    cache_flush()
+    with cache['lock']:
+        cache['connection'].close()
+
+    print(f'[*] Cache: {cache["hits"]:,} hit(s), {cache["misses"]:,} miss(es), {cache["writes"]:,} update(s), {cache["evicted"]:,} evicted')
+
+def create_file(range, shard=None):
+    """ Prepare the resulting playlist: the channels are kept in memory and the file is replaced atomically """
 
     #define the current directory
     currentPath = os.path.dirname(os.path.realpath(__file__))
 
-    # Define the playlist file name
-    playlistFileName = f'scan_results_range_{range.split("/")[0]}-{range.split("/")[1]}.m3u'
+    # Define the playlist file name (each shard process has its own one)
+    suffix = f'_shard{shard}' if shard is not None else ''
+    playlistFileName = f'scan_results_range_{range.split("/")[0]}-{range.split("/")[1]}{suffix}.m3u'
     playlistFile = os.path.join(currentPath, playlistFileName)
 
-    # Open the playlist file and add the first line (header)
-    with open(playlistFile, 'w') as file:
-        file.write(f'#EXTM3U\n')
+    # The state of the single writer: the lines of the channels, the counts and the last commit
+    # (the commits of the write stage and the final one of the main thread are serialized by the lock)
+    playlist_output = {'name': playlistFile, 'temp': playlistFile + '.tmp', 'lines': ['#EXTM3U\n'], 'count': 0, 'unnamed': 0,
+                       'duplicates': 0, 'dirty': False, 'committed': time.monotonic(), 'commits': 0, 'lock': threading.Lock()}
+
+    return playlistFileName, playlistFile, playlist_output
+
+def playlist_commit(force=False):
+    """ Write the playlist to the temporary file in one call and rename it over the resulting file """
+
+    global playlist_output
+
+    with playlist_output['lock']:
+        if not playlist_output['dirty'] and not force:
+            return
+
+        # The lines added during the write are committed the next time
+        playlist_output['dirty'] = False
+        with open(playlist_output['temp'], 'w') as file:
+            file.write(''.join(playlist_output['lines']))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(playlist_output['temp'], playlist_output['name'])
+
+        playlist_output['committed'] = time.monotonic()
+        playlist_output['commits'] += 1
+
+def playlist_checkpoint():
+    """ Commit the new channels of the playlist not more often than the checkpoint interval """
 
-    return playlistFileName, playlistFile
+    if time.monotonic() - playlist_output['committed'] >= playlist_interval:
+        playlist_commit()
 
 def playlist_add(ip, port, name):
-    """ Add the given IP and port to the playlist file"""
+    """ Add the given IP and port to the playlist (the write stage is the only writer) """
 
-    # Define the full name/path to the playlist file
-    global playlistFile
+    started = time.perf_counter()
+    try:
+        return playlist_writer(ip, port, name)
+    finally:
+        profile_add('playlist', ip, port, time.perf_counter() - started)
+
+def playlist_writer(ip, port, name):
+    """ Add the channel's lines to the playlist in memory """
+
+    # Define the state of the resulting playlist
+    global playlist_output
 
     # Define the given dictionary
     global channels_dictionary
 
-    # Check the name variable%
+    # Check the name variable
     if type(name) is int:
         channel_string = f'#EXTINF:2,Channel: {ip}:{port}\n'
     else:
         channel_string = f'#EXTINF:2,{name}\n'
 
-    
-    # Open the file
-    with open(playlistFile, 'a') as file:
+    # Check if the playlist was provided:
+    if args.playlist and f'{str(ip)}:{port}' in channels_dictionary:
+        playlist_output['duplicates'] += 1
+        print(f'[*] The channel is already in the playlist: {ip}:{port} >>> {name}')
+        return 0
+
+    # Add the channel name line and the channel address
+    scheme = 'rtp' if (str(ip), str(port)) in rtp_streams else 'udp'
+    playlist_output['lines'].append(channel_string + f'{scheme}://@{ip}:{port}\n')
+    playlist_output['count'] += 1
+    if type(name) is int:
+        playlist_output['unnamed'] += 1
+    playlist_output['dirty'] = True
+
+    print(f'[*] !!! Channel added to the playlist. {ip}:{port} >>> {name} !!!')
+
+    return 0
+
+def profile_add(stage, address, port, seconds):
+    """ Record the time of the stage for the item (no lock: the list append is atomic) """
+
+    if profile is not None:
+        profile.append((stage, f'{address}:{port}', seconds))
+
+def percentile(values, percent):
+    """ Get the nearest-rank percentile of the sorted values """
+
+    return values[max(0, -(-len(values) * percent // 100) - 1)]
+
+def profile_report():
+    """ Print the time spent in each stage: totals, percentiles and the slowest items (--profile), dump the raw timings """
+
+    # The report of the --profile (the --profile_dump alone writes the raw timings only)
+    if args.profile:
+        stages = {}
+        for stage, item, seconds in profile:
+            stages.setdefault(stage, []).append(seconds)
+
+        print(f'\n[*] Profile of {len(profile):,} timing(s):')
+        print(f'[*] {"stage":<14}{"count":>8}{"total, s":>12}{"p50, ms":>10}{"p90, ms":>10}{"p99, ms":>10}{"max, ms":>10}')
+        for stage, values in stages.items():
+            values.sort()
+            print(f'[*] {stage:<14}{len(values):>8,}{sum(values):>12,.3f}' + ''.join(f'{percentile(values, percent) * 1000:>10,.1f}' for percent in (50, 90, 99)) + f'{values[-1] * 1000:>10,.1f}')
+
+        slowest = sorted((item for item in profile if item[0] in ('info', 'ffprobe')), key=lambda item: item[2], reverse=True)[:10]
+        if slowest:
+            print(f'[*] Slowest probes:')
+            for stage, item, seconds in slowest:
+                print(f'[*] {seconds * 1000:>10,.1f} ms >>> {item} ({stage})')
+
+    # The raw timings for the offline analysis
+    if args.profile_dump:
+        with open(args.profile_dump, 'a') as file:
+            for stage, item, seconds in profile:
+                file.write(json.dumps({'stage': stage, 'item': item, 'seconds': round(seconds, 6)}) + '\n')
+        print(f'[*] Raw timings: {args.profile_dump}')
+
+def scan_result(ip, port, info):
+    """ Add the found stream to the playlist """
+
+    if info == 0: # No metadata found for the stream
         
-        # Check if the playlist was provided:
-        if args.playlist:
-            if f'{str(ip)}:{port}' not in list(channels_dictionary.values()):
-                
-                # Add the channel name line
-                file.write(channel_string)
+        pass
 
-                #Add the channel address
-                file.write(f'udp://@{ip}:{port}\n')
+    elif info == 1: # Stream captured but without channel name
 
-                print(f'[*] !!! Channel added to the playlist. {ip}:{port} >>> {name} !!!')
+        playlist_add(ip, port, info)
+        unnamed_channels_dictionary.append(f'{ip}:{port}')
 
-                return 0
-                            
-            else:
-                print(f'[*] The channel is already in the playlist: {ip}:{port} >>> {name}')
-                return 0
+        # Record the sample while the scan goes on
+        pipeline_put(sample_stage, (ip, port))
+
+    else: # Stream captured with the channel name
+        playlist_add(ip, port, info)
+
+def journal_open(playlistFile, resume):
+    """ Open the append-only checkpoint journal of the scan, load the finished work if resumed """
+
+    journalFile = os.path.splitext(playlistFile)[0] + '.journal'
+    journal = {'name': journalFile, 'lock': threading.Lock(), 'done': set(), 'counts': {}, 'channels': [], 'found': set(), 'pairs': []}
+
+    if resume and os.path.isfile(journalFile):
+        with open(journalFile) as file:
+            for line in file:
+
+                # The last line could be cut by a crash
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+
+                if 'block' in record:
+                    journal['done'].add((record['port'], record['block']))
+                elif 'channel' in record:
+                    journal['channels'].append(record['channel'])
+                    journal['found'].add(tuple(record['channel'][:2]))
+                elif 'pair' in record:
+                    journal['pairs'].append(tuple(record['pair']))
+
+    journal['file'] = open(journalFile, 'a' if resume else 'w')
+
+    return journal
+
+def journal_write(record):
+    """ Append the record to the checkpoint journal """
+
+    global journal
+
+    with journal['lock']:
+        if not journal['file'].closed:
+            journal['file'].write(json.dumps(record) + '\n')
+            journal['file'].flush()
+
+def journal_done(ip, port):
+    """ Count the scanned item and record its block in the journal when the block is completed """
+
+    global journal
+
+    index = (int(ipaddress.IPv4Address(ip)) - int(ip_list.network_address)) // journal_block
+    block_size = min(journal_block, ip_list.num_addresses - index * journal_block)
+    key = (str(port), index)
+
+    with journal['lock']:
+        journal['counts'][key] = journal['counts'].get(key, 0) + 1
+        completed = journal['counts'][key] == block_size
+        if completed:
+            del journal['counts'][key]
+
+    if completed:
+        journal_write({'block': index, 'port': str(port)})
+
+    progress_add('done')
+
+def range_ips(ip_list, port):
+    """ Lazily yield the IPs of the range for the port, skipping the blocks finished before or of the other shards """
+
+    start = int(ip_list.network_address)
+    for block_start in range(0, ip_list.num_addresses, journal_block):
+        if (str(port), block_start // journal_block) in journal['done']:
+            continue
+
+        # The blocks of the other shard processes
+        if (block_start // journal_block) % shard_count != shard_index:
+            continue
+        for offset in range(block_start, min(block_start + journal_block, ip_list.num_addresses)):
+            yield ipaddress.IPv4Address(start + offset)
+
+def scan_items(ip_list, port_list):
+    """ Lazily yield the (ip, port) items to scan """
+
+    for port in port_list:
+        for ip in range_ips(ip_list, port):
+            yield str(ip), port
+
+def bounded_scheduler(function, items, workers):
+    """ Run the function for the items keeping only the given number of tasks in flight """
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        running = set()
+        for item in items:
+
+            # Wait for a free worker before taking the next item
+            if len(running) >= workers:
+                done, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+            running.add(executor.submit(function, *item))
+
+        for future in concurrent.futures.as_completed(running):
+            yield future.result()
+
+def progress_total(ip_list, port_list):
+    """ Count the items to scan: the blocks of this shard not finished before """
+
+    total = 0
+    for port in port_list:
+        for block_start in range(0, ip_list.num_addresses, journal_block):
+            if (str(port), block_start // journal_block) in journal['done']:
+                continue
+            if (block_start // journal_block) % shard_count != shard_index:
+                continue
+            total += min(journal_block, ip_list.num_addresses - block_start)
+
+    return total
+
+def progress_add(counter):
+    """ Count the scanned item or the found stream """
+
+    if progress is not None:
+        with progress['lock']:
+            progress[counter] += 1
+
+def progress_estimate(done, now):
+    """ Update the throughput smoothed by EWMA with the items done since the last report, get the seconds left (None: unknown) """
+
+    rate = (done - progress['last_done']) / (now - progress['last_time'])
+    progress['rate'] = rate if progress['rate'] is None else progress_alpha * rate + (1 - progress_alpha) * progress['rate']
+    progress['last_done'], progress['last_time'] = done, now
+
+    return (progress['total'] - done) / progress['rate'] if progress['rate'] else None
+
+def progress_reporter():
+    """ Print the progress line and the heartbeat record every --progress seconds till the scan is done """
+
+    interval = float(args.progress)
+    while not progress['stop'].wait(interval):
+        now = time.monotonic()
+        with progress['lock']:
+            done, hits = progress['done'], progress['hits']
+
+        # The throughput is smoothed (EWMA) to project the time left
+        eta = progress_estimate(done, now)
+        backlog = probe_stage['queue'].qsize() if probe_stage is not None else 0
+        percent = done / progress['total'] * 100 if progress['total'] else 100
+
+        if eta is None:
+            eta_string = 'unknown'
+        else:
+            days, hours, minutes, seconds = seconds_humanize(int(eta))
+            eta_string = f'{int(days)}d {int(hours)}h {int(minutes)}m {int(seconds)}s' if days else f'{int(hours)}h {int(minutes)}m {int(seconds)}s'
+        print(f'[*] Progress: {done:,}/{progress["total"]:,} ({percent:.1f}%) >>> hits: {hits:,}, channels: {playlist_output["count"]:,}, '
+              f'probe backlog: {backlog:,} >>> {progress["rate"]:,.1f} items/s >>> ETA: {eta_string}')
+
+        if args.heartbeat:
+            record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'range': args.range, 'shard': shard_index, 'done': done, 'total': progress['total'],
+                      'hits': hits, 'channels': playlist_output['count'], 'probe_backlog': backlog, 'rate': round(progress['rate'], 2),
+                      'eta': round(eta) if eta is not None else None}
+            with open(args.heartbeat, 'a') as file:
+                file.write(json.dumps(record) + '\n')
+
+def item_scanner(ip, port):
+    """ Sweep the given IP and port: pass the opened socket of the found stream to the probe stage """
+
+    global probe_stage
+    global write_stage
+
+    # Skip the item recently confirmed dead
+    cached = cache_lookup(ip, port)
+    if cached is not None and cached[0] == 'dead':
+        journal_done(ip, port)
+        return 1
+
+    # The item is not marked done in the journal (the --resume sweeps it again), but it is counted by the progress
+    try:
+        sock = socket_creator(args.nic, ip, port, os_name)
+    except OSError as error:
+        print(f'[*] Unable to join {ip}:{port}: {error}')
+        progress_add('done')
+        return 1
+    waited = time.perf_counter()
+    result = channel_checker(sock)
+    profile_add('first packet' if result == 0 else 'timeout', ip, port, time.perf_counter() - waited)
+    if result == 0:
         
-        # Add the channel name line
-        file.write(channel_string)
+        print(f'[*] Found opened port {port} for {ip}')
+        progress_add('hits')
+
+        # Reuse the cached stream's info instead of the probe
+        if cached is not None:
+            if rtp_detect(sock):
+                rtp_streams.add((str(ip), str(port)))
+            sock.close()
+            pipeline_put(write_stage, (ip, port, cached[1]))
+        else:
+            pipeline_put(probe_stage, (ip, port, sock))
 
-        #Add the channel address
-        file.write(f'udp://@{ip}:{port}\n')
+    else:
+        cache_put(ip, port, 'dead')
+        journal_done(ip, port)
+
+    return result
+
+def write_item(ip, port, info):
+    """ Add the probed stream to the playlist and to the journal (write stage) """
+
+    # The channels of the unfinished blocks could be already found before the resume
+    if info != 0 and (str(ip), str(port)) not in journal['found']:
+        scan_result(ip, port, info)
+        journal_write({'channel': [str(ip), str(port), info] + (['rtp'] if (str(ip), str(port)) in rtp_streams else [])})
+
+    # The discovery marks the blocks done for all the ports at once
+    if args.mode != 'discover':
+        journal_done(ip, port)
+    playlist_checkpoint()
+
+def probe_item(ip, port, sock):
+    """ Get the stream's info of the found stream (probe stage) """
+
+    # Join the group again if the sweep stage has no socket for it (the failed join is swept again by the --resume)
+    if sock is None:
+        try:
+            sock = socket_creator(args.nic, ip, port, os_name)
+        except OSError as error:
+            print(f'[*] Unable to join {ip}:{port}: {error}')
+            progress_add('done')
+            return None
+        if channel_checker(sock) != 0:
+            print(f'[*] No data found for {ip}:{port}')
+            return ip, port, 0
+
+    # Get the data of the possible stream
+    return ip, port, get_stream_info(sock, ip, port)
+
+def pipeline_stage(name, function, workers, output=None, size=0):
+    """ Start the pipeline stage: the workers run the function for the items of the stage queue (up to size items, 0 is no limit) """
+
+    stage = {
+        'name': name,
+        'queue': queue.Queue(maxsize=size),
+        'output': output,       # next stage for the function results
+        'workers': workers,
+        'threads': [],
+        'items': 0,             # items processed
+        'depth_max': 0,         # maximum queue depth
+        'lock': threading.Lock(),
+    }
+
+    for index in range(workers):
+        thread = threading.Thread(target=stage_worker, args=(stage, function), daemon=True)
+        thread.start()
+        stage['threads'].append(thread)
+
+    return stage
+
+def pipeline_put(stage, item):
+    """ Put the item to the stage queue """
+
+    stage['queue'].put(item)
+    depth = stage['queue'].qsize()
+    with stage['lock']:
+        stage['depth_max'] = max(stage['depth_max'], depth)
+
+def stage_worker(stage, function):
+    """ Run the stage function for the items of the stage queue till the end mark (None) """
+
+    while True:
+        item = stage['queue'].get()
+        if item is None:
+            break
+
+        try:
+            result = function(*item)
+        except Exception as error:
+            print(f'[*] Error in the {stage["name"]} stage for {item[0]}:{item[1]}: {error}')
+            result = None
+
+        with stage['lock']:
+            stage['items'] += 1
+        if stage['output'] is not None and result is not None:
+            pipeline_put(stage['output'], result)
+
+def pipeline_close(stage):
+    """ Wait till the stage processes all the items of its queue """
+
+    for thread in stage['threads']:
+        stage['queue'].put(None)
+    for thread in stage['threads']:
+        thread.join()
+
+    print(f'[*] Pipeline stage "{stage["name"]}": {stage["workers"]} worker(s), {stage["items"]:,} item(s), max queue depth: {stage["depth_max"]}')
+
+def multiplex_scanner(ip_list, port):
+    """ Sweep the given list of IPs joining the batches of groups on one socket for the port """
 
+    global args
+    global probe_stage
+    global write_stage
 
-    print(f'[*] !!! Channel added to the playlist. {ip}:{port} >>> {name} !!!')
+    batch = int(args.batch) if args.batch else igmp_max_memberships()
+    join_rate = float(args.join_rate)
 
-    return 0
+    sock = port_socket_creator(args.nic, port, os_name)
+    sock.setsockopt(socket.IPPROTO_IP, getattr(socket, 'IP_PKTINFO', 8), 1)
 
-def ip_scanner(ip_list, port_list):
-    """ Scan the given lists of IPs and ports """
+    # The datagrams of all the groups are received into one reusable buffer
+    buffer = bytearray(65536)
+    view = memoryview(buffer)
 
-    for ip in ip_list:
-        for port in port_list:
-            sock = socket_creator(args.nic, str(ip), port, os_name)
-            result = channel_checker(sock)
-            if result == 0:
-                
-                print(f'[*] Found opened port {port} for {str(ip)}')
-                
-                # Get the data of the possible stream
-                info = get_ffprobe(ip, port)
+    ips = range_ips(ip_list, port)
+    carry = []
 
-                if info == 0: # No metadata found for the stream
-                    
-                    pass
+    while True:
 
-                elif info == 1: # Stream captured but without channel name
+        # Join the next window of groups
+        window = set()
+        cached = {}
+        while len(window) < batch:
+            ip = carry.pop() if carry else next(ips, None)
+            if ip is None:
+                break
 
-                    playlist_add(ip, port, info)
-                    unnamed_channels_dictionary.append(f'{ip}:{port}')
+            # Skip the groups recently confirmed dead
+            cached[str(ip)] = cache_lookup(str(ip), port)
+            if cached[str(ip)] is not None and cached[str(ip)][0] == 'dead':
+                journal_done(str(ip), port)
+                continue
 
-                else: # Stream captured with the channel name
-                    playlist_add(ip, port, info)
-    
-    return f'[*] Scanning for {ip_list} completed!'
+            try:
+                joined = time.perf_counter()
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(str(ip)) + socket.inet_aton(args.nic))
+                profile_add('join', ip, port, time.perf_counter() - joined)
+            except OSError as error:
+                if not window:
+                    print(f'[*] Unable to join {str(ip)}:{port}: {error}')
+                    continue
+
+                # The kernel limit is lower than the batch size
+                carry.append(ip)
+                batch = len(window)
+                print(f'[*] Batch size is limited to {batch} groups: {error}')
+                break
+            window.add(str(ip))
+            if join_rate:
+                time.sleep(1 / join_rate)
+
+        if not window or stop_event.is_set():
+            break
+
+        # Wait for the datagrams and attribute them to the groups by the destination address
+        hits = {}
+        waited = time.perf_counter()
+        deadline = time.monotonic() + float(args.udp_timeout)
+        while len(hits) < len(window):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                break
+            group, size = pktinfo_receiver(sock, buffer)
+            if group not in window:
+                continue
+            if group not in hits:
+                print(f'[*] Found opened port {port} for {group}')
+                progress_add('hits')
+                profile_add('first packet', group, port, time.perf_counter() - waited)
+                hits[group] = (ts_demuxer(), deadline)
+                if size >= 12 and buffer[0] >> 6 == 2:
+                    rtp_streams.add((group, str(port)))
+            ts_demux(hits[group][0], rtp_payload(view[:size]))
+
+        profile_add('window', f'{len(window)} groups', port, time.perf_counter() - waited)
+
+        # Leave all the groups of the window
+        for group in window:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, socket.inet_aton(group) + socket.inet_aton(args.nic))
+            if group not in hits:
+                cache_put(group, port, 'dead')
+                journal_done(group, port)
+
+        # The streams with the cached or complete tables go to the writer, the rest to the probe stage
+        for group, (demuxer, deadline) in hits.items():
+            if cached.get(group) is not None:
+                pipeline_put(write_stage, (group, port, cached[group][1]))
+            elif ts_demuxer_ready(demuxer):
+                programs = ts_demuxer_programs(demuxer)
+                info = programs_parser(programs, group, port)
+                cache_put(group, port, 'alive', info, programs_pids(programs))
+                pipeline_put(write_stage, (group, port, info))
+            else:
+                pipeline_put(probe_stage, (group, port, None))
+
+    sock.close()
+
+    return f'[*] Scanning for {ip_list} on port {port} completed!'
+
+# The classic BPF program for the packet socket (the offsets are from the IPv4 header):
+# UDP, the destination is multicast (224.0.0.0/4), not a fragment -> the first 96 bytes, else drop
+packet_filter = [
+    (0x30, 0, 0, 9),            # ldb [9]               protocol
+    (0x15, 0, 6, 17),           # jeq #17               UDP
+    (0x20, 0, 0, 16),           # ld [16]               destination address
+    (0x54, 0, 0, 0xF0000000),   # and #0xf0000000
+    (0x15, 0, 3, 0xE0000000),   # jeq #0xe0000000       multicast
+    (0x28, 0, 0, 6),            # ldh [6]               flags and fragment offset
+    (0x45, 1, 0, 0x1FFF),       # jset #0x1fff          fragment
+    (0x06, 0, 0, 96),           # ret #96
+    (0x06, 0, 0, 0),            # ret #0
+]
+
+def interface_name(nic):
+    """ Get the name of the network interface with the given IP address (Linux) """
+
+    import fcntl
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for index, name in socket.if_nameindex():
+            try:
+                # SIOCGIFADDR (0x8915): the address is at the offset 20 of the ifreq structure
+                address = fcntl.ioctl(sock.fileno(), 0x8915, struct.pack('256s', name.encode()[:15]))[20:24]
+            except OSError:
+                continue
+            if socket.inet_ntoa(address) == nic:
+                return name
+
+    return None
+
+def packet_socket_creator(nic):
+    """ Creates the packet socket capturing the IPv4 multicast UDP datagrams of the interface (CAP_NET_RAW) """
+
+    import ctypes
+
+    # SOCK_DGRAM: the link layer header is removed, the data starts with the IPv4 header
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(0x0800))
+
+    # Attach the filter: the kernel drops the other packets and copies the headers only
+    # (struct sock_fprog: the number of the instructions and the pointer, aligned natively)
+    program = ctypes.create_string_buffer(b''.join(struct.pack('HBBI', *instruction) for instruction in packet_filter))
+    sock.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_ATTACH_FILTER', 26), struct.pack('HP', len(packet_filter), ctypes.addressof(program)))
+
+    # All the interfaces for 0.0.0.0
+    if nic != '0.0.0.0':
+        name = interface_name(nic)
+        if name is None:
+            sock.close()
+            raise OSError(f'no interface with the address {nic}')
+        sock.bind((name, 0x0800))
+
+    # Drop the packets queued before the filter was attached
+    sock.setblocking(False)
+    while True:
+        try:
+            sock.recv(128)
+        except BlockingIOError:
+            break
+
+    return sock
+
+def packet_parser(data):
+    """ Get the destination group, the port and the payload type (ts, rtp or udp) of the captured datagram """
+
+    header = (data[0] & 0x0F) * 4
+    if len(data) < header + 8:
+        return None
+
+    group = socket.inet_ntoa(data[16:20])
+    port = (data[header + 2] << 8) | data[header + 3]
+    if len(data) == header + 8:
+        kind = 'udp'
+    elif data[header + 8] == 0x47:
+        kind = 'ts'
+    elif data[header + 8] >> 6 == 2:
+        kind = 'rtp'
+    else:
+        kind = 'udp'
+
+    return group, port, kind
+
+def discover_scanner(ip_list):
+    """ Find the (group, port) pairs with the traffic: join the windows of groups and capture all the ports at once """
+
+    global args
+    global probe_stage
+
+    batch = int(args.batch) if args.batch else 256
+    limit = igmp_max_memberships()
+    join_rate = float(args.join_rate)
+
+    # The groups are joined by the unbound sockets (each one up to the kernel limit), the datagrams are captured
+    capture = packet_socket_creator(args.nic)
+    members = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) for index in range(-(-batch // limit))]
+    buffer = bytearray(128)
+    view = memoryview(buffer)
+    streams = 0
+
+    ips = range_ips(ip_list, '*')
+
+    while not stop_event.is_set():
+
+        # Join the next window of groups
+        window = {}
+        while len(window) < batch:
+            ip = next(ips, None)
+            if ip is None:
+                break
+            member = members[len(window) // limit]
+            try:
+                joined = time.perf_counter()
+                member.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(str(ip)) + socket.inet_aton(args.nic))
+                profile_add('join', ip, '*', time.perf_counter() - joined)
+            except OSError as error:
+                print(f'[*] Unable to join {str(ip)}: {error}')
+                journal_done(str(ip), '*')
+                continue
+            window[str(ip)] = member
+            if join_rate:
+                time.sleep(1 / join_rate)
+
+        if not window:
+            break
+
+        # Capture the datagrams of the window: the ports are not known, so wait for the whole timeout
+        found = {}
+        waited = time.perf_counter()
+        deadline = time.monotonic() + float(args.udp_timeout)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([capture], [], [], remaining)[0]:
+                break
+            while True:
+                try:
+                    size = capture.recv_into(buffer)
+                except BlockingIOError:
+                    break
+                packet = packet_parser(view[:size])
+                if packet is None or packet[0] not in window or packet[:2] in found:
+                    continue
+                group, port, kind = packet
+                found[(group, port)] = kind
+                if kind == 'rtp':
+                    rtp_streams.add((group, str(port)))
+                print(f'[*] Found opened port {port} for {group} ({kind})')
+                progress_add('hits')
+                profile_add('first packet', group, port, time.perf_counter() - waited)
+
+        profile_add('window', f'{len(window)} groups', '*', time.perf_counter() - waited)
+
+        # Leave all the groups of the window
+        for group, member in window.items():
+            member.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, socket.inet_aton(group) + socket.inet_aton(args.nic))
+
+        # The pairs are recorded before the blocks are marked done: the resume probes them again
+        for group, port in found:
+            journal_write({'pair': [group, str(port)]})
+            pipeline_put(probe_stage, (group, str(port), None))
+        for group in window:
+            journal_done(group, '*')
+        streams += len(found)
+
+    capture.close()
+    for member in members:
+        member.close()
+
+    return f'[*] Discovery for {ip_list} completed: {streams} stream(s) found'
 
 def channel_checker(sock):
     """ Function to check the given UDP socket """
 
     global args
 
-    ready = select.select([sock], [], [], args.udp_timeout)
+    # The socket is left opened on success: the queued datagrams are used for the stream's info
+    ready = select.select([sock], [], [], float(args.udp_timeout))
     if ready[0]:
-        sock.close()
         return 0
     else:
+        sock.close()
         return 1
 
 def socket_creator(nic, address, port, os_name):
     """ Creates a sockets for a given ports """
 
+    started = time.perf_counter()
+    sock = port_socket_creator(nic, port, os_name)
+    
+    # Tell the kernel that we want to add ourselves to a multicast group
+    # The address for the multicast group is the third param
+    joined = time.perf_counter()
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(address) + socket.inet_aton(nic))
+    profile_add('socket', address, port, joined - started)
+    profile_add('join', address, port, time.perf_counter() - joined)
+
+    return sock
+
+def port_socket_creator(nic, port, os_name):
+    """ Creates a multicast socket bound to a given port without any group joined """
+
     # Create a UDP socket
     # AF_INET address family represented by a pair (host, port)
     # SOCK_DGRAM is a UDP socket type for datagram-based protocol
@@ -247,59 +1413,203 @@ def socket_creator(nic, address, port, os_name):
     else:
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     
+    # On Linux a socket receives the datagrams of all the groups joined on the host for the same port
+    # IP_MULTICAST_ALL = 0 (49) limits it to the groups joined by this socket only (set before the bind)
+    if os_name == 'Linux':
+        sock.setsockopt(socket.IPPROTO_IP, getattr(socket, 'IP_MULTICAST_ALL', 49), 0)
+    
     # Bind to the port that we know will receive multicast data
-    sock.bind((nic, int(port)))
+    # Linux delivers the multicast datagrams to the sockets bound to the group or any address only:
+    # the interface is chosen by the join
+    sock.bind(('0.0.0.0' if os_name == 'Linux' else nic, int(port)))
     
     # Tell the kernel that we are a multicast socket
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
-    
-    # Tell the kernel that we want to add ourselves to a multicast group
-    # The address for the multicast group is the third param
-    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(address) + socket.inet_aton(nic))
 
     return sock
 
-def playlist_parser(playlist):
-    """ Function that returns a dictionary of UDP streams"""
-    
-    # Defining the variables
-    channel_name = ''
-    channel_address = ''
+def igmp_max_memberships():
+    """ Get the kernel limit of the multicast groups joined by one socket """
+
+    try:
+        with open('/proc/sys/net/ipv4/igmp_max_memberships') as file:
+            return int(file.read())
+    except (OSError, ValueError):
+        return 20
+
+def pktinfo_receiver(sock, buffer):
+    """ Receive a datagram into the buffer and get its destination (group) address """
+
+    # struct in_pktinfo { int ipi_ifindex; in_addr ipi_spec_dst; in_addr ipi_addr; }
+    size, ancdata, flags, address = sock.recvmsg_into([buffer], socket.CMSG_SPACE(12))
+    for level, kind, data in ancdata:
+        if level == socket.IPPROTO_IP and kind == getattr(socket, 'IP_PKTINFO', 8):
+            return socket.inet_ntoa(data[8:12]), size
+
+    return None, size
+
+# The stream's URL of the playlist: udp:// or rtp://, the optional source (SSM) before '@' and the port
+playlist_url_re = re.compile(r'^(udp|rtp)://(?:[^@/]*@)?([0-9.]+)(?::([0-9]+))?', re.IGNORECASE)
+
+# The attributes of the #EXTINF line: tvg-id="...", group-title="..."
+playlist_attribute_re = re.compile(r'([A-Za-z0-9_-]+)="([^"]*)"')
+
+def playlist_reader(playlist):
+    """ Lazily yield the UDP/RTP channels' records of the M3U playlist """
+
+    extinf = None
+    group = None
+
+    with open(playlist, errors='replace') as playlist:
+        for line in playlist:
+            line = line.strip()
+
+            # Empty lines and the header
+            if not line or line.startswith('#EXTM3U'):
+                continue
+
+            # #EXTINF:<duration> <attributes>,<name> (the commas inside the quotes are not the separator)
+            if line.startswith('#EXTINF:'):
+                info = line[8:]
+                quoted = False
+                separator = len(info)
+                for index, char in enumerate(info):
+                    if char == '"':
+                        quoted = not quoted
+                    elif char == ',' and not quoted:
+                        separator = index
+                        break
+                head = info[:separator].strip()
+                duration = head.split(' ', 1)[0] if head else '-1'
+                extinf = {'duration': duration, 'attributes': dict(playlist_attribute_re.findall(head)), 'name': info[separator + 1:].strip()}
+                continue
+
+            # The group of the next channel
+            if line.startswith('#EXTGRP:'):
+                group = line[8:].strip()
+                continue
+
+            # The other directives and the comments
+            if line.startswith('#'):
+                continue
+
+            # The stream's URL: the other schemes (http://, files) are skipped
+            url = playlist_url_re.match(line)
+            if url:
+                scheme, address, port = url.group(1).lower(), url.group(2), url.group(3) or '1234'
+                record = {'name': f'{address}:{port}', 'address': address, 'port': port, 'scheme': scheme, 'duration': '-1', 'attributes': {}}
+                if extinf is not None:
+                    record.update(extinf)
+                    record['name'] = extinf['name'] or record['name']
+                if group is not None and 'group-title' not in record['attributes']:
+                    record['attributes'] = dict(record['attributes'], **{'group-title': group})
+                yield record
+
+            extinf = None
+            group = None
 
-    # Defininfg regular expression for strings
-    channel_name_re = re.compile(r'(?<=#EXTINF:2,)(.*)(?=$)')
-    channel_address_re = re.compile(r'(?<=@)(.*)(?=$)')
+def playlist_parser(playlist):
+    """ Function that returns the index of the playlist's channels by group:port """
 
-    # Create a dictionary
     dictionary = {}
+    duplicates = 0
+
+    # The first channel of the same group:port is kept, the names could repeat
+    for record in playlist_reader(playlist):
+        key = f'{record["address"]}:{record["port"]}'
+        if key in dictionary:
+            duplicates += 1
+            continue
+        dictionary[key] = record
+
+    if duplicates:
+        print(f'[*] Duplicate channels skipped in the playlist: {duplicates}')
 
-    # Open the playlist file and write the data to the dictionary
-    with open(playlist) as playlist:
-        for counter, line in enumerate(playlist):
-            if re.findall(channel_name_re ,line):
-                channel_name = re.search(channel_name_re,line).group()
-                channel_address = re.search(channel_address_re, playlist.readline()).group()
-                dictionary[channel_name] = channel_address
-    
     return dictionary
 
 def udp_pors_parser(channels_dictionary):
     """ Function to get the list of the unique ports fron the UDP channels dictionary """
     
-    # Get the unique values of UDP channel:port lines
-    upd_channels_ports = set(channels_dictionary.values())
-    
-    # Get the list of UDP ports
-    port_list = []
-    for item in upd_channels_ports:
-        port = item.split(':')[1]
-        port_list.append(port)
-
     # Get the unique list of UDP ports
-    port_list = set(port_list)
+    port_list = set(record['port'] for record in channels_dictionary.values())
 
     return port_list
 
+def shard_argv(removed):
+    """ Get the command line of the script without the given options and their values """
+
+    argv = []
+    skip = False
+    for token in sys.argv[1:]:
+        if token.startswith('--'):
+            skip = token.split('=')[0] in removed
+        if not skip:
+            argv.append(token)
+
+    return argv
+
+def shard_pin(index):
+    """ Pin the shard process to one of the available CPUs (Linux only) """
+
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+
+    cpus = sorted(os.sched_getaffinity(0))
+    cpu = cpus[index % len(cpus)]
+    os.sched_setaffinity(0, {cpu})
+
+    return cpu
+
+def shard_run(nics, count):
+    """ Scan the range with the shard processes (one interface and CPU each) and merge their playlists """
+
+    global playlist_output
+
+    argv = shard_argv({'--nic', '--processes', '--smtp_server', '--smtp_port', '--sender', '--receivers'})
+
+    shards = []
+    for index in range(count):
+        nic = nics[index % len(nics)]
+        print(f'[*] Shard {index + 1}/{count}: interface {nic}')
+        sys.stdout.flush()
+        command = [sys.executable, os.path.realpath(__file__)] + argv + ['--nic', nic, '--shard', f'{index}/{count}']
+        shards.append(subprocess.Popen(command))
+
+    # Ctrl-C reaches the shards too: wait for them to save their playlists and journals
+    interrupted = False
+    while True:
+        try:
+            for process in shards:
+                process.wait()
+            break
+        except KeyboardInterrupt:
+            interrupted = True
+
+    # Merge the playlists of the shards: the same channel could be found on several interfaces
+    urls = set()
+    for index in range(count):
+        shard_file = create_file(args.range, index)[1]
+        if not os.path.isfile(shard_file):
+            continue
+        with open(shard_file) as file:
+            lines = file.read().splitlines()[1:]
+        for extinf, url in zip(lines[0::2], lines[1::2]):
+            if url in urls:
+                playlist_output['duplicates'] += 1
+                continue
+            urls.add(url)
+            playlist_output['lines'].append(f'{extinf}\n{url}\n')
+            playlist_output['count'] += 1
+            if extinf.startswith('#EXTINF:2,Channel: '):
+                playlist_output['unnamed'] += 1
+        os.remove(shard_file)
+
+    failed = [index + 1 for index, process in enumerate(shards) if process.returncode]
+    if failed:
+        print(f"[*] Shard(s) exited with an error: {', '.join(map(str, failed))}")
+
+    return interrupted
+
 def send_email(smtp_server, smtp_port, sender, receivers, attachment, attachment_name):
     """ Function to send an email with an attached file of the scan result """
 
@@ -325,7 +1635,7 @@ def send_email(smtp_server, smtp_port, sender, receivers, attachment, attachment
         smtpObj = smtplib.SMTP(smtp_server, smtp_port)
         smtpObj.sendmail(sender, receivers, msg.as_string())
         print(f'[*] An email has been sent to {receivers}')
-    except SMTPException as error:
+    except (smtplib.SMTPException, OSError) as error:
         print(f'[*] Error: unable to send an email\n\n{error}\n')
 
 # ================
@@ -341,8 +1651,19 @@ os_name = platform.system()
 # Define the dictionary for UDP ports:
 port_list = {}
 
-# Create a resulting playlist file:
-playlistFileName, playlistFile = create_file(args.range)
+# One shard process for each interface or the given number of processes
+nics = args.nic
+args.nic = nics[0]
+if args.shard:
+    shard_index, shard_count = map(int, args.shard.split('/'))
+    cpu = shard_pin(shard_index)
+    print(f'[*] Shard {shard_index + 1}/{shard_count}: interface {args.nic}' + (f', CPU {cpu}' if cpu is not None else ''))
+else:
+    shard_index, shard_count = 0, max(len(nics), int(args.processes))
+
+# Prepare the resulting playlist file (it is written on the checkpoints and at the end):
+playlistFileName, playlistFile, playlist_output = create_file(args.range, shard_index if args.shard else None)
+playlist_interval = 10
 
 # Check the data of the playlist file
 if args.playlist:
@@ -381,13 +1702,14 @@ else:
     print(f'[*] IPs provided are not multicase. Please try again.')
     sys.exit()
 
-# Devide the given IPs to the subnets
-try:
-    subnets = ip_list.subnets(new_prefix=int(args.size))
-    subnets = list(subnets)
-except:
-    print(f'[*] ERROR: the new prefix --size: "{args.size}" must be longer than the given IPs subnet: "/{ip_list.prefixlen}"\n')
-    sys.exit()
+# The destination group of the datagrams (IP_PKTINFO) and the packet sockets are available on Linux only
+if args.mode in ('multiplex', 'discover') and os_name != 'Linux':
+    print(f'[*] {args.mode.capitalize()} scan mode is supported on Linux only, the sequential mode is used.')
+    args.mode = 'sequential'
+
+# The discovery finds the ports itself: all of them are captured at once
+if args.mode == 'discover':
+    port_list = {'*'}
 
 # Calculating and printing the totals
 total_IPs = ip_list.num_addresses
@@ -396,17 +1718,52 @@ total_ports = len(port_list)
 print(f'\n[*] IP range to scan: {args.range}')
 print(f'[*] IPs to scan: {total_IPs:,}')
 print(f'[*] Ports to scan for each IP: {total_ports}') 
-print(f"[*] List of the port(s) to scan: {', '.join(port_list)}")
+print(f"[*] List of the port(s) to scan: {', '.join(port_list) if args.mode != 'discover' else 'all (captured)'}")
 print(f'[*] Timeout for UDP stream reply: {args.udp_timeout} sec(s)')
 print(f'[*] Timeout for stream data collection: {args.info_timeout} sec(s)')
-print(f'[*] Sample lenght in seconds: {args.sample_sec} sec(s)')
+print(f'[*] Sample lenght in seconds: {args.sample_sec} sec(s), up to {args.sample_size} MB, {args.sample_workers} at once')
 print(f'\n[*] Totals:')
 print(f'[*] Total items to scan: {total_IPs*total_ports:,}')
-print(f'[*] Total number of /{args.size} subnets to scan (# of threads): {len(subnets)}')
-print(f'[*] Total number of hosts for each subnet to scan: {int(total_IPs/len(subnets))} \n')
 
-# Scanning time estimation:
-time_to_complete = int((total_IPs/len(subnets))*total_ports*int(args.udp_timeout)*int(args.info_timeout))
+if args.mode == 'multiplex':
+
+    # Each port socket joins a window of groups and waits for them once
+    batch = int(args.batch) if args.batch else igmp_max_memberships()
+    windows = -(-total_IPs // batch)
+    print(f'[*] Scan mode: multiplex, one socket per port (# of threads): {total_ports}')
+    print(f'[*] Groups joined at once for each port: {batch}')
+    print(f'[*] Total number of windows for each port to scan: {windows:,} \n')
+
+    # Scanning time estimation:
+    join_time = batch / float(args.join_rate) if float(args.join_rate) else 0
+    time_to_complete = int(windows * (join_time + float(args.udp_timeout)))
+
+elif args.mode == 'discover':
+
+    # One packet socket captures the datagrams of all the ports for a window of groups
+    batch = int(args.batch) if args.batch else 256
+    windows = -(-total_IPs // batch)
+    print(f'[*] Scan mode: discover, one packet socket for all the ports')
+    print(f'[*] Groups joined at once: {batch} ({-(-batch // igmp_max_memberships())} socket(s) for the memberships)')
+    print(f'[*] Total number of windows to scan: {windows:,} \n')
+
+    # Scanning time estimation:
+    join_time = batch / float(args.join_rate) if float(args.join_rate) else 0
+    time_to_complete = int(windows * (join_time + float(args.udp_timeout)))
+
+else:
+
+    # The items are taken lazily by a fixed number of workers
+    print(f'[*] Scan mode: sequential, items scanned at once (# of threads): {args.workers}')
+    print(f'[*] Total number of items for each thread to scan: {-(-total_IPs*total_ports // int(args.workers)):,} \n')
+
+    # Scanning time estimation:
+    time_to_complete = int(-(-total_IPs*total_ports // int(args.workers))*float(args.udp_timeout))
+
+# The shards scan every N-th block of 256 IPs each
+if shard_count > 1:
+    print(f'[*] Shard processes: {shard_count}, each one scans every {shard_count}-th block of 256 IPs')
+    time_to_complete = -(-time_to_complete // shard_count)
 
 print(f'[*] Estimated maximum time to complete the task: {time_to_complete:,} seconds')
 
@@ -414,35 +1771,145 @@ print(f'[*] Estimated maximum time to complete the task: {time_to_complete:,} se
 days, hours, minutes, seconds = seconds_humanize(time_to_complete)
 print(f'[*] {days} day(s) {hours} hour(s) {minutes} minute(s) {seconds} second(s)\n')
 
-# Check that FFmpeg/FFprobe are installed
+# Run the shard processes and merge their playlists
+if shard_count > 1 and not args.shard:
+    start = time.perf_counter()
+    interrupted = shard_run(nics, shard_count)
+
+    # Write the merged playlist (a stale one of the previous run is removed if no channels found)
+    if playlist_output['count']:
+        playlist_commit(force=True)
+    elif os.path.isfile(playlistFile):
+        os.remove(playlistFile)
+
+    if not interrupted and playlist_output['count'] and args.smtp_server and args.smtp_port and args.sender and args.receivers:
+        send_email(args.smtp_server, args.smtp_port, args.sender, args.receivers, playlistFile, playlistFileName)
+
+    print(f'\n\n[*] Finished in {round(time.perf_counter() - start, 0):,} second(s)')
+    if not playlist_output['count']:
+        print(f'[*] No channels found\n')
+    else:
+        print(f'[*] Channels found: {playlist_output["count"]} ({playlist_output["unnamed"]} without the name)')
+        if playlist_output['duplicates']:
+            print(f'[*] Found by several shards: {playlist_output["duplicates"]}')
+        print(f'[*] Resulting file: {playlistFile}\n')
+    if interrupted:
+        print(f'[*] Run the script with the same parameters and --resume to continue the scan')
+    sys.exit()
+
+
+# Check that FFprobe is installed (it is only used as a fallback)
 try:
-    subprocess.call(['ffprobe', '-v', 'quiet'])
-    subprocess.call(['ffmpeg', '-v', 'quiet'])
+    if args.ffprobe:
+        subprocess.call(['ffprobe', '-v', 'quiet'])
 except FileNotFoundError:
-    print('[*] ffmpeg and ffprobe are not installed! Please install first: https://ffmpeg.org/')
+    print('[*] ffprobe is not installed! Please install first: https://ffmpeg.org/')
     sys.exit()
 
+# The stage timings of the --profile
+profile = [] if args.profile or args.profile_dump else None
+
+# Start the sample stage first: the unnamed channels are recorded as soon as they are found
+sample_stage = pipeline_stage('sample', get_sample, int(args.sample_workers))
+
+# Open the checkpoint journal: the finished blocks of 256 IPs for each port and the found channels
+journal_block = 256
+journal = journal_open(playlistFile, args.resume)
+
+# Rebuild the playlist from the journal (the samples of the unnamed channels were recorded by the previous run)
+if args.resume:
+    print(f'[*] Resuming the scan: {len(journal["done"]):,} block(s) of {journal_block} IPs finished, {len(journal["channels"])} channel(s) found')
+    for ip, port, info, *scheme in journal['channels']:
+        if scheme == ['rtp']:
+            rtp_streams.add((ip, port))
+        if info != 0:
+            playlist_add(ip, port, info)
+
+# Open the channels cache
+cache = cache_open(args.cache) if args.cache else None
+
+# The items left to sweep: the blocks of this shard not finished before the --resume
+sweep_total = progress_total(ip_list, port_list)
+
+# Report the progress of the sweep (EWMA of the throughput with the weight of the last interval)
+probe_stage = None
+progress = None
+progress_alpha = 0.3
+if float(args.progress) or args.heartbeat:
+    if not float(args.progress):
+        args.progress = 10
+    progress = {'lock': threading.Lock(), 'stop': threading.Event(), 'done': 0, 'hits': 0, 'total': sweep_total,
+                'rate': None, 'last_done': 0, 'last_time': time.monotonic()}
+    threading.Thread(target=progress_reporter, daemon=True).start()
+
 # Scan the IPs range with the given ports:
 try:
 
     # Start timer:
     start = time.perf_counter()
 
+    # Start the pipeline: sweep -> probe -> write
+    write_stage = pipeline_stage('write', write_item, 1)
+    # The found streams wait for the probe with their joined sockets: the sweep is held back by the bounded queue
+    probe_stage = pipeline_stage('probe', probe_item, int(args.probe_workers), write_stage, int(args.probe_workers) * 2)
+
+    # Probe again the discovered pairs without the channels found before the resume
+    for group, port in journal['pairs']:
+        if (group, port) not in journal['found']:
+            pipeline_put(probe_stage, (group, port, None))
+
+    # Capture all the ports of the groups with the packet socket
+    if args.mode == 'discover':
+        try:
+            print(discover_scanner(ip_list))
+        except OSError as error:
+            print(f'[*] Unable to capture the datagrams: {error}')
+            print(f'[*] The discover mode needs the root or CAP_NET_RAW capability for the packet socket')
+            sys.exit()
+
     # Run the scanner as a multi-thread executor
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(subnets)) as executor:
-        results = [executor.submit(ip_scanner, subnet, port_list) for subnet in subnets]
+    elif args.mode == 'multiplex':
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(port_list)) as executor:
+            results = [executor.submit(multiplex_scanner, ip_list, port) for port in port_list]
 
-        # Print the result:
-        for item in concurrent.futures.as_completed(results):
-            print(item.result())
+            # Print the result (stop the threads before the executor waits for them):
+            try:
+                for item in concurrent.futures.as_completed(results):
+                    print(item.result())
+            except KeyboardInterrupt:
+                stop_event.set()
+                raise
+
+    # Run the scanner with a bounded number of the items in flight
+    else:
+        for result in bounded_scheduler(item_scanner, scan_items(ip_list, port_list), int(args.workers)):
+            pass
+        print(f'[*] Scanning for {ip_list} completed!')
+
+    sweep_workers = len(port_list) if args.mode in ('multiplex', 'discover') else int(args.workers)
+    print(f'\n[*] Pipeline stage "sweep": {sweep_workers} worker(s), {sweep_total:,} item(s)')
+
+    # Wait for the found streams to be probed and written
+    pipeline_close(probe_stage)
+    pipeline_close(write_stage)
+    if progress is not None:
+        progress['stop'].set()
+    cache_close()
+
+    # Write the final playlist (a stale one of the previous run is removed if no channels found)
+    if playlist_output['count']:
+        playlist_commit(force=True)
+    elif os.path.isfile(playlistFile):
+        os.remove(playlistFile)
 
-    # Record the samples of the unnamed channels
+    # Wait for the samples of the unnamed channels
     if unnamed_channels_dictionary:
         print(f'\n[*] Recording the samples for unnamed channels...')
-        for channel in unnamed_channels_dictionary:
-            address, port = channel.split(':')
-            get_ffmpeg_sample(address, port)
-            print(f'[*] !!! Sample for {address}:{port} captured !!!')
+    pipeline_close(sample_stage)
+
+    # Print the time spent in each stage
+    if profile is not None:
+        profile_report()
 
     # Send an email with the resulting file
     if args.smtp_server and args.smtp_port and args.sender and args.receivers:
@@ -459,18 +1926,30 @@ try:
     days, hours, minutes, seconds = seconds_humanize(total_time)
     print(f'[*] {days} day(s) {hours} hour(s) {minutes} minute(s) {seconds} second(s)\n')
 
-    # Count the results
-    count_results = len(open(playlistFile).readlines())
-    
-    # Print the results and remove empty files if no channels found:
-    if count_results < 3:
+    # Print the results counted by the writer:
+    if not playlist_output['count']:
         print(f'[*] No channels found\n')
-        os.remove(playlistFile)
     else:
-        print(f'[*] Channels found: {int((count_results - 1)/2)}')
-        print(f'[*] Resulting file: {playlistFile}\n')
+        print(f'[*] Channels found: {playlist_output["count"]} ({playlist_output["unnamed"]} without the name)')
+        if playlist_output['duplicates']:
+            print(f'[*] Already in the playlist: {playlist_output["duplicates"]}')
+        print(f'[*] Resulting file: {playlistFile} ({playlist_output["commits"]} commit(s))\n')
+
+    # The scan is completed, the journal is not needed anymore
+    journal['file'].close()
+    os.remove(journal['name'])
     sys.exit()
 
 except KeyboardInterrupt:
+
+    # Stop the sweep threads and keep the journal consistent
+    stop_event.set()
+    with journal['lock']:
+        journal['file'].close()
+    cache_close()
+
+    # Keep the channels found so far (the playlist is consistent: it is replaced as a whole)
+    playlist_commit()
     print('\n[*] Script has been closed!')
+    print(f'[*] Run the script with the same parameters and --resume to continue the scan')
     sys.exit()
\ No newline at end of file
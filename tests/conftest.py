@@ -0,0 +1,22 @@
+# The shared helpers of the tests: the scripts are standalone, their functions are loaded without running them
+#
+# Run: python3 -m pytest tests
+
+import argparse
+import os
+
+scripts_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def script_functions(name, **arguments):
+    """ Load the functions of the script without running it (the code till the end of the functions) """
+
+    path = os.path.join(scripts_path, name)
+    with open(path) as file:
+        source = file.read().split('# ================\n# End of functions')[0]
+    namespace = {'__file__': path, '__name__': name}
+    exec(compile(source, path, 'exec'), namespace)
+
+    # The parsed arguments the functions read: the defaults of the tests, overridden per test module
+    namespace['args'] = argparse.Namespace(**{'gop': 1, 'pcr': False, **arguments})
+
+    return namespace
@@ -0,0 +1,91 @@
+# Tests of the channels cache of the checker and the scanner: the TTLs of the alive and dead channels and the eviction
+#
+# Run: python3 -m pytest tests
+
+import os
+import tempfile
+import time
+import unittest
+
+from conftest import script_functions
+
+arguments = {'cache_ttl': 3600, 'cache_dead_ttl': 600, 'cache_max_age': 604800}
+checker = script_functions('multicast-checker.py', **arguments)
+scanner = script_functions('multicast-scanner.py', **arguments)
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.sqlite')
+
+    def tearDown(self):
+        for script in (checker, scanner):
+            if script.get('cache') is not None:
+                script['cache']['connection'].close()
+                script['cache'] = None
+        self.directory.cleanup()
+
+    def cache_open(self, script, ages=()):
+        """ Open the cache of the script with the (channel, state, info, seconds ago) rows written before """
+
+        script['cache'] = script['cache_open'](self.path)
+        with script['cache']['connection'] as connection:
+            for channel, state, info, age in ages:
+                connection.execute('INSERT OR REPLACE INTO channels VALUES (?, ?, ?, ?, ?, ?)', (channel, state, info, '[]', time.time() - age, time.time() - age))
+
+        return script['cache']
+
+    def test_put_and_lookup(self):
+        """ The written states are found after the flush, the misses and the hits are counted """
+
+        for script in (checker, scanner):
+            cache = self.cache_open(script)
+            self.assertIsNone(script['cache_lookup']('239.0.0.1', '1234'))
+            script['cache_put']('239.0.0.1', '1234', 'alive', {'name': 'Channel 1'}, [256])
+            script['cache_put']('239.0.0.2', '1234', 'dead')
+            script['cache_flush']()
+
+            self.assertEqual(script['cache_lookup']('239.0.0.1', '1234'), ('alive', {'name': 'Channel 1'}))
+            self.assertEqual(script['cache_lookup']('239.0.0.2', '1234'), ('dead', 0))
+            self.assertEqual((cache['hits'], cache['misses'], cache['writes']), (2, 1, 2))
+            cache['connection'].close()
+            script['cache'] = None
+            os.remove(self.path)
+
+    def test_ttls(self):
+        """ The alive channels are reused for --cache_ttl, the dead ones are trusted for the shorter --cache_dead_ttl """
+
+        for script in (checker, scanner):
+            self.cache_open(script, [('239.0.0.1:1234', 'alive', '{"name": "Fresh"}', 3000), ('239.0.0.2:1234', 'alive', '{"name": "Stale"}', 4000),
+                                     ('239.0.0.3:1234', 'dead', '0', 500), ('239.0.0.4:1234', 'dead', '0', 700),
+                                     ('239.0.0.5:1234', 'alive', '0', 10)])
+            self.assertEqual(script['cache_lookup']('239.0.0.1', '1234'), ('alive', {'name': 'Fresh'}))
+            self.assertIsNone(script['cache_lookup']('239.0.0.2', '1234'))
+            self.assertEqual(script['cache_lookup']('239.0.0.3', '1234'), ('dead', 0))
+            self.assertIsNone(script['cache_lookup']('239.0.0.4', '1234'))
+
+            # The alive channel without the stream's info is probed again
+            self.assertIsNone(script['cache_lookup']('239.0.0.5', '1234'))
+
+    def test_dead_keeps_info(self):
+        """ The dead state of the known channel keeps its info for the time it is alive again """
+
+        cache = self.cache_open(checker, [('239.0.0.1:1234', 'alive', '{"name": "Channel 1"}', 10)])
+        checker['cache_put']('239.0.0.1', '1234', 'dead')
+        checker['cache_flush']()
+        row = cache['connection'].execute('SELECT state, info FROM channels').fetchone()
+        self.assertEqual(row, ('dead', '{"name": "Channel 1"}'))
+
+    def test_eviction(self):
+        """ The entries older than --cache_max_age are evicted when the cache is opened """
+
+        self.cache_open(checker, [('239.0.0.1:1234', 'alive', '{}', 10), ('239.0.0.2:1234', 'dead', '0', 700000)])
+        checker['cache']['connection'].close()
+
+        cache = self.cache_open(scanner)
+        self.assertEqual(cache['evicted'], 1)
+        self.assertEqual(cache['connection'].execute('SELECT channel FROM channels').fetchall(), [('239.0.0.1:1234',)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# Tests of the Prometheus exporter of the checker: the channels' series, the histograms and the label escaping
+#
+# Run: python3 -m pytest tests
+
+import re
+import unittest
+
+from conftest import script_functions
+
+checker = script_functions('multicast-checker.py', nic='127.0.0.1')
+
+# The sample line of the text exposition format: the name, the optional labels and the value
+sample_re = re.compile(r'^([a-z_]+)(?:\{(.*)\})? (\S+)$')
+
+def exporter_samples():
+    """ Render the metrics, get the samples by their name and labels """
+
+    samples = {}
+    for line in checker['exporter_render']().splitlines():
+        if line.startswith('#'):
+            continue
+        name, labels, value = sample_re.match(line).groups()
+        samples[(name, labels)] = float(value)
+
+    return samples
+
+class ExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        checker['exporter_start'](0)
+
+    def test_channels(self):
+        """ The gauges are the last check's values, the counters accumulate """
+
+        metrics = {'cc_errors': 2, 'bitrate': 2000, 'loss': 0.5, 'rtp_lost': 3, 'rtp_jitter': 0.04}
+        checker['exporter_check']('Channel 1', '239.0.0.1', '1234', True, 0.02, 1.5, metrics)
+        checker['exporter_check']('Channel 1', '239.0.0.1', '1234', True, 0.03, 1.2, dict(metrics, bitrate=1900))
+        checker['exporter_check']('Channel 2', '239.0.0.2', '1234', False, None, 2, None)
+
+        samples = exporter_samples()
+        labels = 'channel="Channel 1",group="239.0.0.1:1234"'
+        self.assertEqual(samples[('multicast_channel_up', labels)], 1)
+        self.assertEqual(samples[('multicast_channel_check_seconds', labels)], 1.2)
+        self.assertEqual(samples[('multicast_channel_continuity_errors_total', labels)], 4)
+        self.assertEqual(samples[('multicast_channel_bitrate_kbps', labels)], 1900)
+        self.assertEqual(samples[('multicast_channel_rtp_lost_total', labels)], 6)
+        self.assertEqual(samples[('multicast_channel_up', 'channel="Channel 2",group="239.0.0.2:1234"')], 0)
+        self.assertEqual(samples[('multicast_channels', None)], 2)
+
+    def test_histograms(self):
+        """ The buckets are cumulative, the silent channel has no first packet time """
+
+        for first, duration in ((0.004, 0.5), (0.02, 1.5), (None, 2)):
+            checker['exporter_check']('Channel', '239.0.0.1', '1234', first is not None, first, duration, None)
+
+        samples = exporter_samples()
+        self.assertEqual(samples[('multicast_first_packet_seconds_bucket', 'le="0.005"')], 1)
+        self.assertEqual(samples[('multicast_first_packet_seconds_bucket', 'le="0.025"')], 2)
+        self.assertEqual(samples[('multicast_first_packet_seconds_bucket', 'le="+Inf"')], 2)
+        self.assertEqual(samples[('multicast_first_packet_seconds_count', None)], 2)
+        self.assertEqual(samples[('multicast_check_seconds_bucket', 'le="1"')], 1)
+        self.assertEqual(samples[('multicast_check_seconds_bucket', 'le="2.5"')], 3)
+        self.assertEqual(samples[('multicast_check_seconds_sum', None)], 4)
+
+    def test_label_escaping(self):
+        """ The quotes, the backslashes and the new lines of the channel's name are escaped """
+
+        checker['exporter_check']('News "24"\\HD\n', '239.0.0.1', '1234', True, 0.01, 1, None)
+        text = checker['exporter_render']()
+        self.assertIn('multicast_channel_up{channel="News \\"24\\"\\\\HD\\n",group="239.0.0.1:1234"} 1\n', text)
+
+        # Every sample line is parsed back
+        for line in text.splitlines():
+            self.assertTrue(line.startswith('#') or sample_re.match(line), line)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# Tests of the adaptive timeouts of the checker learned from the channels' latencies history
+#
+# Run: python3 -m pytest tests
+
+import threading
+import unittest
+
+from conftest import script_functions
+
+checker = script_functions('multicast-checker.py', udp_timeout=2, info_timeout=10, adaptive_margin=3, zap=False)
+
+# The history settings of the script (set after its functions)
+checker.update({'cache': {'lock': threading.Lock()}, 'history_size': 50, 'history_samples': 5, 'history_floor': 0.25, 'history_quiet': 1})
+
+def history_timeouts(checks, udp_timeout=None, zap=False):
+    """ Add the (first packet, info) latencies of the checks to the new history, get the channel's timeouts """
+
+    checker['history'] = {}
+    checker['args'].zap = zap
+    for first, info in checks:
+        checker['history_add']('239.0.0.1', 1234, first, info)
+
+    return checker['history_timeouts']('239.0.0.1', 1234, udp_timeout)
+
+class HistoryTimeoutsTest(unittest.TestCase):
+
+    def test_not_learned(self):
+        """ The channel with less than 5 checks waits for the given timeouts """
+
+        self.assertEqual(history_timeouts([(0.1, 0.5)] * 4), (2, 10))
+        self.assertEqual(history_timeouts([(0.1, 0.5)] * 4, udp_timeout=1), (1, 10))
+
+    def test_learned(self):
+        """ The p99 latency with the margin, not shorter than the floor and not longer than the timeouts """
+
+        self.assertEqual(history_timeouts([(0.05, 0.5)] * 5), (0.25, 1.5))
+        self.assertEqual(history_timeouts([(0.5, 1)] * 4 + [(1, 5)]), (2, 10))
+
+    def test_silent_channel(self):
+        """ The group silent in the last 5 checks is waited for 1 second """
+
+        self.assertEqual(history_timeouts([(None, None)] * 5), (1, 10))
+        self.assertEqual(history_timeouts([(None, None)] * 5, udp_timeout=0.5), (0.5, 10))
+
+    def test_zap_keyframe_wait(self):
+        """ With --zap the learned info time does not cut the keyframe wait short """
+
+        self.assertEqual(history_timeouts([(0.05, 0.5)] * 5, zap=True), (0.25, 10))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# Tests of the checkpoint journal of the scanner: the finished blocks, the found channels and the resumed range
+#
+# Run: python3 -m pytest tests
+
+import ipaddress
+import os
+import tempfile
+import unittest
+
+from conftest import script_functions
+
+scanner = script_functions('multicast-scanner.py')
+
+# The scan settings of the script (set after its functions): the range of 2 blocks, one shard
+scanner.update({'ip_list': ipaddress.IPv4Network('239.1.0.0/23'), 'journal_block': 256, 'shard_index': 0, 'shard_count': 1, 'progress': None})
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.playlist = os.path.join(self.directory.name, 'scan_results_range_239.1.0.0_23.m3u')
+        scanner['journal'] = scanner['journal_open'](self.playlist, False)
+
+    def tearDown(self):
+        scanner['journal']['file'].close()
+        self.directory.cleanup()
+
+    def journal_resume(self):
+        """ Close the journal and open it again as --resume does """
+
+        scanner['journal']['file'].close()
+        scanner['journal'] = scanner['journal_open'](self.playlist, True)
+
+        return scanner['journal']
+
+    def test_completed_blocks(self):
+        """ The block is recorded when all of its items are done, the resume skips it """
+
+        for offset in range(256):
+            scanner['journal_done'](f'239.1.0.{offset}', '1234')
+        for offset in range(255):
+            scanner['journal_done'](f'239.1.1.{offset}', '1234')
+        scanner['journal_done']('239.1.1.0', '5000')
+
+        journal = self.journal_resume()
+        self.assertEqual(journal['done'], {('1234', 0)})
+        ips = list(scanner['range_ips'](scanner['ip_list'], '1234'))
+        self.assertEqual((str(ips[0]), len(ips)), ('239.1.1.0', 256))
+        self.assertEqual(scanner['progress_total'](scanner['ip_list'], ['1234', '5000']), 256 + 512)
+
+    def test_found_channels(self):
+        """ The found channels are restored, the line cut by a crash is skipped """
+
+        scanner['journal_write']({'channel': ['239.1.0.1', '1234', 'Channel 1']})
+        scanner['journal_write']({'channel': ['239.1.0.2', '1234', 1, 'rtp']})
+        scanner['journal']['file'].write('{"channel": ["239.1.0.3", "12')
+        scanner['journal']['file'].flush()
+
+        journal = self.journal_resume()
+        self.assertEqual(journal['channels'], [['239.1.0.1', '1234', 'Channel 1'], ['239.1.0.2', '1234', 1, 'rtp']])
+        self.assertEqual(journal['found'], {('239.1.0.1', '1234'), ('239.1.0.2', '1234')})
+
+    def test_new_scan(self):
+        """ The scan without --resume starts the journal anew """
+
+        scanner['journal_write']({'block': 0, 'port': '1234'})
+        scanner['journal']['file'].close()
+        scanner['journal'] = scanner['journal_open'](self.playlist, False)
+        scanner['journal']['file'].close()
+
+        with open(scanner['journal']['name']) as file:
+            self.assertEqual(file.read(), '')
+
+    def test_shard_blocks(self):
+        """ The shard scans every N-th block of the range """
+
+        scanner.update({'shard_index': 1, 'shard_count': 2})
+        try:
+            ips = list(scanner['range_ips'](scanner['ip_list'], '1234'))
+        finally:
+            scanner.update({'shard_index': 0, 'shard_count': 1})
+        self.assertEqual((str(ips[0]), str(ips[-1])), ('239.1.1.0', '239.1.1.255'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Tests of the discovery mode of the scanner: the BPF program of the packet socket and the captured datagrams' parser
+#
+# Run: python3 -m pytest tests
+
+import socket
+import struct
+import unittest
+
+from conftest import script_functions
+
+scanner = script_functions('multicast-scanner.py')
+
+def ip_packet(destination, protocol=17, fragment=0, payload=b'\x47' + b'\x00' * 187, port=1234):
+    """ Build the IPv4 packet (UDP with the given payload) to the destination address """
+
+    udp = struct.pack('>HHHH', 5000, port, 8 + len(payload), 0) + payload
+    return struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 1, fragment, 1, protocol, 0,
+                       socket.inet_aton('10.0.0.1'), socket.inet_aton(destination)) + udp
+
+def filter_run(program, packet):
+    """ Run the classic BPF program of the scanner (its instructions only) over the packet, get the bytes to capture """
+
+    accumulator = 0
+    index = 0
+    while True:
+        code, jump_true, jump_false, k = program[index]
+        index += 1
+        if code == 0x30:
+            accumulator = packet[k]
+        elif code == 0x28:
+            accumulator = int.from_bytes(packet[k:k + 2], 'big')
+        elif code == 0x20:
+            accumulator = int.from_bytes(packet[k:k + 4], 'big')
+        elif code == 0x54:
+            accumulator &= k
+        elif code == 0x15:
+            index += jump_true if accumulator == k else jump_false
+        elif code == 0x45:
+            index += jump_true if accumulator & k else jump_false
+        elif code == 0x06:
+            return k
+        else:
+            raise ValueError(f'unknown BPF instruction {code:#x}')
+
+class PacketFilterTest(unittest.TestCase):
+
+    def test_multicast_udp(self):
+        """ The multicast UDP datagrams are captured by their headers only """
+
+        for group in ('224.0.0.1', '239.255.0.1', '239.255.255.255'):
+            self.assertEqual(filter_run(scanner['packet_filter'], ip_packet(group)), 96)
+
+    def test_dropped_packets(self):
+        """ The unicast and broadcast datagrams, the other protocols and the fragments are dropped """
+
+        self.assertEqual(filter_run(scanner['packet_filter'], ip_packet('10.0.0.2')), 0)
+        self.assertEqual(filter_run(scanner['packet_filter'], ip_packet('255.255.255.255')), 0)
+        self.assertEqual(filter_run(scanner['packet_filter'], ip_packet('239.255.0.1', protocol=6)), 0)
+        self.assertEqual(filter_run(scanner['packet_filter'], ip_packet('239.255.0.1', fragment=0x0010)), 0)
+
+        # The first fragment (more fragments flag, offset 0) has the UDP header: it is captured
+        self.assertEqual(filter_run(scanner['packet_filter'], ip_packet('239.255.0.1', fragment=0x2000)), 96)
+
+    def test_packet_parser(self):
+        """ The group, the port and the payload type of the captured headers """
+
+        self.assertEqual(scanner['packet_parser'](ip_packet('239.255.0.1')[:96]), ('239.255.0.1', 1234, 'ts'))
+        self.assertEqual(scanner['packet_parser'](ip_packet('239.255.0.2', payload=b'\x80\x21' + b'\x00' * 10, port=5000)), ('239.255.0.2', 5000, 'rtp'))
+        self.assertEqual(scanner['packet_parser'](ip_packet('239.255.0.3', payload=b'')), ('239.255.0.3', 1234, 'udp'))
+        self.assertEqual(scanner['packet_parser'](ip_packet('239.255.0.4', payload=b'\x00\x01')), ('239.255.0.4', 1234, 'udp'))
+        self.assertIsNone(scanner['packet_parser'](ip_packet('239.255.0.5')[:24]))
+
+    @unittest.skipIf(not hasattr(socket, 'AF_PACKET'), 'the packet sockets are available on Linux only')
+    def test_filter_attach(self):
+        """ The kernel accepts the program (the struct sock_fprog packing) """
+
+        try:
+            sock = scanner['packet_socket_creator']('0.0.0.0')
+        except PermissionError:
+            self.skipTest('the packet socket needs CAP_NET_RAW')
+        sock.close()
+
+if __name__ == '__main__':
+    unittest.main()
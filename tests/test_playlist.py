@@ -0,0 +1,76 @@
+# Tests of the M3U playlist reader of the checker and the scanner: the EXTINF fields, the URLs and the duplicates
+#
+# Run: python3 -m pytest tests
+
+import os
+import tempfile
+import unittest
+
+from conftest import script_functions
+
+checker = script_functions('multicast-checker.py')
+scanner = script_functions('multicast-scanner.py')
+
+playlist_text = '''#EXTM3U x-tvg-url="http://example.com/epg.xml"
+#EXTINF:-1 tvg-id="first.tv" group-title="News, World",First, the channel
+udp://@239.0.0.1:1234
+
+#EXTINF:0,Second
+#EXTGRP:Sports
+#EXTVLCOPT:network-caching=1000
+rtp://10.0.0.1@239.0.0.2:5000
+#EXTINF:-1,Web
+http://example.com/stream.m3u8
+UDP://@239.0.0.3
+#EXTINF:-1,Second again
+udp://@239.0.0.2:5000
+'''
+
+class PlaylistTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.playlist = os.path.join(self.directory.name, 'all.m3u')
+        with open(self.playlist, 'w') as file:
+            file.write(playlist_text)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_records(self):
+        """ The EXTINF fields, the EXTGRP group, the SSM source and the default port, the other schemes are skipped """
+
+        for script in (checker, scanner):
+            records = list(script['playlist_reader'](self.playlist))
+            self.assertEqual([(record['address'], record['port'], record['scheme']) for record in records],
+                             [('239.0.0.1', '1234', 'udp'), ('239.0.0.2', '5000', 'rtp'), ('239.0.0.3', '1234', 'udp'), ('239.0.0.2', '5000', 'udp')])
+            self.assertEqual(records[0]['name'], 'First, the channel')
+            self.assertEqual(records[0]['attributes'], {'tvg-id': 'first.tv', 'group-title': 'News, World'})
+            self.assertEqual(records[1]['name'], 'Second')
+            self.assertEqual(records[1]['duration'], '0')
+            self.assertEqual(records[1]['attributes'], {'group-title': 'Sports'})
+
+            # The URL without the EXTINF is named by its address, the EXTINF of the skipped URL is not carried over
+            self.assertEqual(records[2]['name'], '239.0.0.3:1234')
+
+    def test_duplicates(self):
+        """ The first channel of the same group:port is kept """
+
+        channels = scanner['playlist_parser'](self.playlist)
+        self.assertEqual(list(channels), ['239.0.0.1:1234', '239.0.0.2:5000', '239.0.0.3:1234'])
+        self.assertEqual(channels['239.0.0.2:5000']['name'], 'Second')
+
+    def test_several_playlists(self):
+        """ The channels of the first playlist are kept over the same ones of the next playlists """
+
+        premium = os.path.join(self.directory.name, 'premium.m3u')
+        with open(premium, 'w') as file:
+            file.write('#EXTM3U\n#EXTINF:-1,Premium\nudp://@239.0.0.2:5000\n')
+
+        channels = checker['playlist_parser']([premium, self.playlist])
+        self.assertEqual(list(channels), ['239.0.0.2:5000', '239.0.0.1:1234', '239.0.0.3:1234'])
+        self.assertEqual((channels['239.0.0.2:5000']['name'], channels['239.0.0.2:5000']['playlist']), ('Premium', 'premium.m3u'))
+        self.assertEqual(channels['239.0.0.1:1234']['playlist'], 'all.m3u')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+# Tests of the scanner's progress: the EWMA of the throughput and the ETA
+#
+# Run: python3 -m pytest tests
+
+import unittest
+
+from conftest import script_functions
+
+scanner = script_functions('multicast-scanner.py')
+
+def progress_estimates(reports, total=1000, alpha=0.3):
+    """ Feed the (seconds, items done) reports to the new progress, get the (rate, ETA) after each one """
+
+    scanner.update({'progress_alpha': alpha, 'progress': {'total': total, 'rate': None, 'last_done': 0, 'last_time': 0}})
+    estimates = []
+    for now, done in reports:
+        eta = scanner['progress_estimate'](done, now)
+        estimates.append((round(scanner['progress']['rate'], 3), round(eta, 3) if eta is not None else None))
+
+    return estimates
+
+class ProgressTest(unittest.TestCase):
+
+    def test_constant_rate(self):
+        """ The constant throughput projects the time left linearly """
+
+        self.assertEqual(progress_estimates([(10, 100), (20, 200), (30, 300)]), [(10, 90), (10, 80), (10, 70)])
+
+    def test_smoothed_rate(self):
+        """ The change of the throughput is weighted by alpha, the stall keeps the last estimate decaying """
+
+        self.assertEqual(progress_estimates([(10, 100), (20, 300)]), [(10, 90), (13, 53.846)])
+        self.assertEqual(progress_estimates([(10, 100), (20, 100)]), [(10, 90), (7, 128.571)])
+
+    def test_unknown_eta(self):
+        """ No items done yet: the ETA is unknown """
+
+        self.assertEqual(progress_estimates([(10, 0)]), [(0, None)])
+
+    def test_done(self):
+        """ All the items done: nothing is left """
+
+        self.assertEqual(progress_estimates([(10, 1000)]), [(100, 0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# Tests of the RTP receiver statistics of the checker: the loss, the reordering and the sender's restart
+#
+# Run: python3 -m pytest tests
+
+import struct
+import unittest
+
+from conftest import script_functions
+
+checker = script_functions('multicast-checker.py')
+
+def rtp_datagram(sequence, ssrc=0x1234, timestamp=0):
+    """ Build the RTP datagram of one TS packet """
+
+    return struct.pack('>BBHII', 0x80, 33, sequence & 0xFFFF, timestamp, ssrc) + b'\x47' + b'\x00' * 187
+
+def rtp_receive(sequences, ssrcs=None):
+    """ Feed the datagrams of the sequence numbers (and the SSRCs) to the receiver, get its metrics """
+
+    rtp = checker['rtp_receiver']()
+    for index, sequence in enumerate(sequences):
+        payload = checker['rtp_strip'](rtp, rtp_datagram(sequence, ssrcs[index] if ssrcs else 0x1234), 100 + index / 1000)
+        assert payload[0] == 0x47 and len(payload) == 188
+
+    return rtp, checker['rtp_metrics'](rtp, 101, 10)
+
+class RtpReceiverTest(unittest.TestCase):
+
+    def test_loss_and_reordering(self):
+        """ The gaps are lost, the late datagrams fill them """
+
+        rtp, metrics = rtp_receive([1, 2, 4, 5, 8, 7, 9])
+        self.assertEqual(metrics['rtp_lost'], 2)
+        self.assertEqual(metrics['rtp_reordered'], 1)
+        self.assertEqual(rtp['missing'], 2)
+        self.assertEqual(rtp['lost'], 3)
+
+    def test_sequence_wrap(self):
+        """ The sequence number wraps without the loss """
+
+        rtp, metrics = rtp_receive([65534, 65535, 0, 1])
+        self.assertEqual(metrics['rtp_lost'], 0)
+
+    def test_sender_restart(self):
+        """ The new random sequence number of the same sender is resynced without the loss """
+
+        rtp, metrics = rtp_receive([100, 101, 102, 30000, 30001, 30002])
+        self.assertEqual(metrics['rtp_lost'], 0)
+        self.assertEqual(rtp['lost'], 0)
+        self.assertEqual(rtp['ssrc'][0x1234]['sequence'], 30002)
+
+    def test_stray_datagram(self):
+        """ The single datagram far ahead is not the loss and does not move the sequence """
+
+        rtp, metrics = rtp_receive([100, 101, 20000, 102, 103])
+        self.assertEqual(metrics['rtp_lost'], 0)
+        self.assertEqual(rtp['ssrc'][0x1234]['sequence'], 103)
+
+    def test_interleaved_senders(self):
+        """ Each sender of the group keeps its own sequence: the loss of both is counted """
+
+        rtp, metrics = rtp_receive([100, 5000, 101, 5001, 103, 5003], [1, 2, 1, 2, 1, 2])
+        self.assertEqual(sorted(rtp['ssrc']), [1, 2])
+        self.assertEqual(metrics['rtp_ssrc'], 2)
+        self.assertEqual(metrics['rtp_lost'], 2)
+
+    def test_stray_sender(self):
+        """ The single datagram of another source does not reset the sender's state """
+
+        rtp, metrics = rtp_receive([100, 101, 7, 102, 104], [1, 1, 9, 1, 1])
+        self.assertEqual(rtp['ssrc'][1]['sequence'], 104)
+        self.assertEqual(metrics['rtp_lost'], 1)
+
+    def test_senders_eviction(self):
+        """ The senders over the limit evict the one silent for the longest time """
+
+        count = checker['rtp_max_ssrc'] + 2
+        rtp, metrics = rtp_receive([10] * count, list(range(count)))
+        self.assertEqual(sorted(rtp['ssrc']), list(range(2, count)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# Tests of the check tiers of the checker: the --tier options and the channels' assignment
+#
+# Run: python3 -m pytest tests
+
+import unittest
+
+from conftest import script_functions
+
+checker = script_functions('multicast-checker.py', udp_timeout=2, interval=0)
+
+def tiers_parser(*values):
+    """ Parse the --tier values with the default depth, get the (match, interval, timeout, depth) of the tiers """
+
+    return [(tier['match'], tier['interval'], tier['timeout'], tier['depth']) for tier in checker['tiers_parser'](values, 'info')]
+
+class TiersTest(unittest.TestCase):
+
+    def test_fields(self):
+        """ The optional timeout and depth, the rest of the channels in the last tier """
+
+        self.assertEqual(tiers_parser('premium.m3u:10:1:metrics', 'Sports:60', 'News:30::join'),
+                         [('premium.m3u', 10, 1, 'metrics'), ('Sports', 60, 2, 'info'), ('News', 30, 2, 'join'), ('*', 300, 2, 'info')])
+        self.assertEqual(tiers_parser('*:120:5:join'), [('*', 120, 5, 'join')])
+
+    def test_title_with_colons(self):
+        """ The group-title could contain ':' """
+
+        self.assertEqual(tiers_parser('Sports: HD:60')[0], ('Sports: HD', 60, 2, 'info'))
+        self.assertEqual(tiers_parser('Sports: HD:60:1')[0], ('Sports: HD', 60, 1, 'info'))
+        self.assertEqual(tiers_parser('A:B:C:60:1:join')[0], ('A:B:C', 60, 1, 'join'))
+        self.assertEqual(tiers_parser('Film: 4K:60::metrics')[0], ('Film: 4K', 60, 2, 'metrics'))
+
+    def test_wrong_tiers(self):
+        """ The tier without the title, the interval or with the unknown depth stops the script """
+
+        for value in (':60', 'Sports', 'Sports:0', 'Sports:sixty', 'Sports:60:1:full'):
+            with self.assertRaises(SystemExit, msg=value):
+                tiers_parser(value)
+
+    def test_assign(self):
+        """ A channel is in the first tier matching its group-title or its playlist """
+
+        channels = {'239.0.0.1:1234': {'attributes': {'group-title': 'Sports: HD'}, 'playlist': 'all.m3u'},
+                    '239.0.0.2:1234': {'attributes': {'group-title': 'Sports: HD'}, 'playlist': 'premium.m3u'},
+                    '239.0.0.3:1234': {'attributes': {}, 'playlist': 'all.m3u'}}
+        tiers = checker['tiers_parser'](['premium.m3u:10', 'Sports: HD:60'], 'info')
+        checker['tiers_assign'](channels, tiers)
+        self.assertEqual([tier['channels'] for tier in tiers], [['239.0.0.2:1234'], ['239.0.0.1:1234'], ['239.0.0.3:1234']])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# Tests of the MPEG-TS health analyzer of the checker: the continuity counters and the PCR timing
+#
+# Run: python3 -m pytest tests
+
+import unittest
+
+from conftest import script_functions
+
+checker = script_functions('multicast-checker.py', pcr=True)
+generator = script_functions('multicast-generator.py')
+
+def ts_datagrams(count, bitrate=1000000):
+    """ Build the datagrams of the synthetic channel with their sending time at the constant bitrate """
+
+    channel = {'pat': generator['ts_pat'](1), 'pmt': generator['ts_pmt'](1), 'sdt': None,
+               'continuity': {}, 'position': 0, 'psi_time': -1, 'pcr_time': -1, 'keyframe_time': 0, 'bitrate': bitrate}
+
+    datagrams = []
+    for index in range(count):
+        now = 100 + index * 1316 * 8 / bitrate
+        datagrams.append((generator['datagram'](channel, now), now))
+
+    return datagrams
+
+def ts_packet(counter, pid=0x100, discontinuity=False):
+    """ Build the TS packet of the PID with the counter (and the adaptation field's discontinuity indicator) """
+
+    if discontinuity:
+        return bytes([0x47, pid >> 8, pid & 0xFF, 0x30 | counter, 1, 0x80]) + b'\x00' * 182
+
+    return bytes([0x47, pid >> 8, pid & 0xFF, 0x10 | counter]) + b'\x00' * 184
+
+def ts_analyze(datagrams, lost=()):
+    """ Feed the datagrams (without the lost ones) to the analyzer, get its metrics """
+
+    analyzer = checker['ts_analyzer']()
+    for index, (data, now) in enumerate(datagrams):
+        if index not in lost:
+            checker['ts_analyze'](analyzer, data, now)
+    now = datagrams[-1][1]
+
+    return analyzer, checker['ts_metrics'](analyzer, now, 10)
+
+class TsAnalyzerTest(unittest.TestCase):
+
+    def test_clean_stream(self):
+        """ The clean stream has no CC errors and the PCR accuracy of the rounding only """
+
+        analyzer, metrics = ts_analyze(ts_datagrams(500))
+        self.assertEqual(metrics['cc_errors'], 0)
+        self.assertEqual(metrics['pcr_pids'], 1)
+        self.assertLess(metrics['pcr_accuracy'], 500)
+
+    def test_lost_datagram_pcr_accuracy(self):
+        """ The lost packets are counted and their bytes do not turn into the PCR accuracy error """
+
+        analyzer, metrics = ts_analyze(ts_datagrams(500), lost={205, 305})
+        self.assertEqual(metrics['cc_errors'], 2)
+        self.assertAlmostEqual(metrics['loss'], 14 * 100 / 3500)
+        self.assertLess(metrics['pcr_accuracy'], 500)
+
+    def test_duplicate_packets(self):
+        """ The packet repeated once is allowed, the second repeat is the CC error without the lost packets """
+
+        datagrams = [(b''.join(ts_packet(counter) for counter in (0, 1, 1, 2, 2, 2, 3)), 100)]
+        analyzer, metrics = ts_analyze(datagrams)
+        self.assertEqual(metrics['cc_errors'], 1)
+        self.assertEqual(metrics['loss'], 0)
+
+    def test_discontinuity_indicator(self):
+        """ The counter jump of the packet with the discontinuity indicator is not the CC error """
+
+        datagrams = [(b''.join([ts_packet(0), ts_packet(1), ts_packet(9, discontinuity=True), ts_packet(10), ts_packet(12)]), 100)]
+        analyzer, metrics = ts_analyze(datagrams)
+        self.assertEqual(metrics['cc_errors'], 1)
+        self.assertEqual(analyzer['cc_errors'], {0x100: 1})
+
+if __name__ == '__main__':
+    unittest.main()
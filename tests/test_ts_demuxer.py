@@ -0,0 +1,125 @@
+# Tests of the built-in MPEG-TS demuxer of the checker and the scanner against the synthetic TS files
+# ffprobe (if installed) is the oracle of the channels' names
+#
+# Run: python3 -m pytest tests
+
+import json
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from conftest import script_functions
+
+checker = script_functions('multicast-checker.py')
+scanner = script_functions('multicast-scanner.py')
+generator = script_functions('multicast-generator.py')
+
+# The encoded service names with the character table selection bytes and their text
+service_names = [
+    (b'Channel 1', 'Channel 1'),
+    ('Первый канал'.encode('utf-8'), 'Первый канал'),
+    (b'\x01' + 'Первый канал'.encode('iso8859-5'), 'Первый канал'),
+    (b'\x10\x00\x05' + 'Россия 1'.encode('iso8859-5'), 'Россия 1'),
+    (b'\x03' + 'ΕΡΤ1'.encode('iso8859-7'), 'ΕΡΤ1'),
+    (b'\x05' + 'Şov TV'.encode('iso8859-9'), 'Şov TV'),
+    (b'\x11' + 'Матч ТВ'.encode('utf-16-be'), 'Матч ТВ'),
+    (b'\x13' + '中央电视台'.encode('gb2312'), '中央电视台'),
+    (b'\x14' + '公視'.encode('big5'), '公視'),
+    (b'\x15' + 'Канал 5'.encode('utf-8'), 'Канал 5'),
+]
+
+def sdt_service(program_number, descriptor, loop_length=None):
+    """ Build the service of the SDT with its descriptors' loop (of the given length if set) """
+
+    length = len(descriptor) if loop_length is None else loop_length
+
+    return program_number.to_bytes(2, 'big') + bytes([0xFC, 0x80 | (length >> 8), length & 0xFF]) + descriptor
+
+def ts_sdt(program_number, name, services=b''):
+    """ Build the SDT of the program with the encoded service name (after the given services) """
+
+    provider = b'multicast-generator'
+    descriptor = bytes([0x48, 3 + len(provider) + len(name), 0x01, len(provider)]) + provider + bytes([len(name)]) + name
+    body = bytes([0x00, 0x01, 0xFF]) + services + sdt_service(program_number, descriptor)
+
+    return generator['ts_section'](0x42, 1, body)
+
+def ts_file(program_number, name):
+    """ Build one second of the synthetic TS of the program with the given service name """
+
+    channel = {'pat': generator['ts_pat'](program_number), 'pmt': generator['ts_pmt'](program_number), 'sdt': ts_sdt(program_number, name),
+               'continuity': {}, 'position': 0, 'psi_time': 0, 'pcr_time': 0, 'keyframe_time': 0, 'bitrate': 500000}
+
+    packets = []
+    for tick in range(10):
+        packets += generator['psi_packets'](channel)
+        packets += [generator['video_packet'](channel, tick / 10 + index / 1000) for index in range(30)]
+
+    return b''.join(packets)
+
+def demuxer_programs(script, data):
+    """ Demux the TS by the datagrams of 7 packets and get the ffprobe-like programs """
+
+    demuxer = script['ts_demuxer']()
+    for offset in range(0, len(data), 1316):
+        script['ts_demux'](demuxer, data[offset:offset + 1316])
+
+    return script['ts_demuxer_programs'](demuxer)
+
+class TsDemuxerTest(unittest.TestCase):
+
+    def test_service_names(self):
+        """ The service names of all the character tables are decoded by both scripts """
+
+        for number, (name, text) in enumerate(service_names, 1):
+            data = ts_file(number, name)
+            for script in (checker, scanner):
+                programs = demuxer_programs(script, data)['programs']
+                self.assertEqual(len(programs), 1)
+                self.assertEqual(programs[0]['program_num'], number)
+                self.assertEqual(programs[0]['tags']['service_name'], text)
+                self.assertEqual([stream['codec_name'] for stream in programs[0]['streams']], ['h264'])
+
+    def test_broken_service_descriptors(self):
+        """ The service descriptors overrunning their lengths are skipped, the next services are parsed """
+
+        broken = [
+            sdt_service(1, bytes([0x48, 5, 0x01, 200, 0x41, 0x42, 0x43])),                   # the provider's length
+            sdt_service(2, bytes([0x48, 6, 0x01, 1, 0x41, 50, 0x42, 0x43])),                 # the name's length
+            sdt_service(3, bytes([0x48, 40, 0x01, 1, 0x41, 1, 0x42])),                       # the descriptor's length
+            sdt_service(4, bytes([0x48, 1, 0x01])),                                          # too short
+        ]
+        for services in broken:
+            for script in (checker, scanner):
+                demuxer = script['ts_demuxer']()
+                script['ts_section_parser'](demuxer, ts_sdt(9, b'Channel 9', services))
+                self.assertEqual(demuxer['sdt'], {9: ('multicast-generator', 'Channel 9')})
+
+        # The descriptors' loop overrunning the section ends with it
+        for script in (checker, scanner):
+            demuxer = script['ts_demuxer']()
+            script['ts_section_parser'](demuxer, ts_sdt(9, b'Channel 9', sdt_service(5, bytes([0x48, 5, 0x01, 1, 0x41, 1, 0x42]), loop_length=900)))
+            self.assertEqual(demuxer['sdt'], {5: ('A', 'B')})
+
+    @unittest.skipIf(shutil.which('ffprobe') is None, 'ffprobe is not installed')
+    def test_ffprobe_oracle(self):
+        """ The programs and the service names are the same as ffprobe finds in the TS file """
+
+        for number, (name, text) in enumerate(service_names, 1):
+            data = ts_file(number, name)
+            with tempfile.NamedTemporaryFile(suffix='.ts') as file:
+                file.write(data)
+                file.flush()
+                output = subprocess.run(['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_programs', file.name],
+                                        capture_output=True, text=True, check=True).stdout
+            expected = json.loads(output)['programs']
+
+            for script in (checker, scanner):
+                programs = demuxer_programs(script, data)['programs']
+                self.assertEqual([program['program_num'] for program in programs], [program['program_num'] for program in expected])
+                self.assertEqual([program['tags'].get('service_name') for program in programs],
+                                 [program['tags'].get('service_name') for program in expected])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# Tests of the zap time measurement of the checker: the stages since the join and the keyframe detection
+#
+# Run: python3 -m pytest tests
+
+import unittest
+
+from conftest import script_functions
+
+checker = script_functions('multicast-checker.py')
+generator = script_functions('multicast-generator.py')
+
+video_pid = generator['video_pid']
+
+def ts_channel(gop=1):
+    """ Create the generator's channel state of the program 1 (the keyframe every GOP seconds) """
+
+    generator['args'].gop = gop
+    return {'pat': generator['ts_pat'](1), 'pmt': generator['ts_pmt'](1), 'sdt': generator['ts_sdt'](1, 'Channel 1'),
+            'continuity': {}, 'position': 0, 'psi_time': -1, 'pcr_time': -1, 'keyframe_time': 0, 'bitrate': 1000000}
+
+def video_demuxer(stream_type):
+    """ Create the demuxer with the known PMT of the video stream of the type """
+
+    demuxer = checker['ts_demuxer']()
+    demuxer['pmt'][1] = {'pcr_pid': video_pid, 'streams': [(video_pid, stream_type)]}
+
+    return demuxer
+
+def pes_packet(nal, random_access=False):
+    """ Build the video packet starting the PES with the given start code's payload """
+
+    channel = ts_channel()
+    payload = b'\x00\x00\x01\xe0\x00\x00\x80\x00\x00' + b'\x00\x00\x01' + nal
+    adaptation = bytes([0x40]) if random_access else None
+
+    return generator['ts_packet'](channel, video_pid, payload + b'\x00' * (184 - len(payload) - (2 if random_access else 0)), True, adaptation)
+
+class ZapTest(unittest.TestCase):
+
+    def test_stages(self):
+        """ The stages are reached in order: the first packet, the PAT, the PMT and the keyframe after the PMT """
+
+        # The first keyframe is sent before the tables, the next one a GOP later (with the next PCR, every 20 ms)
+        channel = ts_channel(gop=0.5)
+        channel['psi_time'] = 0
+        demuxer = checker['ts_demuxer']()
+        zap = checker['ts_zap'](0)
+        for index in range(100):
+            now = index / 100
+            data = generator['datagram'](channel, now)
+            checker['ts_demux'](demuxer, data)
+            checker['ts_zap_update'](zap, demuxer, data, now)
+
+        self.assertEqual(zap['packet'], 0)
+        self.assertEqual((zap['pat'], zap['pmt']), (0.1, 0.1))
+        self.assertAlmostEqual(zap['keyframe'], 0.5, delta=0.02)
+
+    def test_random_access_indicator(self):
+        """ The random_access_indicator of the adaptation field is the keyframe of any video stream """
+
+        packet = pes_packet(b'\x41', random_access=True)
+        self.assertTrue(checker['ts_keyframe'](video_demuxer(0x1b), packet))
+        self.assertFalse(checker['ts_keyframe'](video_demuxer(0x1b), pes_packet(b'\x41')))
+
+    def test_pictures(self):
+        """ The IDR picture of H.264 and HEVC and the sequence header of MPEG-2 without the indicator """
+
+        self.assertTrue(checker['ts_keyframe'](video_demuxer(0x1b), pes_packet(b'\x65')))
+        self.assertTrue(checker['ts_keyframe'](video_demuxer(0x24), pes_packet(bytes([19 << 1, 0x01]))))
+        self.assertFalse(checker['ts_keyframe'](video_demuxer(0x24), pes_packet(bytes([1 << 1, 0x01]))))
+        self.assertTrue(checker['ts_keyframe'](video_demuxer(0x02), pes_packet(b'\xb3')))
+        self.assertFalse(checker['ts_keyframe'](video_demuxer(0x02), pes_packet(b'\x00')))
+
+    def test_not_video(self):
+        """ The packets of the PIDs not in the PMT as the video are not the keyframes """
+
+        self.assertFalse(checker['ts_keyframe'](checker['ts_demuxer'](), pes_packet(b'\x65', random_access=True)))
+        self.assertFalse(checker['ts_keyframe'](video_demuxer(0x0f), pes_packet(b'\x65', random_access=True)))
+
+if __name__ == '__main__':
+    unittest.main()